@@ -0,0 +1,132 @@
+import argparse
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select
+
+from database import SQLALCHEMY_DATABASE_URL, DB_PROFILE, ENGINE_PROFILES, create_sqlite_engine, create_schema
+from models import Flight, Booking, SeatMap, WaitlistEntry, ArchivedFlight, ArchivedBooking, FlightStatus
+from services import flight_changed
+
+# Flights moved per transaction, with their bookings and seat maps. A batch
+# of 25 flights (about 500 bookings) holds the write lock for tens of
+# milliseconds; the pause between batches lets bookings and cancellations in.
+ARCHIVE_BATCH = 25
+ARCHIVE_PAUSE = 0.05  # seconds
+
+# Completed flights stay in the hot tables this long after departure
+KEEP_DAYS = 1
+
+ARCHIVE_STATUSES = (FlightStatus.DEPARTED, FlightStatus.ARRIVED, FlightStatus.CANCELLED)
+
+FLIGHT_COLUMNS = [column.name for column in Flight.__table__.columns]
+BOOKING_COLUMNS = [column.name for column in Booking.__table__.columns]
+
+ArchiveReport = namedtuple("ArchiveReport", "flights bookings batches seconds")
+
+
+# Up to batch_size completed flights that departed before the cutoff. The
+# newest flight and the flight holding the newest booking are never taken:
+# SQLite gives new rows max(id) + 1, so keeping the highest ids in the hot
+# tables means an archived id is never handed out again.
+def _completed_flights(cutoff: datetime, batch_size: int, archived_at: datetime):
+    newest_flight = select(func.max(Flight.id)).scalar_subquery()
+    newest_booking = select(func.max(Booking.id)).scalar_subquery()
+    newest_booking_flight = select(Booking.flight_id).where(Booking.id == newest_booking).scalar_subquery()
+    return (
+        select(*(Flight.__table__.c[name] for name in FLIGHT_COLUMNS), literal(archived_at, DateTime))
+        .where(Flight.status.in_(ARCHIVE_STATUSES),
+               Flight.departure_time < cutoff,
+               Flight.id < newest_flight,
+               Flight.id != func.coalesce(newest_booking_flight, 0))
+        .limit(batch_size)
+    )
+
+# Move one batch in the caller's transaction. The first statement is the
+# INSERT, so the write lock is taken (waiting on busy_timeout) before
+# anything is read. Returns the archived flights as rows with the columns
+# flight_changed needs, and the number of bookings moved with them.
+def archive_batch(conn, cutoff: datetime, batch_size: int = ARCHIVE_BATCH, archived_at: datetime = None):
+    archived_at = archived_at or datetime.utcnow()
+    flights = conn.execute(
+        insert(ArchivedFlight)
+        .from_select(FLIGHT_COLUMNS + ["archived_at"], _completed_flights(cutoff, batch_size, archived_at))
+        .returning(ArchivedFlight.id, ArchivedFlight.status, ArchivedFlight.available_seats,
+                   ArchivedFlight.departure_airport, ArchivedFlight.arrival_airport,
+                   ArchivedFlight.departure_time)
+    ).all()
+    if not flights:
+        return flights, 0
+
+    ids = [flight.id for flight in flights]
+    bookings = conn.execute(
+        insert(ArchivedBooking).from_select(
+            BOOKING_COLUMNS + ["archived_at"],
+            select(*(Booking.__table__.c[name] for name in BOOKING_COLUMNS), literal(archived_at, DateTime))
+            .where(Booking.flight_id.in_(ids)))
+    ).rowcount
+    conn.execute(delete(Booking).where(Booking.flight_id.in_(ids)))
+    conn.execute(delete(SeatMap).where(SeatMap.flight_id.in_(ids)))
+    # Nobody can be promoted onto a completed flight any more
+    conn.execute(delete(WaitlistEntry).where(WaitlistEntry.flight_id.in_(ids)))
+    conn.execute(delete(Flight).where(Flight.id.in_(ids)))
+    return flights, bookings
+
+# Archive every completed flight that departed more than keep_days ago, one
+# short transaction per batch, so the hot tables only hold what is still
+# ahead (plus the last keep_days). Safe to run while the app is in use and
+# to stop at any point: each batch is all or nothing.
+def archive_completed(db_url=SQLALCHEMY_DATABASE_URL, keep_days: float = KEEP_DAYS,
+                      batch_size: int = ARCHIVE_BATCH, pause: float = ARCHIVE_PAUSE, max_batches: int = None,
+                      profile=DB_PROFILE, now: datetime = None):
+    engine = create_sqlite_engine(db_url, profile=profile)
+    create_schema(engine)
+    cutoff = (now or datetime.now()) - timedelta(days=keep_days)
+    flights = bookings = batches = 0
+    started = time.perf_counter()
+    try:
+        while max_batches is None or batches < max_batches:
+            with engine.begin() as conn:
+                archived, moved = archive_batch(conn, cutoff, batch_size)
+            if not archived:
+                break
+            for flight in archived:
+                flight_changed(flight)
+            flights += len(archived)
+            bookings += moved
+            batches += 1
+            if len(archived) < batch_size:
+                break
+            time.sleep(pause)
+
+        if flights:
+            # The hot tables just shrank; let SQLite refresh stale statistics
+            with engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA optimize")
+    finally:
+        engine.dispose()
+    return ArchiveReport(flights, bookings, batches, time.perf_counter() - started)
+
+def print_report(report):
+    print(f"Archived {report.flights:,} flights and {report.bookings:,} bookings "
+          f"in {report.batches:,} batches ({report.seconds:.1f}s)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Move completed flights and their bookings to the archive tables.")
+    parser.add_argument("--keep-days", type=float, default=KEEP_DAYS,
+                        help=f"keep completed flights this many days after departure (default {KEEP_DAYS})")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH,
+                        help=f"flights per transaction (default {ARCHIVE_BATCH})")
+    parser.add_argument("--pause-ms", type=float, default=ARCHIVE_PAUSE * 1000,
+                        help=f"pause between batches in ms (default {ARCHIVE_PAUSE * 1000:g})")
+    parser.add_argument("--max-batches", type=int, help="stop after this many batches")
+    parser.add_argument("--profile", choices=ENGINE_PROFILES, default=DB_PROFILE, help="engine profile")
+    parser.add_argument("--db", default=SQLALCHEMY_DATABASE_URL, help="database URL")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print_report(archive_completed(args.db, args.keep_days, args.batch_size, args.pause_ms / 1000,
+                                   args.max_batches, args.profile))
@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import services
+from database import DB_PATH, DB_PROFILE, ENGINE_PROFILES, install_sqlite_pragmas, profile_settings
+from models import Flight, Passenger, FlightClass, BOOKABLE_STATUSES
+
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+
+
+# Async counterpart of database.create_sqlite_engine: same profiles, same
+# pragmas, with the pool bounding how many aiosqlite connections are open
+def create_async_sqlite_engine(url=ASYNC_DATABASE_URL, profile=DB_PROFILE, **overrides):
+    settings = profile_settings(profile, **overrides)
+    engine = create_async_engine(url, pool_size=settings["pool_size"], max_overflow=settings["max_overflow"])
+    install_sqlite_pragmas(engine.sync_engine, settings)
+    return engine
+
+
+# Async front end of the service layer. Each call gets its own AsyncSession
+# and runs the synchronous service function through run_sync, so the rules
+# live in one place (services.py) and both front ends share them. A
+# semaphore caps sessions in flight at the pool size: extra requests wait in
+# the event loop instead of queueing on the pool's checkout timeout.
+class AsyncBookingService:
+    def __init__(self, engine=None, profile=DB_PROFILE, max_sessions=None):
+        self.engine = engine or create_async_sqlite_engine(profile=profile)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False, autoflush=False)
+        self.max_sessions = max_sessions or ENGINE_PROFILES[profile]["pool_size"]
+        self._slots = asyncio.Semaphore(self.max_sessions)
+        self.open_connections = 0
+        self.peak_connections = 0
+        event.listen(self.engine.sync_engine, "checkout", self._on_checkout)
+        event.listen(self.engine.sync_engine, "checkin", self._on_checkin)
+
+    def _on_checkout(self, *args):
+        self.open_connections += 1
+        self.peak_connections = max(self.peak_connections, self.open_connections)
+
+    def _on_checkin(self, *args):
+        self.open_connections -= 1
+
+    async def _run(self, fn, *args, **kwargs):
+        async with self._slots:
+            async with self.sessions() as session:
+                return await session.run_sync(fn, *args, **kwargs)
+
+    async def search_flights(self, departure: str = None, arrival: str = None, day=None):
+        return await self._run(services.search_flight_rows, departure, arrival, day)
+
+    async def flights_page(self, after=None, limit: int = services.PAGE_SIZE, bookable: bool = False):
+        return await self._run(services.flights_page, after, limit, bookable)
+
+    async def bookings_page(self, ref_or_email: str = None, after=None, limit: int = services.PAGE_SIZE):
+        return await self._run(services.bookings_page, ref_or_email, after, limit)
+
+    async def create_flight(self, *args, **kwargs):
+        return await self._run(services.create_flight, *args, **kwargs)
+
+    async def create_passenger(self, *args, **kwargs):
+        return await self._run(services.create_passenger, *args, **kwargs)
+
+    async def create_booking(self, *args, **kwargs):
+        return await self._run(services.create_booking, *args, **kwargs)
+
+    async def book_group(self, flight_id: int, flight_class: FlightClass, passengers):
+        return await self._run(services.book_group, flight_id, flight_class, passengers)
+
+    async def cancel_booking(self, booking_reference: str):
+        return await self._run(services.cancel_reservation, booking_reference)
+
+    async def close(self):
+        await self.engine.dispose()
+
+
+# Load demo: fire a batch of concurrent searches and bookings at one service
+# and report throughput and how many connections were ever open at once
+async def load_test(requests: int, book_share: float, random_seed: int, profile: str):
+    service = AsyncBookingService(profile=profile)
+    rng = random.Random(random_seed)
+    try:
+        async with service.sessions() as session:
+            flights = (await session.execute(
+                select(Flight.id, Flight.departure_airport, Flight.arrival_airport, Flight.departure_time)
+                .where(Flight.status.in_(BOOKABLE_STATUSES), Flight.available_seats > 0)
+                .limit(500))).all()
+            emails = (await session.scalars(select(Passenger.email).order_by(func.random()).limit(500))).all()
+        if not flights or not emails:
+            print("Need scheduled flights and passengers; seed the database first (see seed_demo.py).")
+            return
+
+        async def one_request():
+            flight = rng.choice(flights)
+            if rng.random() < book_share:
+                result = await service.create_booking(flight.id, rng.choice(list(FlightClass)), rng.choice(emails))
+                return "book_ok" if result.ok else f"book_{result.status}"
+            await service.search_flights(flight.departure_airport, flight.arrival_airport, flight.departure_time)
+            return "search"
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(one_request() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+
+        counts = {}
+        for outcome in outcomes:
+            counts[outcome] = counts.get(outcome, 0) + 1
+        print(f"{requests} concurrent requests in {elapsed:.2f}s ({requests / elapsed:.0f} req/s)")
+        for outcome, count in sorted(counts.items()):
+            print(f"  {outcome:<20} {count}")
+        print(f"Peak open connections: {service.peak_connections} (session limit {service.max_sessions})")
+    finally:
+        await service.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent search/booking load against the async service.")
+    parser.add_argument("--requests", type=int, default=5000, help="number of concurrent requests (default 5000)")
+    parser.add_argument("--book-share", type=float, default=0.2, help="fraction of requests that book (default 0.2)")
+    parser.add_argument("--seed", type=int, default=int(datetime.now().timestamp()), help="random seed")
+    parser.add_argument("--profile", choices=ENGINE_PROFILES, default=DB_PROFILE, help="engine profile")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(load_test(args.requests, args.book_share, args.seed, args.profile))
@@ -0,0 +1,514 @@
+import argparse
+import enum
+import json
+import multiprocessing
+import queue
+import random
+import sys
+import time
+from collections import Counter, defaultdict, namedtuple
+from datetime import date, datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import SQLALCHEMY_DATABASE_URL, DB_PROFILE, ENGINE_PROFILES, create_sqlite_engine, create_schema
+from models import Flight, Booking, FlightClass, FlightStatus
+from services import (create_booking, cancel_reservation, search_flight_rows, flights_page, bookings_page,
+                      iter_flights, iter_booking_rows, PAGE_SIZE)
+from importers import import_flights, import_passengers
+from sampling import percentile, sample_inputs
+
+# Operations handed to a replay worker at a time, and chunks queued ahead
+# per worker; the stream is read as the workers go, never all at once
+REPLAY_CHUNK = 50
+QUEUE_CHUNKS = 4
+
+# Seconds a replay waits on a queue before checking its workers are alive
+QUEUE_POLL = 1.0
+
+# Refusals caused by what other operations did to the same rows, as opposed
+# to errors in the request itself. "busy" is a write lock not obtained
+# within busy_timeout.
+CONFLICT_STATUSES = {"sold_out", "seat_unavailable", "already_cancelled", "duplicate", "not_bookable", "archived",
+                     "busy"}
+
+# A replayed cancel with no reference when its worker has no bookings left to
+# undo; neither an error nor a conflict
+SKIPPED = "skipped"
+
+# Default operation mix of a generated workload, in percent
+WORKLOAD_MIX = {"search": 40, "book": 30, "cancel": 20, "list": 10}
+
+# Mismatches listed in the consistency check; the count covers all of them
+MISMATCHES_SHOWN = 20
+
+ReplayReport = namedtuple("ReplayReport",
+                          "operations workers seconds latency statuses errors conflicts consistency lost_workers")
+Consistency = namedtuple("Consistency", "flights mismatched examples")
+
+
+# JSON for values the service layer returns: times as ISO 8601, enums by name
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.name
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def to_json(value, indent=None):
+    return json.dumps(value, default=_plain, indent=indent)
+
+def _columns(obj):
+    return {column.name: getattr(obj, column.name) for column in obj.__table__.columns}
+
+def _result(result, **data):
+    return {"ok": result.ok, "status": result.status, "message": result.message, **data}
+
+def _after(value):
+    if value is None:
+        return None
+    key, row_id = value
+    return datetime.fromisoformat(key), int(row_id)
+
+def _flight_id(db: Session, op):
+    if op.get("flight_id") is not None:
+        return int(op["flight_id"])
+    return db.scalar(select(Flight.id).where(Flight.flight_number == op["flight_number"]))
+
+
+# The operations, shared by the subcommands and the replay workers. Each takes
+# a session and the operation as a dict with the fields of its JSONL form,
+# and returns a JSON-ready dict with at least ok and status.
+
+def run_search(db: Session, op):
+    day = date.fromisoformat(op["date"]) if op.get("date") else None
+    rows = search_flight_rows(db, (op.get("departure") or "").upper() or None,
+                              (op.get("arrival") or "").upper() or None, day)
+    return {"ok": True, "status": "found", "count": len(rows), "flights": [row._asdict() for row in rows]}
+
+def run_book(db: Session, op):
+    flight_id = _flight_id(db, op)
+    if flight_id is None:
+        return {"ok": False, "status": "not_found", "message": "Flight not found."}
+    dob = op.get("date_of_birth")
+    result = create_booking(db, flight_id, FlightClass[op.get("flight_class", "ECONOMY").upper()], op["email"],
+                            op.get("first_name"), op.get("last_name"), op.get("phone"), op.get("passport_number"),
+                            date.fromisoformat(dob) if dob else None, op.get("seat_number"))
+    if not result.ok:
+        return _result(result)
+    return _result(result, booking=_columns(result.value))
+
+def run_cancel(db: Session, op):
+    return _result(cancel_reservation(db, op["reference"]), reference=op["reference"])
+
+def run_list(db: Session, op):
+    limit = int(op.get("limit", PAGE_SIZE))
+    if op.get("what", "bookings") == "flights":
+        flights, after = flights_page(db, _after(op.get("after")), limit, bool(op.get("bookable")))
+        rows = [_columns(flight) for flight in flights]
+    else:
+        bookings, after = bookings_page(db, op.get("query"), _after(op.get("after")), limit)
+        rows = [row._asdict() for row in bookings]
+    return {"ok": True, "status": "listed", "count": len(rows), "rows": rows, "next": after}
+
+# Every row of a listing, as JSON-ready dicts, streamed in chunks instead of
+# paged; for exports too large to hold in memory
+def stream_list(db: Session, op):
+    if op.get("what", "bookings") == "flights":
+        return (_columns(flight) for flight in iter_flights(db, bookable=bool(op.get("bookable"))))
+    return (row._asdict() for row in iter_booking_rows(db, op.get("query")))
+
+# Imports run through importers.py, on their own engine for the session's database
+def run_import(db: Session, op):
+    db_url = db.get_bind().url.render_as_string(hide_password=False)
+    if op["kind"] == "flights":
+        report = import_flights(op["path"], db_url, op.get("format"))
+    elif op["kind"] == "passengers":
+        report = import_passengers(op["path"], db_url, op.get("format"))
+    else:
+        return {"ok": False, "status": "invalid", "message": f"Unknown import kind {op['kind']!r}."}
+    return {"ok": True, "status": "imported", **report._asdict()}
+
+OPERATIONS = {
+    "search": run_search,
+    "book": run_book,
+    "cancel": run_cancel,
+    "list": run_list,
+    "import": run_import,
+}
+
+# Run one operation; a malformed one comes back as status "invalid" rather
+# than raising. Database errors propagate.
+def execute(db: Session, op):
+    run = OPERATIONS.get(op.get("op")) if isinstance(op, dict) else None
+    if run is None:
+        return {"ok": False, "status": "invalid", "message": f"Unknown operation {op!r}."}
+    try:
+        return run(db, op)
+    except (KeyError, ValueError, TypeError) as e:
+        db.rollback()
+        return {"ok": False, "status": "invalid", "message": f"Bad {op['op']} operation: {e!r}"}
+
+
+# Flights whose counter disagrees with their bookings: available_seats must
+# be total_seats minus the active bookings. Cancelled flights are left out,
+# since cancelling a flight cancels its bookings without giving seats back.
+def check_seat_counts(db: Session, shown: int = MISMATCHES_SHOWN):
+    active = (
+        select(Booking.flight_id, func.count().label("active"))
+        .where(Booking.is_cancelled == False)  # noqa: E712
+        .group_by(Booking.flight_id)
+        .subquery()
+    )
+    sold = func.coalesce(active.c.active, 0)
+    mismatched = (
+        select(Flight.flight_number, Flight.total_seats, Flight.available_seats, sold.label("active"))
+        .outerjoin(active, active.c.flight_id == Flight.id)
+        .where(Flight.status != FlightStatus.CANCELLED, Flight.available_seats != Flight.total_seats - sold)
+    )
+    rows = db.execute(mismatched).all()
+    flights = db.scalar(select(func.count()).select_from(Flight).where(Flight.status != FlightStatus.CANCELLED))
+    return Consistency(flights, len(rows), [row._asdict() for row in rows[:shown]])
+
+
+def _replay_one(sessions, op, booked):
+    # A cancel without a reference undoes one of this worker's own bookings
+    if isinstance(op, dict) and op.get("op") == "cancel" and not op.get("reference"):
+        if not booked:
+            return {"ok": False, "status": SKIPPED}
+        op = {**op, "reference": booked.pop()}
+    try:
+        with sessions() as db:
+            result = execute(db, op)
+    except OperationalError as e:
+        locked = "locked" in str(e.orig) or "busy" in str(e.orig)
+        return {"ok": False, "status": "busy" if locked else "error", "message": str(e.orig)}
+    except Exception as e:
+        return {"ok": False, "status": "error", "message": repr(e)}
+    if result["ok"] and "booking" in result:
+        booked.append(result["booking"]["booking_reference"])
+    return result
+
+def _is_error(result):
+    return not result["ok"] and result["status"] not in CONFLICT_STATUSES and result["status"] != SKIPPED
+
+# Worker process: its own engine and pool, operations taken a chunk at a
+# time until None. Sends back its latencies (ms), status counts per
+# operation, its error count and a few error messages.
+def _replay_worker(db_url, profile, tasks, results):
+    engine = create_sqlite_engine(db_url, profile=profile)
+    # One operation per session, so results stay readable after its commit
+    sessions = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    latencies = defaultdict(list)
+    statuses = Counter()
+    errors = []
+    error_count = 0
+    booked = []
+    results.put("ready")
+    try:
+        while True:
+            chunk = tasks.get()
+            if chunk is None:
+                break
+            for op in chunk:
+                name = op.get("op", "?") if isinstance(op, dict) else "?"
+                started = time.perf_counter()
+                result = _replay_one(sessions, op, booked)
+                latencies[name].append((time.perf_counter() - started) * 1000)
+                statuses[name, result["status"]] += 1
+                if _is_error(result):
+                    error_count += 1
+                    if len(errors) < MISMATCHES_SHOWN:
+                        errors.append(f"{name} {result['status']}: {result.get('message')}")
+    finally:
+        engine.dispose()
+        results.put((dict(latencies), statuses, error_count, errors))
+
+def _read_operations(lines):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield {"op": "?", "line": line}
+
+def _exited(processes):
+    return [process for process in processes if process.exitcode is not None]
+
+def _running(processes):
+    return any(process.is_alive() for process in processes)
+
+# Queue a chunk for the workers, waiting while the queue is full. Returns
+# False without queueing it once running() is false, so a dead worker cannot
+# leave the replay blocked on a queue nobody reads.
+def _put(tasks, chunk, running):
+    while running():
+        try:
+            tasks.put(chunk, timeout=QUEUE_POLL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+# The reports of the workers that finish; a worker that died sends none.
+# Stops once every worker has exited and nothing more arrives.
+def _collect(results, processes):
+    collected = []
+    while len(collected) < len(processes):
+        try:
+            report = results.get(timeout=QUEUE_POLL)
+        except queue.Empty:
+            if _running(processes):
+                continue
+            # What a worker sent before exiting is in the pipe by now
+            try:
+                report = results.get(timeout=QUEUE_POLL)
+            except queue.Empty:
+                break
+        if report != "ready":
+            collected.append(report)
+    return collected
+
+# Replay a JSONL stream of operations against one database from a pool of
+# worker processes, then check the seat counters. Throughput is measured
+# from when every worker is ready until the last operation is done. A worker
+# that dies stops the replay: the rest of the stream is not sent, the
+# operations it was running are missing from the counts, and it is reported
+# in lost_workers and as an error.
+def replay(lines, db_url=SQLALCHEMY_DATABASE_URL, workers: int = 4, profile=DB_PROFILE):
+    engine = create_sqlite_engine(db_url, profile=profile)
+    create_schema(engine)
+    engine.dispose()
+
+    context = multiprocessing.get_context("spawn")
+    tasks = context.Queue(maxsize=workers * QUEUE_CHUNKS)
+    results = context.Queue()
+    processes = [context.Process(target=_replay_worker, args=(db_url, profile, tasks, results), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    ready = 0
+    while ready < len(processes) and not _exited(processes):
+        try:
+            results.get(timeout=QUEUE_POLL)
+            ready += 1
+        except queue.Empty:
+            pass
+
+    started = time.perf_counter()
+    chunk = []
+    for op in _read_operations(lines):
+        chunk.append(op)
+        if len(chunk) == REPLAY_CHUNK:
+            if not _put(tasks, chunk, lambda: not _exited(processes)):
+                break
+            chunk = []
+    else:
+        if chunk:
+            _put(tasks, chunk, lambda: not _exited(processes))
+    for _ in processes:
+        if not _put(tasks, None, lambda: _running(processes)):
+            break
+    collected = _collect(results, processes)
+    seconds = time.perf_counter() - started
+    for process in processes:
+        process.join(timeout=QUEUE_POLL)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+    latencies = defaultdict(list)
+    statuses = Counter()
+    errors = []
+    error_count = 0
+    for worker_latencies, worker_statuses, worker_error_count, worker_errors in collected:
+        for name, values in worker_latencies.items():
+            latencies[name] += values
+        statuses.update(worker_statuses)
+        error_count += worker_error_count
+        errors += worker_errors
+    lost = len(processes) - len(collected)
+    if lost:
+        error_count += lost
+        exit_codes = ", ".join(str(process.exitcode) for process in processes if process.exitcode)
+        errors.insert(0, f"{lost} of {workers} workers died (exit code {exit_codes or 'unknown'}); "
+                         f"their operations are missing and the rest of the stream was not replayed")
+
+    latency = {}
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        latency[name] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "max_ms": round(values[-1], 3),
+        }
+    by_operation = defaultdict(dict)
+    for (name, status), count in sorted(statuses.items()):
+        by_operation[name][status] = count
+
+    engine = create_sqlite_engine(db_url, profile=profile)
+    try:
+        with Session(engine) as db:
+            consistency = check_seat_counts(db)
+    finally:
+        engine.dispose()
+    conflicts = sum(count for (_, status), count in statuses.items() if status in CONFLICT_STATUSES)
+    return ReplayReport(sum(statuses.values()), workers, seconds, latency, dict(by_operation),
+                        {"count": error_count, "examples": errors}, conflicts, consistency, lost)
+
+def print_replay_report(report):
+    rate = report.operations / report.seconds if report.seconds else 0.0
+    print(f"Replayed {report.operations:,} operations with {report.workers} workers "
+          f"in {report.seconds:.1f}s ({rate:,.0f} ops/s)")
+    for name, stats in report.latency.items():
+        outcomes = ", ".join(f"{status} {count:,}" for status, count in report.statuses[name].items())
+        print(f"  {name:<8} {stats['count']:>8,} ops  p50 {stats['p50_ms']:>8.3f} ms  p95 {stats['p95_ms']:>8.3f} ms  "
+              f"p99 {stats['p99_ms']:>8.3f} ms  max {stats['max_ms']:>8.3f} ms  ({outcomes})")
+    print(f"Errors: {report.errors['count']:,}, conflicts: {report.conflicts:,}")
+    if report.lost_workers:
+        print(f"Replay INCOMPLETE: {report.lost_workers} of {report.workers} workers died")
+    for message in report.errors["examples"]:
+        print(f"  {message}")
+    consistency = report.consistency
+    if consistency.mismatched:
+        print(f"Consistency check FAILED: {consistency.mismatched:,} of {consistency.flights:,} flights have "
+              f"available_seats != total_seats - active bookings")
+        for row in consistency.examples:
+            print(f"  {row['flight_number']}: {row['available_seats']} available, {row['total_seats']} seats, "
+                  f"{row['active']} active bookings")
+    else:
+        print(f"Consistency check passed: seat counters match active bookings on all {consistency.flights:,} flights")
+
+# A JSONL workload over the database's own data: searches and bookings on
+# sampled flights, booking lookups, and cancels that undo the worker's own
+# bookings. mix maps operation to weight.
+def generate_workload(db: Session, count: int, mix=WORKLOAD_MIX, random_seed: int = 42):
+    rng = random.Random(random_seed)
+    inputs = sample_inputs(db, rng)
+    emails = [lookup for lookup in inputs["lookups"] if "@" in lookup]
+    names, weights = zip(*mix.items())
+    for _ in range(count):
+        name = rng.choices(names, weights)[0]
+        flight = rng.choice(inputs["flights"])
+        if name == "search":
+            yield {"op": "search", "departure": flight.departure_airport, "arrival": flight.arrival_airport,
+                   "date": flight.departure_time.date().isoformat()}
+        elif name == "book":
+            yield {"op": "book", "flight_id": rng.choice(inputs["bookable"]),
+                   "flight_class": rng.choice(list(FlightClass)).name, "email": rng.choice(emails)}
+        elif name == "cancel":
+            yield {"op": "cancel"}
+        else:
+            yield {"op": "list", "what": "bookings", "query": rng.choice(inputs["lookups"])}
+
+def _mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in WORKLOAD_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}")
+        mix[name] = float(weight)
+    return mix
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py",
+                                     description="Run one operation and print the result as JSON, or replay a "
+                                                 "JSONL workload. Without a command, main.py runs the menu.")
+    parser.add_argument("--profile", choices=ENGINE_PROFILES, default=DB_PROFILE, help="engine profile")
+    parser.add_argument("--db", default=SQLALCHEMY_DATABASE_URL, help="database URL")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="search flights")
+    search.add_argument("--from", dest="departure", help="departure airport")
+    search.add_argument("--to", dest="arrival", help="arrival airport")
+    search.add_argument("--date", help="departure date, YYYY-MM-DD")
+
+    book = commands.add_parser("book", help="book a seat")
+    book.add_argument("flight", help="flight id or flight number")
+    book.add_argument("--email", required=True, help="passenger email; new passengers need the details below")
+    book.add_argument("--class", dest="flight_class", default="ECONOMY",
+                      choices=[cls.name for cls in FlightClass], help="cabin class (default ECONOMY)")
+    book.add_argument("--seat", dest="seat_number", help="seat, e.g. E12 (default any)")
+    book.add_argument("--first-name")
+    book.add_argument("--last-name")
+    book.add_argument("--phone")
+    book.add_argument("--passport", dest="passport_number")
+    book.add_argument("--dob", dest="date_of_birth", help="date of birth, YYYY-MM-DD")
+
+    cancel = commands.add_parser("cancel", help="cancel a booking")
+    cancel.add_argument("reference", help="booking reference")
+
+    listing = commands.add_parser("list", help="list bookings or flights, one page at a time")
+    listing.add_argument("what", choices=("bookings", "flights"))
+    listing.add_argument("--query", help="booking reference or passenger email (bookings)")
+    listing.add_argument("--bookable", action="store_true", help="only flights that can be booked (flights)")
+    listing.add_argument("--after", type=json.loads, help="the \"next\" value of the previous page, as JSON")
+    listing.add_argument("--limit", type=int, default=PAGE_SIZE, help=f"rows per page (default {PAGE_SIZE})")
+    listing.add_argument("--all", action="store_true", help="print every row as one JSON line, read in chunks")
+
+    importing = commands.add_parser("import", help="import a flight schedule or passenger file")
+    importing.add_argument("kind", choices=("flights", "passengers"))
+    importing.add_argument("path", help="CSV or JSONL file")
+    importing.add_argument("--format", choices=("csv", "jsonl"), help="file format (default: from the extension)")
+
+    replaying = commands.add_parser("replay", help="replay a JSONL stream of operations from worker processes")
+    replaying.add_argument("path", help="JSONL file, or - for standard input")
+    replaying.add_argument("--workers", type=int, default=4, help="worker processes (default 4)")
+    replaying.add_argument("--json", action="store_true", help="print the report as JSON")
+
+    workload = commands.add_parser("workload", help="write a JSONL workload sampled from the database")
+    workload.add_argument("--ops", type=int, default=10_000, help="number of operations (default 10000)")
+    workload.add_argument("--mix", type=_mix, default=WORKLOAD_MIX,
+                          help="weights, e.g. search=40,book=30,cancel=20,list=10 (the default)")
+    workload.add_argument("--seed", type=int, default=42, help="random seed (default 42)")
+    return parser.parse_args(argv)
+
+# Returns the exit status: 0 when the operation succeeded (or the replay ran
+# to the end and left every seat counter consistent), 1 otherwise
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "replay":
+        if args.path == "-":
+            report = replay(sys.stdin, args.db, args.workers, args.profile)
+        else:
+            with open(args.path) as lines:
+                report = replay(lines, args.db, args.workers, args.profile)
+        if args.json:
+            print(to_json({**report._asdict(), "consistency": report.consistency._asdict()}, indent=2))
+        else:
+            print_replay_report(report)
+        return 1 if report.consistency.mismatched or report.lost_workers else 0
+
+    engine = create_sqlite_engine(args.db, profile=args.profile)
+    create_schema(engine)
+    try:
+        with Session(engine, autoflush=False, expire_on_commit=False) as db:
+            if args.command == "workload":
+                for op in generate_workload(db, args.ops, args.mix, args.seed):
+                    print(to_json(op))
+                return 0
+            if args.command == "list" and args.all:
+                for row in stream_list(db, vars(args)):
+                    print(to_json(row))
+                return 0
+            op = {key: value for key, value in vars(args).items()
+                  if key not in ("profile", "db", "command") and value is not None}
+            op["op"] = args.command
+            if args.command == "book":
+                flight = op.pop("flight")
+                op["flight_id" if flight.isdigit() else "flight_number"] = flight
+            result = execute(db, op)
+    finally:
+        engine.dispose()
+    print(to_json(result, indent=2))
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
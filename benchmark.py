@@ -0,0 +1,320 @@
+import argparse
+import json
+import os
+import random
+import threading
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import sessionmaker
+
+from database import create_sqlite_engine, create_schema, DB_PROFILE, ENGINE_PROFILES
+from models import Flight, Passenger, FlightClass, BOOKABLE_STATUSES
+from seed_demo import SCALES, seed_scale
+from search_cache import flight_search_cache
+from instrumentation import instrumentation
+from sampling import percentile, sample_inputs
+from booking_pipeline import BookingPipeline, BATCH_SIZE, MAX_WAIT
+from services import find_flights, search_flight_rows, book_seat, cancel_seat, bookings_page, flights_page
+
+# Seeded databases are built once per tier and reused; the reference date is
+# fixed so every machine benchmarks the same rows
+DATA_DIR = os.path.join(tempfile.gettempdir(), "flight_bench")
+SEED_NOW = datetime(2026, 1, 1)
+
+# Operations in run order; cancel undoes the bookings made by book
+OPERATIONS = ("search", "search_cached", "view_flights", "view_bookings", "book", "cancel")
+
+
+# Counts statements sent to the database, to report queries per operation
+class StatementCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+def build_operations(inputs):
+    def search(db, rng):
+        flight = rng.choice(inputs["flights"])
+        return find_flights(db, flight.departure_airport, flight.arrival_airport, flight.departure_time).all()
+
+    # Repeated searches over a small hot set of routes, as in production traffic
+    hot_flights = inputs["flights"][:200]
+
+    def search_cached(db, rng):
+        flight = rng.choice(hot_flights)
+        return search_flight_rows(db, flight.departure_airport, flight.arrival_airport, flight.departure_time)
+
+    def view_flights(db, rng):
+        flight = rng.choice(inputs["flights"])
+        return flights_page(db, after=(flight.departure_time, flight.id))
+
+    def view_bookings(db, rng):
+        return bookings_page(db, rng.choice(inputs["lookups"]))
+
+    def book(db, rng):
+        flight_class = rng.choice(list(FlightClass))
+        booking = book_seat(db, rng.choice(inputs["bookable"]), rng.randint(1, inputs["passenger_count"]), flight_class)
+        if booking is not None:
+            inputs["booked"].append(booking.booking_reference)
+        return booking
+
+    def cancel(db, rng):
+        if inputs["booked"]:
+            return cancel_seat(db, inputs["booked"].pop())
+        return False
+
+    return {
+        "search": search,
+        "search_cached": search_cached,
+        "view_flights": view_flights,
+        "view_bookings": view_bookings,
+        "book": book,
+        "cancel": cancel,
+    }
+
+def run_operation(db, counter, operation, iterations, warmup, rng):
+    for _ in range(warmup):
+        operation(db, rng)
+        db.expunge_all()
+
+    latencies = []
+    statements = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        before = counter.count
+        t = time.perf_counter()
+        operation(db, rng)
+        latencies.append(time.perf_counter() - t)
+        statements += counter.count - before
+        db.expunge_all()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "ops_per_sec": round(iterations / elapsed, 1),
+        "statements_per_op": round(statements / iterations, 2),
+    }
+
+# Seed the tier once, then benchmark a throwaway copy so book/cancel never
+# change the reference database
+def prepare_database(scale, data_dir, random_seed):
+    os.makedirs(data_dir, exist_ok=True)
+    base = os.path.join(data_dir, f"{scale}-seed{random_seed}.db")
+    if not os.path.exists(base):
+        flights, passengers, bookings = SCALES[scale]
+        seed_scale(f"sqlite:///{base}", flights, passengers, bookings, random_seed=random_seed, now=SEED_NOW)
+
+    work = os.path.join(data_dir, f"{scale}-run.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.copyfile(base, work)
+    # A cached seed may predate tables or indexes added since
+    engine = create_sqlite_engine(f"sqlite:///{work}", profile="throughput")
+    create_schema(engine)
+    engine.dispose()
+    return work
+
+def benchmark_scale(scale, profile, iterations, warmup, data_dir, random_seed, instrument=False):
+    path = prepare_database(scale, data_dir, random_seed)
+    engine = create_sqlite_engine(f"sqlite:///{path}", profile=profile)
+    counter = StatementCounter(engine)
+    if instrument:
+        instrumentation.reset()
+        instrumentation.install(engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    rng = random.Random(random_seed)
+    flight_search_cache.clear()
+    try:
+        operations = build_operations(sample_inputs(db, rng))
+        results = {}
+        for name in OPERATIONS:
+            results[name] = run_operation(db, counter, operations[name], iterations, warmup, rng)
+            print(f"  {name:<14} p50 {results[name]['p50_ms']:>9.3f} ms  p95 {results[name]['p95_ms']:>9.3f} ms  "
+                  f"{results[name]['ops_per_sec']:>9.1f} ops/s  {results[name]['statements_per_op']:>5.2f} stmts/op")
+        print(f"  search cache: {flight_search_cache.stats()}")
+        if instrument:
+            print(instrumentation.export())
+        return results
+    finally:
+        instrumentation.uninstall()
+        db.close()
+        engine.dispose()
+
+# Group commit (booking_pipeline.py) against one commit per booking: every
+# worker thread books a seat and then cancels it, either directly through
+# book_seat/cancel_seat (one transaction each) or through a pipeline
+def _commit_ops(mode, pipeline, flight_ids, passenger_count):
+    def book(db, rng):
+        flight_id = rng.choice(flight_ids)
+        passenger_id = rng.randint(1, passenger_count)
+        flight_class = rng.choice(list(FlightClass))
+        if mode == "direct":
+            booking = book_seat(db, flight_id, passenger_id, flight_class)
+            return booking.booking_reference if booking is not None else None
+        result = pipeline.book(flight_id, passenger_id, flight_class)
+        return result.value.booking_reference if result.ok else None
+
+    def cancel(db, reference):
+        if mode == "direct":
+            return cancel_seat(db, reference)
+        return pipeline.cancel(reference).ok
+
+    return book, cancel
+
+def run_commit_mode(mode, sessions, flight_ids, passenger_count, threads, requests, random_seed,
+                    batch_size=BATCH_SIZE, max_wait=MAX_WAIT):
+    pipeline = BookingPipeline(sessions, batch_size, max_wait) if mode == "pipeline" else None
+    book, cancel = _commit_ops(mode, pipeline, flight_ids, passenger_count)
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(n):
+        rng = random.Random(random_seed + n)
+        timings = []
+        with sessions() as db:
+            for i in range(requests // threads // 2):
+                t = time.perf_counter()
+                reference = book(db, rng)
+                timings.append(time.perf_counter() - t)
+                if reference:
+                    t = time.perf_counter()
+                    cancel(db, reference)
+                    timings.append(time.perf_counter() - t)
+        with lock:
+            latencies.extend(timings)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if pipeline is not None:
+        pipeline.close()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "ops_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_batch": pipeline.stats()["mean_batch"] if pipeline is not None else 1.0,
+    }
+
+def compare_group_commit(scale, profile, threads, requests, batch_sizes, max_wait, data_dir, random_seed):
+    path = prepare_database(scale, data_dir, random_seed)
+    bench_engine = create_sqlite_engine(f"sqlite:///{path}", profile=profile)
+    sessions = sessionmaker(bind=bench_engine, autoflush=False, expire_on_commit=False)
+    try:
+        with sessions() as db:
+            flight_ids = db.scalars(select(Flight.id).where(Flight.status.in_(BOOKABLE_STATUSES),
+                                                            Flight.available_seats > 0).limit(2000)).all()
+            passenger_count = db.scalar(select(func.max(Passenger.id)))
+
+        print(f"{scale} ({profile} profile), {threads} threads, {requests} requests")
+        modes = [("direct", 1)] + [("pipeline", size) for size in batch_sizes]
+        for mode, size in modes:
+            stats = run_commit_mode(mode, sessions, flight_ids, passenger_count, threads, requests, random_seed,
+                                    size, max_wait)
+            label = "one commit each" if mode == "direct" else f"batch {size}, wait {max_wait * 1000:g} ms"
+            print(f"  {label:<26} {stats['ops_per_sec']:>9.1f} ops/s  p50 {stats['p50_ms']:>8.3f} ms  "
+                  f"p95 {stats['p95_ms']:>8.3f} ms  p99 {stats['p99_ms']:>8.3f} ms  mean batch {stats['mean_batch']}")
+    finally:
+        bench_engine.dispose()
+
+# Operations that got slower than the baseline by more than threshold (a
+# fraction), or that now issue more statements
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for scale, operations in results["results"].items():
+        for name, current in operations.items():
+            previous = baseline.get("results", {}).get(scale, {}).get(name)
+            if not previous:
+                continue
+            if current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+                regressions.append(f"{scale}/{name}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+            if current["statements_per_op"] > previous["statements_per_op"]:
+                regressions.append(f"{scale}/{name}: statements/op {previous['statements_per_op']} -> "
+                                   f"{current['statements_per_op']}")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark search, book, cancel and listing operations.")
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=["small"], help="data tiers to run (default small)")
+    parser.add_argument("--profile", choices=ENGINE_PROFILES, default=DB_PROFILE, help="engine profile")
+    parser.add_argument("--iterations", type=int, default=500, help="timed calls per operation (default 500)")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed calls per operation (default 20)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for data and inputs (default 42)")
+    parser.add_argument("--data-dir", default=DATA_DIR, help=f"where seeded databases are kept (default {DATA_DIR})")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    parser.add_argument("--instrument", action="store_true",
+                        help="run with the instrumentation layer on, to measure its overhead")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed p95 slowdown against the baseline, as a fraction (default 0.2)")
+    parser.add_argument("--group-commit", action="store_true",
+                        help="instead, compare group-committed bookings with one commit per booking")
+    parser.add_argument("--threads", type=int, default=32, help="concurrent callers (--group-commit, default 32)")
+    parser.add_argument("--requests", type=int, default=4000,
+                        help="bookings plus cancels per mode (--group-commit, default 4000)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32, BATCH_SIZE],
+                        help=f"pipeline batch sizes to try (--group-commit, default 8 32 {BATCH_SIZE})")
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT * 1000,
+                        help=f"pipeline max wait in ms (--group-commit, default {MAX_WAIT * 1000:g})")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.group_commit:
+        for scale in args.scales:
+            compare_group_commit(scale, args.profile, args.threads, args.requests, args.batch_sizes,
+                                 args.max_wait / 1000, args.data_dir, args.seed)
+        return 0
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "profile": args.profile,
+        "iterations": args.iterations,
+        "seed": args.seed,
+        "instrumented": args.instrument,
+        "results": {},
+    }
+    for scale in args.scales:
+        print(f"{scale} ({args.profile} profile)")
+        results["results"][scale] = benchmark_scale(scale, args.profile, args.iterations, args.warmup,
+                                                    args.data_dir, args.seed, args.instrument)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.threshold)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
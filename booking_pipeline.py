@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from sqlalchemy.orm import sessionmaker
+
+from database import engine
+from models import FlightClass
+from services import Result, add_booking, remove_booking, booking_failure, cancel_failure, flight_changed
+
+# Defaults: commit after 64 requests, or 5 ms after the first one arrived
+BATCH_SIZE = 64
+MAX_WAIT = 0.005  # seconds
+
+Request = namedtuple("Request", "kind args future")
+
+
+# Group commit for bookings and cancellations. Callers queue requests and get
+# a Future back; one writer thread drains the queue in micro-batches and
+# applies each batch in a single transaction, so a burst of N bookings costs
+# one commit (one fsync) instead of N. Each request still succeeds or fails
+# on its own: a sold-out flight leaves nothing behind in the batch, and if
+# the batch itself fails every request in it is retried in its own
+# transaction.
+class BookingPipeline:
+    def __init__(self, session_factory=None, batch_size: int = BATCH_SIZE, max_wait: float = MAX_WAIT):
+        if batch_size < 1 or max_wait < 0:
+            raise ValueError("batch_size must be at least 1 and max_wait cannot be negative")
+        self.session_factory = session_factory or sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.requests = 0
+        self.retried_batches = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="booking-pipeline", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Queue a booking; the Future resolves to a services.Result whose value
+    # is the Booking (detached, with its reference and seat filled in)
+    def submit_booking(self, flight_id: int, passenger_id: int, flight_class: FlightClass,
+                       seat_number: str = None):
+        return self._submit("book", (flight_id, passenger_id, flight_class, seat_number))
+
+    # Queue a cancellation; the Future resolves to a services.Result
+    def submit_cancel(self, booking_reference: str):
+        return self._submit("cancel", (booking_reference,))
+
+    def book(self, flight_id: int, passenger_id: int, flight_class: FlightClass, seat_number: str = None,
+             timeout: float = None):
+        return self.submit_booking(flight_id, passenger_id, flight_class, seat_number).result(timeout)
+
+    def cancel(self, booking_reference: str, timeout: float = None):
+        return self.submit_cancel(booking_reference).result(timeout)
+
+    # Apply everything already queued, then stop the writer
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "retried_batches": self.retried_batches,
+        }
+
+    def _submit(self, kind, args):
+        if self._closed:
+            raise RuntimeError("Booking pipeline is closed")
+        future = Future()
+        self._queue.put(Request(kind, args, future))
+        return future
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                try:
+                    request = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        with self.session_factory() as db:
+            try:
+                outcomes = [self._apply(db, request) for request in batch]
+                db.commit()
+            except Exception:
+                db.rollback()
+                outcomes = None
+
+            if outcomes is None:
+                # One bad request must not fail the others
+                self.retried_batches += 1
+                for request in batch:
+                    self._run_alone(db, request)
+                return
+
+            self.batches += 1
+            self.requests += len(batch)
+            # RETURNING rows come back in order, so the last one per flight
+            # is its state at commit
+            changed = {flight.id: flight for _, flight in outcomes if flight is not None}
+            for flight in changed.values():
+                flight_changed(flight)
+            for request, (value, _) in zip(batch, outcomes):
+                self._resolve(db, request, value)
+
+    def _run_alone(self, db, request):
+        try:
+            value, flight = self._apply(db, request)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            request.future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.requests += 1
+        if flight is not None:
+            flight_changed(flight)
+        self._resolve(db, request, value)
+
+    def _apply(self, db, request):
+        if request.kind == "book":
+            return add_booking(db, *request.args)
+        return remove_booking(db, *request.args)
+
+    def _resolve(self, db, request, value):
+        try:
+            if request.kind == "book":
+                flight_id, _, flight_class, seat_number = request.args
+                result = (Result(True, "booked", "Booking successful!", value) if value is not None
+                          else booking_failure(db, flight_id, flight_class, seat_number))
+            else:
+                result = (Result(True, "cancelled", "Booking has been cancelled successfully.") if value
+                          else cancel_failure(db, *request.args))
+        except Exception as e:
+            request.future.set_exception(e)
+            return
+        request.future.set_result(result)
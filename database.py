@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Date, DateTime, ForeignKey, Float, Boolean
+from sqlalchemy import create_engine, event, Column, Integer, String, Date, DateTime, ForeignKey, Float, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -8,10 +8,79 @@ import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "flight_reservation.db")
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+
+# SQLite engine profiles. Pragmas are applied to every new connection.
+# "throughput" trades the last few commits on power loss (synchronous=NORMAL
+# in WAL mode never corrupts the file) for much cheaper commits; "durable"
+# fsyncs every commit. Both use WAL so readers never block behind a writer.
+ENGINE_PROFILES = {
+    "throughput": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,       # KiB when negative, i.e. 64 MiB
+        "mmap_size": 268435456,     # 256 MiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 10000,      # ms
+        "pool_size": 20,
+        "max_overflow": 40,
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16384,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 30000,
+        "pool_size": 10,
+        "max_overflow": 20,
+    },
+}
+PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout")
+DB_PROFILE = os.environ.get("FLIGHT_DB_PROFILE", "durable")
+
+# Settings of a named profile with single values overridden
+def profile_settings(profile=DB_PROFILE, **overrides):
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"Unknown engine profile {profile!r}, expected one of {', '.join(ENGINE_PROFILES)}")
+    return {**ENGINE_PROFILES[profile], **overrides}
+
+# Run the profile's pragmas on every new DBAPI connection of a (sync) engine
+def install_sqlite_pragmas(sync_engine, settings):
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name in PRAGMAS:
+            cursor.execute(f"PRAGMA {name}={settings[name]}")
+        cursor.close()
+
+# Build an engine from a named profile; keyword arguments override single
+# settings, e.g. create_sqlite_engine(profile="durable", mmap_size=67108864)
+def create_sqlite_engine(url=SQLALCHEMY_DATABASE_URL, profile=DB_PROFILE, **overrides):
+    settings = profile_settings(profile, **overrides)
+
+    # A thread-safe queue of connections: each thread checks one out for the
+    # life of its session instead of sharing a single connection
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        pool_size=settings["pool_size"],
+        max_overflow=settings["max_overflow"],
+    )
+    install_sqlite_pragmas(engine, settings)
+    return engine
+
+engine = create_sqlite_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Create missing tables, plus any indexes added to tables that already exist
+def create_schema(bind=None):
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,116 @@
+import argparse
+import time
+from datetime import date, datetime
+
+from sqlalchemy import DDL, delete, func, select, text
+from sqlalchemy.orm import Session
+
+from database import SQLALCHEMY_DATABASE_URL, DB_PROFILE, ENGINE_PROFILES, create_sqlite_engine, create_schema
+from instrumentation import timed
+from models import FareCalendarDay, FARE_CALENDAR_QUERY, FARE_CALENDAR_REBUILD, FARE_CALENDAR_TRIGGERS
+
+# Columns of a month view row
+FARE_DAY_COLUMNS = (
+    FareCalendarDay.day,
+    FareCalendarDay.min_price,
+    FareCalendarDay.flights,
+    FareCalendarDay.seats,
+)
+
+# Days where the calendar and a fresh GROUP BY over flights disagree. Days
+# with no bookable flights left count as absent on both sides.
+FARE_CALENDAR_DRIFT = f"""
+    SELECT
+        (SELECT COUNT(*) FROM (
+            SELECT departure_airport, arrival_airport, day, min_price, flights, seats
+            FROM fare_calendar WHERE flights > 0
+            EXCEPT {FARE_CALENDAR_QUERY}))
+      + (SELECT COUNT(*) FROM (
+            {FARE_CALENDAR_QUERY}
+            EXCEPT
+            SELECT departure_airport, arrival_airport, day, min_price, flights, seats
+            FROM fare_calendar WHERE flights > 0))"""
+
+
+def _month(year: int, month: int):
+    first = date(year, month, 1)
+    following = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return first, following
+
+# One month of a route's fare calendar, days in order, read as a single
+# range of the primary key. Days without scheduled flights are left out;
+# min_price is None on days that are sold out.
+@timed("fare_calendar")
+def fare_calendar_month(db: Session, departure: str, arrival: str, year: int, month: int):
+    first, following = _month(year, month)
+    return db.execute(
+        select(*FARE_DAY_COLUMNS)
+        .where(FareCalendarDay.departure_airport == departure.upper(),
+               FareCalendarDay.arrival_airport == arrival.upper(),
+               FareCalendarDay.day >= first,
+               FareCalendarDay.day < following,
+               FareCalendarDay.flights > 0)
+        .order_by(FareCalendarDay.day)
+    ).all()
+
+# Bulk loads drop the triggers and rebuild the calendar once at the end
+def drop_triggers(conn):
+    for name in FARE_CALENDAR_TRIGGERS:
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+
+# Recompute the whole calendar and reinstall its triggers in one
+# transaction, for recovery or after a load that ran without them
+def rebuild(conn):
+    drop_triggers(conn)
+    conn.execute(delete(FareCalendarDay))
+    conn.execute(DDL(FARE_CALENDAR_REBUILD))
+    for ddl in FARE_CALENDAR_TRIGGERS.values():
+        conn.execute(DDL(ddl))
+
+def drift(conn):
+    return conn.execute(text(FARE_CALENDAR_DRIFT)).scalar()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fare calendar: cheapest bookable fare per route and day.")
+    parser.add_argument("--profile", choices=ENGINE_PROFILES, default=DB_PROFILE, help="engine profile")
+    parser.add_argument("--db", default=SQLALCHEMY_DATABASE_URL, help="database URL")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild", help="recompute the calendar from the flights table")
+    commands.add_parser("check", help="count days that differ from the flights table")
+    month = commands.add_parser("month", help="show one month of a route")
+    month.add_argument("departure")
+    month.add_argument("arrival")
+    month.add_argument("month", help="MM-YYYY")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    engine = create_sqlite_engine(args.db, profile=args.profile)
+    create_schema(engine)
+    try:
+        started = time.perf_counter()
+        if args.command == "rebuild":
+            with engine.begin() as conn:
+                rebuild(conn)
+                days = conn.execute(select(func.count()).select_from(FareCalendarDay)).scalar()
+            print(f"Fare calendar rebuilt: {days:,} route days in {time.perf_counter() - started:.1f}s")
+        elif args.command == "check":
+            with engine.connect() as conn:
+                count = drift(conn)
+            print(f"{count} days differ from the flights table" if count else "Fare calendar is up to date")
+            return 1 if count else 0
+        else:
+            when = datetime.strptime(args.month, "%m-%Y")
+            with Session(engine) as db:
+                days = fare_calendar_month(db, args.departure, args.arrival, when.year, when.month)
+            for day in days:
+                fare = f"Rs.{day.min_price:.2f}" if day.min_price is not None else "sold out"
+                print(f"{day.day.strftime('%d-%m-%Y')}  {fare:<14} {day.flights:>3} flights  {day.seats:>5} seats")
+    finally:
+        engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
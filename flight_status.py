@@ -0,0 +1,223 @@
+import argparse
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, Integer, func, insert, literal, select, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import (SQLALCHEMY_DATABASE_URL, DB_PROFILE, ENGINE_PROFILES, SessionLocal, create_sqlite_engine,
+                      create_schema)
+from instrumentation import timed
+from models import Flight, Booking, BookingDisruption, FlightStatus
+from search_cache import flight_search_cache
+from services import CHANGE_COLUMNS, Result, flight_changed
+
+# Seconds between runs of the background scheduler
+STATUS_INTERVAL = 60
+
+# Flights that have not left yet
+NOT_DEPARTED = (FlightStatus.SCHEDULED, FlightStatus.DELAYED)
+
+TransitionReport = namedtuple("TransitionReport", "departed arrived")
+
+logger = logging.getLogger("flight_reservation.status")
+
+
+def _transition(db: Session, from_statuses, to_status: FlightStatus, *conditions):
+    return db.execute(
+        update(Flight)
+        .where(Flight.status.in_(from_statuses), *conditions)
+        .values(status=to_status)
+        .returning(*CHANGE_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+# Move every flight whose time has come one step along its lifecycle:
+# scheduled or delayed flights past their departure time depart, departed
+# flights past their arrival time arrive. Each step is one UPDATE over a
+# range of ix_flights_status_departure, so a run only reads the flights that
+# changed since the last one, however long the schedule is.
+@timed("status_transitions")
+def advance_statuses(db: Session, now: datetime = None):
+    now = now or datetime.now()
+    try:
+        departed = _transition(db, NOT_DEPARTED, FlightStatus.DEPARTED, Flight.departure_time <= now)
+        # departure_time bounds the index range, arrival_time filters inside it
+        arrived = _transition(db, (FlightStatus.DEPARTED,), FlightStatus.ARRIVED,
+                              Flight.departure_time <= now, Flight.arrival_time <= now)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    for flight in departed + arrived:
+        flight_changed(flight)
+    return TransitionReport(len(departed), len(arrived))
+
+# DateTime columns are stored as 'YYYY-MM-DD HH:MM:SS.ffffff' text. SQLite's
+# strftime drops the fraction, so it is carried over: a shifted value has to
+# keep the same format to compare correctly with the others.
+def _shifted(column, minutes: int):
+    return func.strftime("%Y-%m-%d %H:%M:%S", column, f"+{int(minutes)} minutes").concat(func.substr(column, 20))
+
+# Record the disruption on every active booking of the flights, with one
+# INSERT ... SELECT over ix_bookings_active_flight. Returns how many.
+def _mark_bookings(db: Session, flight_ids, status: FlightStatus, delay_minutes: int = None):
+    active = (
+        select(Booking.id, Booking.flight_id,
+               literal(status, BookingDisruption.status.type),
+               literal(delay_minutes, Integer),
+               literal(datetime.utcnow(), DateTime))
+        .where(Booking.flight_id.in_(flight_ids), Booking.is_cancelled == False)  # noqa: E712
+    )
+    columns = ["booking_id", "flight_id", "status", "delay_minutes", "created_at"]
+    return db.execute(insert(BookingDisruption).from_select(columns, active)).rowcount
+
+# Delay flights that have not left yet: departure and arrival move by
+# `minutes` and the flights become DELAYED. One UPDATE and one INSERT,
+# whatever the number of flights. Returns a Result whose value is the list of
+# delayed flights as CHANGE_COLUMNS rows.
+@timed("delay_flights")
+def delay_flights(db: Session, flight_ids, minutes: int):
+    if minutes <= 0:
+        return Result(False, "invalid", "A delay must be a positive number of minutes.")
+
+    try:
+        flights = db.execute(
+            update(Flight)
+            .where(Flight.id.in_(flight_ids), Flight.status.in_(NOT_DEPARTED))
+            .values(status=FlightStatus.DELAYED,
+                    departure_time=_shifted(Flight.departure_time, minutes),
+                    arrival_time=_shifted(Flight.arrival_time, minutes))
+            .returning(*CHANGE_COLUMNS)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if not flights:
+            db.rollback()
+            return Result(False, "not_found", "None of these flights can still be delayed.")
+        bookings = _mark_bookings(db, [flight.id for flight in flights], FlightStatus.DELAYED, minutes)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    delay = timedelta(minutes=minutes)
+    for flight in flights:
+        # The flight also leaves the searches of its old departure time
+        flight_search_cache.invalidate_flight(flight.departure_airport, flight.arrival_airport,
+                                              flight.departure_time - delay)
+        flight_changed(flight)
+    return Result(True, "delayed", f"{len(flights)} flights delayed by {minutes} minutes, "
+                                   f"{bookings} bookings affected.", flights)
+
+# Cancel flights that have not left yet, and with them every active booking
+# on them. Returns a Result whose value is the list of cancelled flights as
+# CHANGE_COLUMNS rows.
+@timed("cancel_flights")
+def cancel_flights(db: Session, flight_ids):
+    try:
+        flights = db.execute(
+            update(Flight)
+            .where(Flight.id.in_(flight_ids), Flight.status.in_(NOT_DEPARTED))
+            .values(status=FlightStatus.CANCELLED)
+            .returning(*CHANGE_COLUMNS)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if not flights:
+            db.rollback()
+            return Result(False, "not_found", "None of these flights can still be cancelled.")
+        cancelled_ids = [flight.id for flight in flights]
+        bookings = _mark_bookings(db, cancelled_ids, FlightStatus.CANCELLED)
+        db.execute(
+            update(Booking)
+            .where(Booking.flight_id.in_(cancelled_ids), Booking.is_cancelled == False)  # noqa: E712
+            .values(is_cancelled=True)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    for flight in flights:
+        flight_changed(flight)
+    return Result(True, "cancelled", f"{len(flights)} flights cancelled, {bookings} bookings cancelled.", flights)
+
+
+# Runs advance_statuses right away and then every `interval` seconds on a
+# daemon thread. Several app processes may each run one: the UPDATEs only
+# match flights that still need to move, so a repeated run changes nothing.
+class StatusScheduler:
+    def __init__(self, session_factory=SessionLocal, interval: float = STATUS_INTERVAL):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="flight-status", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                with self.session_factory() as db:
+                    advance_statuses(db)
+            except Exception:
+                logger.exception("Flight status update failed")
+            if self._stop.wait(self.interval):
+                break
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Move flights through their lifecycle, or delay or cancel flights.")
+    parser.add_argument("--profile", choices=ENGINE_PROFILES, default=DB_PROFILE, help="engine profile")
+    parser.add_argument("--db", default=SQLALCHEMY_DATABASE_URL, help="database URL")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="update statuses from departure and arrival times")
+    run.add_argument("--every", type=float, help="keep running, every this many seconds")
+    delay = commands.add_parser("delay", help="delay flights")
+    delay.add_argument("flight_numbers", nargs="+")
+    delay.add_argument("--minutes", type=int, required=True, help="length of the delay")
+    cancel = commands.add_parser("cancel", help="cancel flights and their bookings")
+    cancel.add_argument("flight_numbers", nargs="+")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    engine = create_sqlite_engine(args.db, profile=args.profile)
+    create_schema(engine)
+    sessions = sessionmaker(bind=engine, autoflush=False)
+    try:
+        with sessions() as db:
+            if args.command == "run":
+                while True:
+                    started = time.perf_counter()
+                    report = advance_statuses(db)
+                    print(f"{report.departed} departed, {report.arrived} arrived "
+                          f"({(time.perf_counter() - started) * 1000:.1f} ms)")
+                    if args.every is None:
+                        break
+                    time.sleep(args.every)
+                return
+
+            flight_ids = db.scalars(select(Flight.id).where(Flight.flight_number.in_(args.flight_numbers))).all()
+            if args.command == "delay":
+                result = delay_flights(db, flight_ids, args.minutes)
+            else:
+                result = cancel_flights(db, flight_ids)
+            print(result.message)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
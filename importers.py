@@ -0,0 +1,556 @@
+import argparse
+import csv
+import json
+import os
+import time
+from collections import namedtuple
+from datetime import date, datetime
+
+from sqlalchemy import and_, bindparam, delete, func, insert, literal_column, or_, select, table, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import SQLALCHEMY_DATABASE_URL, DB_PROFILE, ENGINE_PROFILES, create_sqlite_engine, create_schema
+from itineraries import route_graph
+from models import Flight, Passenger, Booking, SeatMap, FlightClass, FlightStatus
+from seat_map import CABIN_ORDER, CABIN_SHARE, cabin_sizes, new_seat_map, seat_bookings, log_rebuild
+from search_cache import flight_search_cache
+
+# Rows validated and written per transaction; memory use is bounded by this,
+# not by the size of the file
+IMPORT_CHUNK = 5_000
+
+# Accepted time formats: ISO 8601, or the one the menu uses. Dates of birth
+# are YYYY-MM-DD or DD-MM-YYYY.
+TIME_FORMATS = ("%d-%m-%Y %H:%M",)
+
+FLIGHT_FIELDS = ("flight_number", "airline", "departure_airport", "arrival_airport",
+                 "departure_time", "arrival_time", "total_seats", "price")
+
+# A row missing any of these is rejected, as create_passenger would refuse it
+REQUIRED_PASSENGER_FIELDS = ("first_name", "last_name", "email", "phone", "passport_number", "date_of_birth")
+
+# Passenger columns an import may change
+PASSENGER_COLUMNS = ("first_name", "last_name", "email", "phone", "passport_number", "date_of_birth")
+
+ImportReport = namedtuple("ImportReport", "rows inserted updated unchanged rejected seconds reasons")
+
+
+# (line number, record) pairs from a CSV file with a header row or a JSONL
+# file, read lazily. The format follows the extension unless given. A JSONL
+# line that does not parse comes through as a None record.
+def read_records(path, fmt=None):
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".json")) else "csv")
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield line_no, record if isinstance(record, dict) else None
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def parse_time(value):
+    if isinstance(value, datetime):
+        return value
+    value = str(value).strip()
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError("unrecognised time format")
+
+# A schedule record as Flight column values; raises ValueError with the
+# reason the row is rejected
+def parse_flight(record):
+    missing = [field for field in FLIGHT_FIELDS if record.get(field) in (None, "")]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    try:
+        total_seats = int(record["total_seats"])
+        price = float(record["price"])
+    except (TypeError, ValueError):
+        raise ValueError("total_seats and price must be numbers")
+    try:
+        departure_time = parse_time(record["departure_time"])
+        arrival_time = parse_time(record["arrival_time"])
+    except ValueError:
+        raise ValueError("unrecognised departure or arrival time")
+
+    if total_seats <= 0:
+        raise ValueError("total_seats must be positive")
+    if price < 0:
+        raise ValueError("price cannot be negative")
+    if arrival_time <= departure_time:
+        raise ValueError("arrival must be after departure")
+
+    status = str(record.get("status") or FlightStatus.SCHEDULED.name).upper()
+    if status not in FlightStatus.__members__:
+        raise ValueError("unknown status")
+
+    return {
+        "flight_number": str(record["flight_number"]).strip(),
+        "airline": str(record["airline"]).strip(),
+        "departure_airport": str(record["departure_airport"]).strip().upper(),
+        "arrival_airport": str(record["arrival_airport"]).strip().upper(),
+        "departure_time": departure_time,
+        "arrival_time": arrival_time,
+        "total_seats": total_seats,
+        "available_seats": total_seats,
+        "price": price,
+        "status": FlightStatus[status],
+    }
+
+
+# Insert new flights and update existing ones in one executemany per chunk.
+# Status is only set on insert: a nightly reload must not bring a cancelled
+# flight back. Seats already sold are kept: available_seats becomes the new
+# capacity minus the sold seats, and the WHERE makes the database skip a row
+# whose capacity no longer covers them even if seats sold since the check.
+def _flight_upsert():
+    stmt = sqlite_insert(Flight)
+    sold = Flight.total_seats - Flight.available_seats
+    return stmt.on_conflict_do_update(
+        index_elements=[Flight.flight_number],
+        set_={
+            "airline": stmt.excluded.airline,
+            "departure_airport": stmt.excluded.departure_airport,
+            "arrival_airport": stmt.excluded.arrival_airport,
+            "departure_time": stmt.excluded.departure_time,
+            "arrival_time": stmt.excluded.arrival_time,
+            "total_seats": stmt.excluded.total_seats,
+            "available_seats": stmt.excluded.total_seats - sold,
+            "price": stmt.excluded.price,
+        },
+        where=and_(stmt.excluded.total_seats >= sold,
+                   or_(stmt.excluded.total_seats == Flight.total_seats,
+                       _cabins_fit(stmt.excluded.total_seats))),
+    )
+
+# Whether every cabin of the resized aircraft still holds the cabin's active
+# bookings, worked out as cabin_sizes does. The import checks this before
+# writing; repeating it in the upsert covers bookings made in between.
+def _cabins_fit(total_seats):
+    sizes = {cls: total_seats * share // 100 for cls, share in CABIN_SHARE.items()}
+    sizes[FlightClass.ECONOMY] = total_seats - sizes[FlightClass.FIRST] - sizes[FlightClass.BUSINESS]
+    return and_(*(size >= select(func.count()).select_from(Booking)
+                  .where(Booking.flight_id == literal_column("flights.id"),
+                         Booking.is_cancelled == False,  # noqa: E712
+                         Booking.flight_class == cls).scalar_subquery()
+                  for cls, size in sizes.items()))
+
+# Why a flight with `sold` seats and the given active bookings per cabin
+# cannot take `total_seats`, as (reason, detail), or None if it can
+def _resize_problem(total_seats, sold, active):
+    if total_seats < sold:
+        return "total_seats below seats already sold", f"{sold} sold"
+    sizes = cabin_sizes(total_seats)
+    short = [f"{cls.value}: {active[cls]} booked, {sizes[cls]} seats"
+             for cls in CABIN_ORDER if active.get(cls, 0) > sizes[cls]]
+    if short:
+        return "cabin below its active bookings", "; ".join(short)
+    booked = sum(active.values())
+    if booked != sold:
+        return "seat counter does not match active bookings", f"{sold} sold, {booked} active bookings"
+    return None
+
+# Active bookings of the given flights, {flight_id: {class: count}}
+def _active_by_cabin(conn, flight_ids):
+    active = {}
+    for row in conn.execute(
+        select(Booking.flight_id, Booking.flight_class, func.count())
+        .where(Booking.flight_id.in_(flight_ids), Booking.is_cancelled == False)  # noqa: E712
+        .group_by(Booking.flight_id, Booking.flight_class)
+    ):
+        active.setdefault(row.flight_id, {})[row.flight_class] = row[2]
+    return active
+
+# Replace the seat maps of resized flights with ones rebuilt from their active
+# bookings, moving the bookings whose seat is gone. Runs in the import's
+# transaction, after the upsert has taken the write lock, so no booking can
+# land in between. Returns the ids of the flights that were resized: a row the
+# upsert skipped because of a booking made since the check keeps its old
+# capacity and seat map.
+def _rebuild_seat_maps(conn, resized):
+    flights = {row.id: row for row in conn.execute(
+        select(Flight.id, Flight.flight_number, Flight.total_seats, Flight.available_seats)
+        .where(Flight.id.in_(list(resized))))
+        if row.total_seats == resized[row.id]}
+    if not flights:
+        return set()
+    bookings = {}
+    for booking in conn.execute(
+        select(Booking.id, Booking.flight_id, Booking.booking_reference, Booking.seat_number, Booking.flight_class)
+        .where(Booking.flight_id.in_(list(flights)), Booking.is_cancelled == False)  # noqa: E712
+        .order_by(Booking.flight_id, Booking.id)
+    ):
+        bookings.setdefault(booking.flight_id, []).append(booking)
+
+    seat_maps, moved = [], []
+    for flight in flights.values():
+        seat_map = new_seat_map(flight.total_seats)
+        moves = seat_bookings(seat_map, bookings.get(flight.id, []))
+        log_rebuild(seat_map, flight.flight_number, flight.available_seats, moves)
+        moved.extend({"booking_id": booking.id, "seat_number": seat_number}
+                     for booking, seat_number in moves if seat_number)
+        seat_maps.append(_seat_map_row(flight.id, seat_map))
+
+    conn.execute(delete(SeatMap).where(SeatMap.flight_id.in_(list(flights))))
+    conn.execute(insert(SeatMap), seat_maps)
+    if moved:
+        conn.execute(update(Booking).where(Booking.id == bindparam("booking_id"))
+                     .values(seat_number=bindparam("seat_number")), moved)
+    return set(flights)
+
+# Keeps the planner's row counts in step while a load grows a table. With
+# statistics from when the table was small, SQLite answers the chunk
+# lookups (long IN lists) with full scans, so every time the table has
+# grown by half, re-run a sampled ANALYZE, which takes milliseconds.
+class _Statistics:
+    def __init__(self, conn, table):
+        self.conn = conn
+        self.table = table
+        self.analyzed_rows = 0
+        self.added = 0
+        self.refresh()
+
+    def refresh(self):
+        self.conn.exec_driver_sql("PRAGMA analysis_limit=1000")
+        self.conn.exec_driver_sql(f"ANALYZE {self.table}")
+        self.conn.commit()
+        self.analyzed_rows = self.conn.execute(select(func.count()).select_from(table(self.table))).scalar()
+        self.added = 0
+
+    def grew(self, rows):
+        self.added += rows
+        if self.added * 2 > self.analyzed_rows:
+            self.refresh()
+
+# A seat_maps row for the flight
+def _seat_map_row(flight_id, seat_map):
+    return {
+        "flight_id": flight_id,
+        "first_seats": seat_map.first_seats,
+        "business_seats": seat_map.business_seats,
+        "economy_seats": seat_map.economy_seats,
+        "occupied": seat_map.occupied,
+    }
+
+# Rejected rows, streamed to a CSV side file (line, key, reason, detail) and
+# counted by reason for the report
+class _Rejects:
+    def __init__(self, path):
+        self.count = 0
+        self.reasons = {}
+        self._file = open(path, "w", newline="", encoding="utf-8") if path else None
+        self._writer = csv.writer(self._file) if self._file else None
+        if self._writer:
+            self._writer.writerow(["line", "key", "reason", "detail"])
+
+    def add(self, line, key, reason, detail=""):
+        self.count += 1
+        reason = str(reason)
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        if self._writer:
+            self._writer.writerow([line, key, reason, detail])
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+# Stream a schedule file into the flights table, upserting on flight_number.
+# Rejected rows (and why) go to rejects_path as CSV. New flights get an empty
+# seat map. A capacity change is rejected if any cabin would end up smaller
+# than its active bookings; otherwise the flight's seat map is rebuilt from
+# its bookings in the same transaction.
+def import_flights(path, db_url=SQLALCHEMY_DATABASE_URL, fmt=None, chunk_size=IMPORT_CHUNK,
+                   rejects_path=None, profile=DB_PROFILE):
+    engine = create_sqlite_engine(db_url, profile=profile)
+    create_schema(engine)
+    upsert = _flight_upsert()
+    rejects = _Rejects(rejects_path)
+    rows = inserted = updated = 0
+    started = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            statistics = _Statistics(conn, Flight.__tablename__)
+            for chunk in _chunks(read_records(path, fmt), chunk_size):
+                # Last row wins when the same flight appears twice in a chunk
+                flights = {}
+                for line, record in chunk:
+                    rows += 1
+                    if record is None:
+                        rejects.add(line, "", "not a JSON object")
+                        continue
+                    try:
+                        flight = parse_flight(record)
+                    except ValueError as e:
+                        rejects.add(line, record.get("flight_number", ""), e)
+                        continue
+                    flights[flight["flight_number"]] = (line, flight)
+
+                existing = {row.flight_number: row for row in conn.execute(
+                    select(Flight.id, Flight.flight_number, Flight.total_seats, Flight.available_seats)
+                    .where(Flight.flight_number.in_(list(flights))))}
+                changes = {number: existing[number] for number, (_, flight) in flights.items()
+                           if number in existing and flight["total_seats"] != existing[number].total_seats}
+                active = _active_by_cabin(conn, [current.id for current in changes.values()]) if changes else {}
+                batch, resized = [], {}
+                for number, (line, flight) in flights.items():
+                    current = changes.get(number)
+                    if current is not None:
+                        problem = _resize_problem(flight["total_seats"], current.total_seats - current.available_seats,
+                                                  active.get(current.id, {}))
+                        if problem:
+                            rejects.add(line, number, *problem)
+                            continue
+                        resized[current.id] = flight["total_seats"]
+                    batch.append(flight)
+
+                if batch:
+                    conn.execute(upsert, batch)
+                skipped = 0
+                if resized:
+                    rebuilt = _rebuild_seat_maps(conn, resized)
+                    for number, current in changes.items():
+                        if current.id in resized and current.id not in rebuilt:
+                            rejects.add(flights[number][0], number, "cabin below its active bookings",
+                                        "booked during the import")
+                            skipped += 1
+                added = [flight["flight_number"] for flight in batch if flight["flight_number"] not in existing]
+                if added:
+                    conn.execute(insert(SeatMap), [_seat_map_row(row.id, new_seat_map(row.total_seats))
+                                                   for row in conn.execute(
+                        select(Flight.id, Flight.total_seats).where(Flight.flight_number.in_(added)))])
+                conn.commit()
+                inserted += len(added)
+                updated += len(batch) - len(added) - skipped
+                statistics.grew(len(added))
+    finally:
+        rejects.close()
+        engine.dispose()
+
+    _schedule_changed()
+    return ImportReport(rows, inserted, updated, 0, rejects.count, time.perf_counter() - started, rejects.reasons)
+
+def parse_date(value):
+    if isinstance(value, date):
+        return value
+    value = str(value).strip()
+    # strptime is the slowest step of an import; try the C parsers first
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        pass
+    day, _, rest = value.partition("-")
+    month, _, year = rest.partition("-")
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        raise ValueError("unrecognised date_of_birth")
+
+# A CRM record as Passenger column values; raises ValueError with the reason
+# the row is rejected
+def parse_passenger(record):
+    missing = [field for field in REQUIRED_PASSENGER_FIELDS if record.get(field) in (None, "")]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    email = str(record["email"]).strip()
+    if "@" not in email:
+        raise ValueError("invalid email")
+    return {
+        "first_name": str(record["first_name"]).strip(),
+        "last_name": str(record["last_name"]).strip(),
+        "email": email,
+        "phone": str(record["phone"]).strip(),
+        "passport_number": str(record["passport_number"]).strip().upper(),
+        "date_of_birth": parse_date(record["date_of_birth"]),
+    }
+
+# Rows of a chunk with duplicates folded: a row that repeats an earlier row's
+# email and passport replaces it, a row that shares only one of the two keys
+# with an earlier row is a conflict. Returns {email: (line, row)}.
+def _dedupe_passengers(parsed, rejects):
+    by_email, by_passport = {}, {}
+    for line, row in parsed:
+        email, passport = row["email"], row["passport_number"]
+        if email in by_email or passport in by_passport:
+            if by_passport.get(passport) == email:
+                by_email[email] = (line, row)
+                continue
+            other = by_email.get(email) or by_email[by_passport[passport]]
+            rejects.add(line, email, "conflicts with another row in the file", f"line {other[0]}")
+            continue
+        by_email[email] = (line, row)
+        by_passport[passport] = email
+    return by_email
+
+# Match rows to stored passengers: by email, else by passport (a changed
+# email). A row whose email and passport belong to two different
+# passengers is a conflict. Returns (inserts, updates, unchanged count), the
+# first two as {email: (line, values)}.
+def _match_passengers(conn, rows, rejects):
+    emails = list(rows)
+    passports = [row["passport_number"] for _, row in rows.values()]
+    found = conn.execute(select(Passenger.id, *(getattr(Passenger, c) for c in PASSENGER_COLUMNS))
+                         .where(Passenger.email.in_(emails) | Passenger.passport_number.in_(passports))).all()
+    by_email = {p.email: p for p in found}
+    by_passport = {p.passport_number: p for p in found}
+
+    inserts, updates, unchanged = {}, {}, 0
+    for email, (line, row) in rows.items():
+        same_email, same_passport = by_email.get(email), by_passport.get(row["passport_number"])
+        if same_email and same_passport and same_email.id != same_passport.id:
+            rejects.add(line, email, "email and passport_number belong to different passengers",
+                        f"passengers {same_email.id} and {same_passport.id}")
+            continue
+        current = same_email or same_passport
+        if current is None:
+            inserts[email] = (line, row)
+        elif all(getattr(current, c) == row[c] for c in PASSENGER_COLUMNS):
+            unchanged += 1
+        else:
+            updates[email] = (line, {"passenger_id": current.id, **row})
+    return inserts, updates, unchanged
+
+# Stream a CRM export into the passengers table, upserting on email and
+# passport_number. Rejected rows and conflicts go to conflicts_path as CSV
+# instead of aborting the import. Each chunk is one transaction; if it still
+# hits a unique constraint (another writer, or keys swapped between two
+# passengers), it is redone row by row so only the offending rows are lost.
+def import_passengers(path, db_url=SQLALCHEMY_DATABASE_URL, fmt=None, chunk_size=IMPORT_CHUNK,
+                      conflicts_path=None, profile=DB_PROFILE):
+    engine = create_sqlite_engine(db_url, profile=profile)
+    create_schema(engine)
+    update_stmt = (update(Passenger)
+                   .where(Passenger.id == bindparam("passenger_id"))
+                   .values({c: bindparam(c) for c in PASSENGER_COLUMNS}))
+    rejects = _Rejects(conflicts_path)
+    rows = inserted = updated = unchanged = 0
+    started = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            statistics = _Statistics(conn, Passenger.__tablename__)
+            for chunk in _chunks(read_records(path, fmt), chunk_size):
+                parsed = []
+                for line, record in chunk:
+                    rows += 1
+                    if record is None:
+                        rejects.add(line, "", "not a JSON object")
+                        continue
+                    try:
+                        parsed.append((line, parse_passenger(record)))
+                    except ValueError as e:
+                        rejects.add(line, record.get("email", ""), e)
+
+                inserts, updates, same = _match_passengers(conn, _dedupe_passengers(parsed, rejects), rejects)
+                try:
+                    _write_passengers(conn, update_stmt, inserts, updates)
+                    conn.commit()
+                except IntegrityError:
+                    conn.rollback()
+                    inserts, updates = _import_one_by_one(conn, update_stmt, {**inserts, **updates}, rejects)
+                inserted += len(inserts)
+                updated += len(updates)
+                unchanged += same
+                statistics.grew(len(inserts))
+    finally:
+        rejects.close()
+        engine.dispose()
+
+    return ImportReport(rows, inserted, updated, unchanged, rejects.count, time.perf_counter() - started,
+                        rejects.reasons)
+
+def _write_passengers(conn, update_stmt, inserts, updates):
+    if updates:
+        conn.execute(update_stmt, [values for _, values in updates.values()])
+    if inserts:
+        conn.execute(insert(Passenger), [values for _, values in inserts.values()])
+
+def _import_one_by_one(conn, update_stmt, rows, rejects):
+    inserted, updated = {}, {}
+    for email, (line, row) in rows.items():
+        row = {c: row[c] for c in PASSENGER_COLUMNS}
+        inserts, updates, _ = _match_passengers(conn, {email: (line, row)}, rejects)
+        try:
+            _write_passengers(conn, update_stmt, inserts, updates)
+            conn.commit()
+        except IntegrityError as e:
+            conn.rollback()
+            rejects.add(line, email, "unique constraint failed", str(e.orig))
+            continue
+        inserted.update(inserts)
+        updated.update(updates)
+    return inserted, updated
+
+# Cached searches and the route graph of this process no longer match the
+# table after a bulk load. Only this process's copies are cleared: a serving
+# process sharing the database picks the import up when its search cache
+# entries (TTL_SECONDS) and route graph (GRAPH_TTL) expire, and re-reads
+# itinerary legs before showing them.
+def _schedule_changed():
+    flight_search_cache.clear()
+    route_graph.invalidate()
+
+def print_report(name, report):
+    rate = report.rows / report.seconds if report.seconds else 0.0
+    print(f"{name}: {report.rows:,} rows in {report.seconds:.1f}s ({rate:,.0f} rows/s)")
+    unchanged = f", unchanged {report.unchanged:,}" if report.unchanged else ""
+    print(f"  inserted {report.inserted:,}, updated {report.updated:,}{unchanged}, rejected {report.rejected:,}")
+    for reason, count in sorted(report.reasons.items(), key=lambda item: -item[1]):
+        print(f"    {count:>8,}  {reason}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import data files into the reservation database.")
+    subparsers = parser.add_subparsers(dest="kind", required=True)
+
+    flights = subparsers.add_parser("flights", help="upsert a flight schedule (CSV or JSONL) on flight_number")
+    flights.add_argument("path", help="schedule file")
+    flights.add_argument("--rejects", help="write rejected rows and reasons to this CSV file")
+
+    passengers = subparsers.add_parser("passengers", help="upsert passengers (CSV or JSONL) on email and passport")
+    passengers.add_argument("path", help="passenger export file")
+    passengers.add_argument("--conflicts", help="write rejected and conflicting rows to this CSV file")
+
+    for sub in subparsers.choices.values():
+        sub.add_argument("--format", choices=("csv", "jsonl"), help="file format (default: from the extension)")
+        sub.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK,
+                         help=f"rows per transaction (default {IMPORT_CHUNK})")
+        sub.add_argument("--profile", choices=ENGINE_PROFILES, default=DB_PROFILE, help="engine profile")
+        sub.add_argument("--db", default=None, help="SQLite file to import into (default flight_reservation.db)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    db_url = f"sqlite:///{os.path.abspath(args.db)}" if args.db else SQLALCHEMY_DATABASE_URL
+    if args.kind == "flights":
+        report = import_flights(args.path, db_url, args.format, args.chunk_size, args.rejects, args.profile)
+        print_report("Flights", report)
+    else:
+        report = import_passengers(args.path, db_url, args.format, args.chunk_size, args.conflicts, args.profile)
+        print_report("Passengers", report)
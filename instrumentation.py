@@ -0,0 +1,252 @@
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+
+import database
+
+# Upper bounds of the latency buckets, in milliseconds; the last bucket
+# catches everything slower
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf"))
+
+SLOW_QUERY_MS = 100.0
+SLOW_LOG_SIZE = 100
+# Distinct statements tracked one by one; the rest are pooled under "(other)"
+MAX_STATEMENTS = 500
+
+slow_query_logger = logging.getLogger("flight_reservation.slow_query")
+
+
+# Fixed-bucket latency histogram: constant memory and one bisect to record,
+# with percentiles read back as the upper bound of the bucket they fall in
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, pct):
+        if not self.count:
+            return 0.0
+        target = pct / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": {("inf" if bound == float("inf") else str(bound)): count
+                        for bound, count in zip(BUCKETS_MS, self.counts) if count},
+        }
+
+
+class _Operation:
+    __slots__ = ("name", "statements", "sql_ms")
+
+    def __init__(self, name):
+        self.name = name
+        self.statements = 0
+        self.sql_ms = 0.0
+
+_current_operation = contextvars.ContextVar("current_operation", default=None)
+
+
+# Statement and operation metrics for an engine. Statements are timed through
+# before/after_cursor_execute; operations are the logical actions (search,
+# book, cancel, list) marked with operation() or @timed, and get their own
+# latency histogram plus the number of statements they issued.
+class Instrumentation:
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, explain_slow=True):
+        self.enabled = False
+        self.slow_query_ms = slow_query_ms
+        self.explain_slow = explain_slow
+        self.started = time.time()
+        self._engines = []
+        self._lock = threading.Lock()
+        self._statements = {}   # sql -> Histogram
+        self._operations = {}   # name -> [Histogram, statements, sql_ms]
+        self._slow = deque(maxlen=SLOW_LOG_SIZE)
+
+    def install(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        self._engines.append(engine)
+        self.enabled = True
+        return self
+
+    def uninstall(self):
+        for engine in self._engines:
+            event.remove(engine, "before_cursor_execute", self._before_execute)
+            event.remove(engine, "after_cursor_execute", self._after_execute)
+        self._engines = []
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._operations.clear()
+            self._slow.clear()
+            self.started = time.time()
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._instrumentation_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        ms = (time.perf_counter() - context._instrumentation_start) * 1000
+        operation = _current_operation.get()
+        with self._lock:
+            histogram = self._statements.get(statement)
+            if histogram is None:
+                key = statement if len(self._statements) < MAX_STATEMENTS else "(other)"
+                histogram = self._statements.setdefault(key, Histogram())
+            histogram.observe(ms)
+        if operation is not None:
+            operation.statements += 1
+            operation.sql_ms += ms
+        if ms >= self.slow_query_ms:
+            self._log_slow(cursor, statement, parameters, executemany, ms, operation)
+
+    # The plan is taken on the same connection right after the statement, so
+    # it is the plan SQLite just used; executemany batches are logged without one
+    def _log_slow(self, cursor, statement, parameters, executemany, ms, operation):
+        plan = None
+        if self.explain_slow and not executemany:
+            try:
+                rows = cursor.connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+                plan = [row[-1] for row in rows]
+            except Exception as e:
+                plan = [f"(plan unavailable: {e})"]
+        entry = {
+            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "ms": round(ms, 3),
+            "operation": operation.name if operation is not None else None,
+            "statement": statement,
+            "plan": plan,
+        }
+        with self._lock:
+            self._slow.append(entry)
+        slow_query_logger.warning("slow query (%.1f ms, %s): %s | plan: %s", ms, entry["operation"],
+                                  " ".join(statement.split()), "; ".join(plan or ()))
+
+    def record_operation(self, operation, ms):
+        with self._lock:
+            stats = self._operations.get(operation.name)
+            if stats is None:
+                stats = self._operations[operation.name] = [Histogram(), 0, 0.0]
+            stats[0].observe(ms)
+            stats[1] += operation.statements
+            stats[2] += operation.sql_ms
+
+    def snapshot(self):
+        with self._lock:
+            operations = {}
+            for name, (histogram, statements, sql_ms) in sorted(self._operations.items()):
+                operations[name] = {
+                    **histogram.snapshot(),
+                    "statements_per_op": round(statements / histogram.count, 2) if histogram.count else 0.0,
+                    "sql_share": round(sql_ms / histogram.total_ms, 3) if histogram.total_ms else 0.0,
+                }
+            statements = [{"statement": sql, **histogram.snapshot()}
+                          for sql, histogram in self._statements.items()]
+            slow = list(self._slow)
+        statements.sort(key=lambda s: -s["mean_ms"] * s["count"])
+        return {
+            "since": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "slow_query_ms": self.slow_query_ms,
+            "operations": operations,
+            "statements": statements,
+            "slow_queries": slow,
+        }
+
+    def export(self, fmt="text"):
+        snapshot = self.snapshot()
+        if fmt == "json":
+            return json.dumps(snapshot, indent=2, default=str)
+
+        lines = [f"Instrumentation since {snapshot['since']}", "", "Operations:"]
+        for name, op in snapshot["operations"].items():
+            lines.append(f"  {name:<16} {op['count']:>8} calls  mean {op['mean_ms']:>8.3f} ms  "
+                         f"p95 <= {op['p95_ms']:>6} ms  max {op['max_ms']:>8.3f} ms  "
+                         f"{op['statements_per_op']:>5.2f} stmts/op  {op['sql_share']:.0%} in SQL")
+        lines += ["", "Statements by total time:"]
+        for stmt in snapshot["statements"][:20]:
+            sql = " ".join(stmt["statement"].split())
+            lines.append(f"  {stmt['count']:>8} x  mean {stmt['mean_ms']:>8.3f} ms  p95 <= {stmt['p95_ms']:>6} ms  "
+                         f"{sql[:100]}")
+        lines += ["", f"Slow queries (>= {snapshot['slow_query_ms']} ms), most recent last:"]
+        for entry in snapshot["slow_queries"]:
+            lines.append(f"  {entry['at']}  {entry['ms']:>9.3f} ms  {entry['operation']}  "
+                         f"{' '.join(entry['statement'].split())[:100]}")
+            for step in entry["plan"] or ():
+                lines.append(f"      {step}")
+        return "\n".join(lines)
+
+
+# Process-wide instance; off until enable() installs it on an engine
+instrumentation = Instrumentation()
+
+def enable(engine=None, slow_query_ms=SLOW_QUERY_MS, explain_slow=True):
+    instrumentation.slow_query_ms = slow_query_ms
+    instrumentation.explain_slow = explain_slow
+    return instrumentation.install(engine or database.engine)
+
+def disable():
+    instrumentation.uninstall()
+
+
+# Attribute everything inside the block to one logical operation. Nested
+# operations count toward the outermost one, so create_booking calling
+# book_seat is one "book".
+class operation:
+    def __init__(self, name):
+        self.name = name
+        self._token = None
+
+    def __enter__(self):
+        if instrumentation.enabled and _current_operation.get() is None:
+            self._operation = _Operation(self.name)
+            self._token = _current_operation.set(self._operation)
+            self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._token is not None:
+            ms = (time.perf_counter() - self._started) * 1000
+            _current_operation.reset(self._token)
+            self._token = None
+            instrumentation.record_operation(self._operation, ms)
+
+# Decorator form of operation(); costs one attribute check when disabled
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not instrumentation.enabled or _current_operation.get() is not None:
+                return fn(*args, **kwargs)
+            with operation(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,276 @@
+import bisect
+import heapq
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from models import Flight, BOOKABLE_STATUSES
+
+Leg = namedtuple("Leg", "id flight_number airline departure_airport arrival_airport "
+                        "departure_time arrival_time price available_seats")
+Itinerary = namedtuple("Itinerary", "legs departure_time arrival_time total_price stops")
+
+LEG_COLUMNS = (
+    Flight.id,
+    Flight.flight_number,
+    Flight.airline,
+    Flight.departure_airport,
+    Flight.arrival_airport,
+    Flight.departure_time,
+    Flight.arrival_time,
+    Flight.price,
+    Flight.available_seats,
+)
+
+MIN_LAYOVER = timedelta(minutes=45)
+MAX_LAYOVER = timedelta(hours=6)
+MAX_STOPS = 2
+
+# A loaded graph only follows writes made in its own process. It is rebuilt
+# this long after loading, which bounds how far it can fall behind imports,
+# delays and archiving done by other processes.
+GRAPH_TTL = 300.0  # seconds
+
+# Searches repeated after stale legs were found in the results
+RECHECK_ROUNDS = 3
+
+# Search orders. Each key only grows along an itinerary (later legs arrive
+# later and cost more), so the first itinerary to reach the destination is
+# the best one.
+CRITERIA = {
+    "earliest": lambda legs, price, leg: (leg.arrival_time, price),
+    "cheapest": lambda legs, price, leg: (price, leg.arrival_time),
+    "fewest_stops": lambda legs, price, leg: (legs, leg.arrival_time),
+}
+
+
+# Time-indexed adjacency of the bookable schedule: for every airport, its
+# scheduled departures sorted by (departure_time, id), so the flights that fit
+# a layover window are one bisect away. Sold-out flights stay in the index
+# with their seat count and are skipped at search time, so a cancellation
+# that frees a seat needs no re-insert.
+class RouteGraph:
+    def __init__(self, ttl=GRAPH_TTL):
+        self.ttl = ttl
+        self.loaded = False
+        self.loaded_at = None
+        self._departures = {}   # airport -> sorted [(departure_time, id)]
+        self._legs = {}         # id -> Leg
+        self._routes = {}       # airport -> {arrival airport: number of flights}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._legs)
+
+    @property
+    def stale(self):
+        return not self.loaded or time.monotonic() - self.loaded_at >= self.ttl
+
+    # Build from every bookable flight departing after `since` (default now)
+    def load(self, db: Session, since: datetime = None, chunk_size: int = 10_000):
+        since = since or datetime.now()
+        query = (db.query(*LEG_COLUMNS)
+                 .filter(Flight.status.in_(BOOKABLE_STATUSES), Flight.departure_time >= since)
+                 .yield_per(chunk_size))
+        departures, legs, routes = {}, {}, {}
+        for row in query:
+            leg = Leg(*row)
+            legs[leg.id] = leg
+            departures.setdefault(leg.departure_airport, []).append((leg.departure_time, leg.id))
+            arrivals = routes.setdefault(leg.departure_airport, {})
+            arrivals[leg.arrival_airport] = arrivals.get(leg.arrival_airport, 0) + 1
+        for keys in departures.values():
+            keys.sort()
+        with self._lock:
+            self._departures, self._legs, self._routes = departures, legs, routes
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+        return self
+
+    # Forget the index after a bulk change; get_route_graph() rebuilds it
+    def invalidate(self):
+        with self._lock:
+            self._departures, self._legs, self._routes = {}, {}, {}
+            self.loaded = False
+
+    def add(self, leg: Leg):
+        with self._lock:
+            self.remove(leg.id)
+            self._legs[leg.id] = leg
+            bisect.insort(self._departures.setdefault(leg.departure_airport, []), (leg.departure_time, leg.id))
+            arrivals = self._routes.setdefault(leg.departure_airport, {})
+            arrivals[leg.arrival_airport] = arrivals.get(leg.arrival_airport, 0) + 1
+
+    def remove(self, flight_id: int):
+        with self._lock:
+            leg = self._legs.pop(flight_id, None)
+            if leg is None:
+                return False
+            keys = self._departures[leg.departure_airport]
+            index = bisect.bisect_left(keys, (leg.departure_time, leg.id))
+            if index < len(keys) and keys[index][1] == leg.id:
+                del keys[index]
+            arrivals = self._routes[leg.departure_airport]
+            arrivals[leg.arrival_airport] -= 1
+            if not arrivals[leg.arrival_airport]:
+                del arrivals[leg.arrival_airport]
+            return True
+
+    # Keep the index in step with a changed flight. `flight` is a Flight or
+    # any row with the same attribute names; changes to a known leg need just
+    # id, status, departure_time and available_seats.
+    def apply(self, flight):
+        with self._lock:
+            if flight.status not in BOOKABLE_STATUSES:
+                self.remove(flight.id)
+            elif flight.id in self._legs:
+                leg = self._legs[flight.id]
+                shift = flight.departure_time - leg.departure_time
+                if shift:
+                    # A delay moves both ends of the leg by the same time
+                    self.add(leg._replace(departure_time=flight.departure_time, arrival_time=leg.arrival_time + shift,
+                                          available_seats=flight.available_seats))
+                else:
+                    self._legs[flight.id] = leg._replace(available_seats=flight.available_seats)
+            elif hasattr(flight, "flight_number"):
+                self.add(Leg(*(getattr(flight, column.key) for column in LEG_COLUMNS)))
+
+    def _departing(self, airport, start, end):
+        keys = self._departures.get(airport, ())
+        index = bisect.bisect_left(keys, (start,))
+        while index < len(keys) and keys[index][0] < end:
+            leg = self._legs[keys[index][1]]
+            if leg.available_seats > 0:
+                yield leg
+            index += 1
+
+    # Best itinerary from origin to destination leaving on `day`, or None.
+    # A best-first search over legs: each flight is expanded at most once
+    # per stop count, and only along departures inside the layover window.
+    # The last leg must land at the destination and the one before it at an
+    # airport with a direct route there, which keeps hopeless searches short.
+    def search(self, origin: str, destination: str, day, criterion: str = "earliest",
+               max_stops: int = MAX_STOPS, min_layover: timedelta = MIN_LAYOVER,
+               max_layover: timedelta = MAX_LAYOVER):
+        key = CRITERIA[criterion]
+        start = datetime(day.year, day.month, day.day)
+        origin, destination = origin.upper(), destination.upper()
+
+        with self._lock:
+            max_legs = max_stops + 1
+            feeders = {airport for airport, arrivals in self._routes.items() if destination in arrivals}
+
+            # Can a leg that is the n-th of the trip still reach the destination?
+            def useful(leg, n):
+                if leg.arrival_airport == destination:
+                    return True
+                if n == max_legs:
+                    return False
+                return n < max_legs - 1 or leg.arrival_airport in feeders
+
+            heap = []
+            counter = 0
+            for leg in self._departing(origin, start, start + timedelta(days=1)):
+                if not useful(leg, 1):
+                    continue
+                heapq.heappush(heap, (key(1, leg.price, leg), counter, leg, 1, leg.price, None))
+                counter += 1
+
+            fewest_legs = {}
+            while heap:
+                _, _, leg, legs, price, parent = heapq.heappop(heap)
+                if leg.arrival_airport == destination:
+                    return _itinerary(leg, parent)
+                if fewest_legs.get(leg.id, legs + 1) <= legs:
+                    continue
+                fewest_legs[leg.id] = legs
+
+                visited = _airports(leg, parent)
+                node = (leg, parent)
+                window = self._departing(leg.arrival_airport, leg.arrival_time + min_layover,
+                                         leg.arrival_time + max_layover + timedelta(microseconds=1))
+                for next_leg in window:
+                    # Already expanded at no more stops from a better label
+                    if next_leg.arrival_airport in visited or fewest_legs.get(next_leg.id, legs + 2) <= legs + 1:
+                        continue
+                    if not useful(next_leg, legs + 1):
+                        continue
+                    total = price + next_leg.price
+                    heapq.heappush(heap, (key(legs + 1, total, next_leg), counter, next_leg, legs + 1, total, node))
+                    counter += 1
+        return None
+
+    # The earliest-arrival, cheapest and fewest-stop itineraries in one call
+    def search_all(self, origin: str, destination: str, day, **limits):
+        return {criterion: self.search(origin, destination, day, criterion, **limits) for criterion in CRITERIA}
+
+    # Bring these legs in line with the flights table, so changes made by
+    # other processes to the flights about to be shown are never missed.
+    # Returns the ids of the legs that changed.
+    def refresh_legs(self, db: Session, flight_ids):
+        rows = {row.id: row for row in
+                db.query(*LEG_COLUMNS, Flight.status).filter(Flight.id.in_(flight_ids))}
+        changed = set()
+        with self._lock:
+            for flight_id in flight_ids:
+                row = rows.get(flight_id)
+                if row is None or row.status not in BOOKABLE_STATUSES:
+                    if self.remove(flight_id):
+                        changed.add(flight_id)
+                    continue
+                fresh = Leg(*row[:len(LEG_COLUMNS)])
+                if fresh != self._legs.get(flight_id):
+                    self.add(fresh)
+                    changed.add(flight_id)
+        return changed
+
+
+def _airports(leg, parent):
+    airports = {leg.departure_airport, leg.arrival_airport}
+    while parent is not None:
+        leg, parent = parent
+        airports.add(leg.departure_airport)
+    return airports
+
+def _itinerary(leg, parent):
+    legs = [leg]
+    while parent is not None:
+        leg, parent = parent
+        legs.append(leg)
+    legs.reverse()
+    return Itinerary(
+        legs=legs,
+        departure_time=legs[0].departure_time,
+        arrival_time=legs[-1].arrival_time,
+        total_price=sum(leg.price for leg in legs),
+        stops=len(legs) - 1,
+    )
+
+
+# Process-wide index, filled by load() on first use, kept current through
+# services.flight_changed and rebuilt once it is older than its ttl
+route_graph = RouteGraph()
+
+def get_route_graph(db: Session):
+    if route_graph.stale:
+        route_graph.load(db)
+    return route_graph
+
+# search_all on the process-wide graph, with every leg of the results read
+# back from the flights table (one primary key lookup for at most a dozen
+# ids). A leg that was sold out, cancelled, retimed or archived elsewhere is
+# corrected in the graph and the search runs again; an itinerary whose legs
+# still changed in the last round is left out.
+def search_itineraries(db: Session, origin: str, destination: str, day, **limits):
+    graph = get_route_graph(db)
+    for _ in range(RECHECK_ROUNDS):
+        itineraries = graph.search_all(origin, destination, day, **limits)
+        flight_ids = {leg.id for itinerary in itineraries.values() if itinerary for leg in itinerary.legs}
+        changed = graph.refresh_legs(db, flight_ids) if flight_ids else set()
+        if not changed:
+            return itineraries
+    return {criterion: None if itinerary is None or changed & {leg.id for leg in itinerary.legs} else itinerary
+            for criterion, itinerary in itineraries.items()}
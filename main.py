@@ -1,28 +1,44 @@
+import gc
 import os
-import random
-import string
-from datetime import datetime, timedelta
+import sys
+from datetime import datetime
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 import colorama
 from colorama import Fore, Style
 
-from database import engine, Base, get_db
-from models import Flight, Passenger, Booking, FlightClass, FlightStatus
+from database import create_schema, SessionLocal
+from models import Flight, FlightClass, FlightStatus
+from services import (create_flight, create_passenger, create_booking, cancel_reservation, cancel_failure,
+                      find_passenger, find_booking, join_waitlist, search_flight_rows, flights_page, bookings_page)
+from seat_map import get_seat_map, free_seats
+from itineraries import get_route_graph, search_itineraries, MAX_STOPS
+import instrumentation
+import batch
+from flight_status import StatusScheduler
+from fare_calendar import fare_calendar_month
 
 # Initialize colorama
 colorama.init()
 
 # Create database tables
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    create_schema()
     print(f"{Fore.GREEN}Database initialized successfully!{Style.RESET_ALL}")
 
+# ANSI clear and home instead of running the clear command in a shell;
+# colorama translates it on Windows. Nothing is written when the output is
+# not a terminal.
 def clear_screen():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if sys.stdout.isatty():
+        print("\033[2J\033[H", end="", flush=True)
 
-def generate_booking_reference():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+def show_result(result):
+    color = Fore.GREEN if result.ok else Fore.RED
+    print(f"{color}{result.message}{Style.RESET_ALL}")
+
+def show_next_page():
+    return input("\nPress Enter for the next page, or q to stop: ").strip().lower() != 'q'
 
 def display_menu():
     clear_screen()
@@ -55,24 +71,9 @@ def add_flight(db: Session):
         departure_time = datetime.strptime(departure_time, "%d-%m-%Y %H:%M")
         arrival_time = datetime.strptime(arrival_time, "%d-%m-%Y %H:%M")
         
-        flight = Flight(
-            flight_number=flight_number,
-            airline=airline,
-            departure_airport=departure_airport,
-            arrival_airport=arrival_airport,
-            departure_time=departure_time,
-            arrival_time=arrival_time,
-            total_seats=total_seats,
-            available_seats=total_seats,
-            price=price,
-            status=FlightStatus.SCHEDULED
-        )
-        
-        db.add(flight)
-        db.commit()
-        print(f"{Fore.GREEN}Flight added successfully!{Style.RESET_ALL}")
-    except Exception as e:
-        db.rollback()
+        show_result(create_flight(db, flight_number, airline, departure_airport, arrival_airport,
+                                  departure_time, arrival_time, total_seats, price))
+    except ValueError as e:
         print(f"{Fore.RED}Error: {str(e)}{Style.RESET_ALL}")
     
     input("\nPress Enter to continue...")
@@ -81,17 +82,22 @@ def view_flights(db: Session):
     clear_screen()
     print(f"{Fore.YELLOW}=== Available Flights ==={Style.RESET_ALL}\n")
     
-    flights = db.query(Flight).all()
+    flights, after = flights_page(db)
     
     if not flights:
         print("No flights found.")
     else:
         print(f"{'ID':<5} {'Flight':<10} {'From':<5} {'To':<5} {'Departure':<20} {'Arrival':<20} {'Seats':<10} {'Price':<10} {'Status':<15}")
         print("-" * 100)
-        for flight in flights:
-            print(f"{flight.id:<5} {flight.flight_number:<10} {flight.departure_airport:<5} {flight.arrival_airport:<5} "
-                  f"{flight.departure_time.strftime('%Y-%m-%d %H:%M'):<20} {flight.arrival_time.strftime('%Y-%m-%d%H:%M'):<20} "
-                  f"{flight.available_seats}/{flight.total_seats:<9} Rs.{flight.price:<9.2f} {flight.status.value:<15}")
+        # Page through the schedule instead of loading every flight at once
+        while flights:
+            for flight in flights:
+                print(f"{flight.id:<5} {flight.flight_number:<10} {flight.departure_airport:<5} {flight.arrival_airport:<5} "
+                      f"{flight.departure_time.strftime('%Y-%m-%d %H:%M'):<20} {flight.arrival_time.strftime('%Y-%m-%d%H:%M'):<20} "
+                      f"{flight.available_seats}/{flight.total_seats:<9} Rs.{flight.price:<9.2f} {flight.status.value:<15}")
+            if after is None or not show_next_page():
+                break
+            flights, after = flights_page(db, after)
     
     input("\nPress Enter to continue...")
 
@@ -103,21 +109,14 @@ def search_flights(db: Session):
     arrival = input("Enter arrival airport (leave empty to skip): ").upper()
     date = input("Enter date (DD-MM-YYYY, leave empty to skip): ")
     
-    query = db.query(Flight)
-    
-    if departure:
-        query = query.filter(Flight.departure_airport == departure)
-    if arrival:
-        query = query.filter(Flight.arrival_airport == arrival)
+    date_obj = None
     if date:
         try:
             date_obj = datetime.strptime(date, "%d-%m-%Y")
-            next_day = date_obj + timedelta(days=1)
-            query = query.filter(Flight.departure_time >= date_obj, Flight.departure_time < next_day)
         except ValueError:
             print(f"{Fore.RED}Invalid date format. Please use DD-MM-YYYY.{Style.RESET_ALL}")
     
-    flights = query.all()
+    flights = search_flight_rows(db, departure, arrival, date_obj)
     
     if not flights:
         print("No flights found matching your criteria.")
@@ -129,6 +128,31 @@ def search_flights(db: Session):
                   f"{flight.departure_time.strftime('%d-%m-%Y %H:%M'):<20} {flight.arrival_time.strftime('%d-%m-%Y %H:%M'):<20} "
                   f"{flight.available_seats}/{flight.total_seats:<9} Rs.{flight.price:<9.2f}")
     
+    # A route without a date also gets this month's cheapest fare per day
+    if departure and arrival and not date_obj:
+        today = datetime.now()
+        days = fare_calendar_month(db, departure, arrival, today.year, today.month)
+        if days:
+            print(f"\n{Fore.CYAN}Fare calendar for {today.strftime('%B %Y')}:{Style.RESET_ALL}")
+        for day in days:
+            fare = f"Rs.{day.min_price:.2f}" if day.min_price is not None else "Sold out"
+            print(f"{day.day.strftime('%d-%m-%Y')}  {fare:<14} {day.flights} flights, {day.seats} seats left")
+    
+    # Connecting itineraries need both ends of the route and a date
+    if departure and arrival and date_obj:
+        itineraries = search_itineraries(db, departure, arrival, date_obj)
+        labels = {"earliest": "Earliest arrival", "cheapest": "Cheapest", "fewest_stops": "Fewest stops"}
+        if any(itineraries.values()):
+            print(f"\n{Fore.CYAN}Best itineraries (up to {MAX_STOPS} stops):{Style.RESET_ALL}")
+        for criterion, itinerary in itineraries.items():
+            if itinerary is None:
+                continue
+            route = " -> ".join([itinerary.legs[0].departure_airport] + [leg.arrival_airport for leg in itinerary.legs])
+            flights = ", ".join(leg.flight_number for leg in itinerary.legs)
+            print(f"{labels[criterion]:<17} {route:<25} {flights:<25} "
+                  f"{itinerary.departure_time.strftime('%d-%m-%Y %H:%M')} - {itinerary.arrival_time.strftime('%d-%m-%Y %H:%M')} "
+                  f"Rs.{itinerary.total_price:.2f}")
+    
     input("\nPress Enter to continue...")
 
 def add_passenger(db: Session):
@@ -145,20 +169,8 @@ def add_passenger(db: Session):
     try:
         dob_date = datetime.strptime(dob, "%Y-%m-%d").date()
         
-        passenger = Passenger(
-            first_name=first_name,
-            last_name=last_name,
-            email=email,
-            phone=phone,
-            passport_number=passport,
-            date_of_birth=dob_date
-        )
-        
-        db.add(passenger)
-        db.commit()
-        print(f"{Fore.GREEN}Passenger added successfully!{Style.RESET_ALL}")
-    except Exception as e:
-        db.rollback()
+        show_result(create_passenger(db, first_name, last_name, email, phone, passport, dob_date))
+    except ValueError as e:
         print(f"{Fore.RED}Error: {str(e)}{Style.RESET_ALL}")
     
     input("\nPress Enter to continue...")
@@ -167,8 +179,8 @@ def book_flight(db: Session):
     clear_screen()
     print(f"{Fore.YELLOW}=== Book a Flight ==={Style.RESET_ALL}")
     
-    # Show available flights
-    flights = db.query(Flight).filter(Flight.available_seats > 0, Flight.status == FlightStatus.SCHEDULED).all()
+    # Show available flights, a page at a time
+    flights, after = flights_page(db, bookable=True)
     
     if not flights:
         print("No available flights found.")
@@ -178,9 +190,13 @@ def book_flight(db: Session):
     print("\nAvailable Flights:")
     print(f"{'ID':<5} {'Flight':<10} {'From':<5} {'To':<5} {'Departure':<20} {'Price':<10}")
     print("-" * 70)
-    for flight in flights:
-        print(f"{flight.id:<5} {flight.flight_number:<10} {flight.departure_airport:<5} {flight.arrival_airport:<5} "
-              f"{flight.departure_time.strftime('%d-%m-%Y %H:%M'):<20} Rs.{flight.price:<.2f}")
+    while flights:
+        for flight in flights:
+            print(f"{flight.id:<5} {flight.flight_number:<10} {flight.departure_airport:<5} {flight.arrival_airport:<5} "
+                  f"{flight.departure_time.strftime('%d-%m-%Y %H:%M'):<20} Rs.{flight.price:<.2f}")
+        if after is None or not show_next_page():
+            break
+        flights, after = flights_page(db, after, bookable=True)
     
     try:
         flight_id = int(input("\nEnter flight ID to book: "))
@@ -192,9 +208,7 @@ def book_flight(db: Session):
             return
             
         if flight.available_seats <= 0:
-            print(f"{Fore.RED}No available seats on this flight.{Style.RESET_ALL}")
-            input("\nPress Enter to continue...")
-            return
+            print(f"{Fore.YELLOW}This flight is full, but you can join its waitlist.{Style.RESET_ALL}")
         
         # Get passenger details
         print("\nPassenger Details:")
@@ -202,38 +216,25 @@ def book_flight(db: Session):
         last_name = input("Last Name: ")
         email = input("Email: ")
         
-        # Check if passenger exists, if not create new
-        passenger = db.query(Passenger).filter(Passenger.email == email).first()
-        
-        if not passenger:
-            phone = input("Phone: ")
-            passport = input("Passport Number: ")
+        # New passengers are created together with the booking
+        details = {}
+        if not find_passenger(db, email):
+            details["phone"] = input("Phone: ")
+            details["passport_number"] = input("Passport Number: ")
             dob = input("Date of Birth (DD-MM-YYYY): ")
             
             try:
-                dob_date = datetime.strptime(dob, "%d-%m-%Y").date()
-                
-                passenger = Passenger(
-                    first_name=first_name,
-                    last_name=last_name,
-                    email=email,
-                    phone=phone,
-                    passport_number=passport,
-                    date_of_birth=dob_date
-                )
-                
-                db.add(passenger)
-                db.flush()  # Get the passenger ID without committing the transaction
-            except Exception as e:
-                db.rollback()
+                details["date_of_birth"] = datetime.strptime(dob, "%d-%m-%Y").date()
+            except ValueError as e:
                 print(f"{Fore.RED}Error creating passenger: {str(e)}{Style.RESET_ALL}")
                 input("\nPress Enter to continue...")
                 return
         
         # Get seat class
+        seat_map = get_seat_map(db, flight.id)
         print("\nAvailable Classes:")
         for i, cls in enumerate(FlightClass, 1):
-            print(f"{i}. {cls.value}")
+            print(f"{i}. {cls.value} ({free_seats(seat_map, cls)} seats left)")
         
         class_choice = int(input("Select class (1-3): "))
         if class_choice < 1 or class_choice > len(FlightClass):
@@ -242,30 +243,27 @@ def book_flight(db: Session):
             return
             
         flight_class = list(FlightClass)[class_choice - 1]
+        seat_number = input("Preferred seat (e.g. E12, leave empty for any): ").strip().upper()
         
-        # Generate seat number (simple implementation)
-        seat_number = f"{flight_class.value[0]}{flight.available_seats}"
+        # Reserve the seat atomically and create the booking
+        result = create_booking(db, flight.id, flight_class, email, first_name, last_name,
+                                seat_number=seat_number or None, **details)
         
-        # Create booking
-        booking = Booking(
-            booking_reference=generate_booking_reference(),
-            flight_id=flight.id,
-            passenger_id=passenger.id,
-            seat_number=seat_number,
-            flight_class=flight_class
-        )
-        
-        # Update available seats
-        flight.available_seats -= 1
-        
-        db.add(booking)
-        db.commit()
+        if not result.ok:
+            show_result(result)
+            if result.status == "sold_out" and input("\nJoin the waitlist for this class? (y/n): ").lower() == 'y':
+                tier = input("Loyalty tier (0-3, leave empty for none): ").strip()
+                show_result(join_waitlist(db, flight.id, flight_class, email, first_name, last_name,
+                                          loyalty_tier=int(tier or 0), **details))
+            input("\nPress Enter to continue...")
+            return
         
-        print(f"\n{Fore.GREEN}Booking successful!{Style.RESET_ALL}")
+        booking = result.value
+        print(f"\n{Fore.GREEN}{result.message}{Style.RESET_ALL}")
         print(f"Booking Reference: {booking.booking_reference}")
         print(f"Flight: {flight.flight_number} from {flight.departure_airport} to {flight.arrival_airport}")
-        print(f"Passenger: {passenger.first_name} {passenger.last_name}")
-        print(f"Seat: {seat_number} ({flight_class.value})")
+        print(f"Passenger: {booking.passenger.first_name} {booking.passenger.last_name}")
+        print(f"Seat: {booking.seat_number} ({flight_class.value})")
         
     except ValueError:
         print(f"{Fore.RED}Invalid input. Please enter a valid number.{Style.RESET_ALL}")
@@ -281,15 +279,8 @@ def view_bookings(db: Session):
     
     ref_or_email = input("Enter booking reference or passenger email (leave empty to view all): ").strip()
     
-    if ref_or_email:
-        # Search by booking reference or email
-        bookings = db.query(Booking).join(Passenger).filter(
-            (Booking.booking_reference == ref_or_email) | 
-            (Passenger.email == ref_or_email)
-        ).all()
-    else:
-        # Get all bookings
-        bookings = db.query(Booking).all()
+    # Search by booking reference or email, or get all bookings
+    bookings, after = bookings_page(db, ref_or_email)
     
     if not bookings:
         print("No bookings found.")
@@ -298,13 +289,22 @@ def view_bookings(db: Session):
               f"{'Departure':<20} {'Seat':<10} {'Class':<15} {'Status':<10}")
         print("-" * 100)
         
-        for booking in bookings:
-            status = "Cancelled" if booking.is_cancelled else "Confirmed"
-            print(f"{booking.booking_reference:<10} "
-                  f"{booking.passenger.first_name} {booking.passenger.last_name:<15} "
-                  f"{booking.flight.flight_number:<10} {booking.flight.departure_airport:<5} {booking.flight.arrival_airport:<5} "
-                  f"{booking.flight.departure_time.strftime('%d-%m-%Y %H:%M'):<20} "
-                  f"{booking.seat_number:<10} {booking.flight_class.value:<15} {status:<10}")
+        while bookings:
+            for booking in bookings:
+                if booking.is_cancelled:
+                    status = "Cancelled"
+                elif booking.status == FlightStatus.DELAYED:
+                    status = "Delayed"
+                else:
+                    status = "Confirmed"
+                print(f"{booking.booking_reference:<10} "
+                      f"{booking.first_name} {booking.last_name:<15} "
+                      f"{booking.flight_number:<10} {booking.departure_airport:<5} {booking.arrival_airport:<5} "
+                      f"{booking.departure_time.strftime('%d-%m-%Y %H:%M'):<20} "
+                      f"{booking.seat_number:<10} {booking.flight_class.value:<15} {status:<10}")
+            if after is None or not show_next_page():
+                break
+            bookings, after = bookings_page(db, ref_or_email, after)
     
     input("\nPress Enter to continue...")
 
@@ -319,10 +319,11 @@ def cancel_booking(db: Session):
         input("\nPress Enter to continue...")
         return
     
-    booking = db.query(Booking).filter(Booking.booking_reference == ref).first()
+    booking = find_booking(db, ref)
     
     if not booking:
-        print(f"{Fore.RED}Booking not found.{Style.RESET_ALL}")
+        # Not found, or moved to the archive with its completed flight
+        show_result(cancel_failure(db, ref))
     elif booking.is_cancelled:
         print(f"{Fore.YELLOW}This booking is already cancelled.{Style.RESET_ALL}")
     else:
@@ -336,41 +337,59 @@ def cancel_booking(db: Session):
         confirm = input("\nAre you sure you want to cancel this booking? (y/n): ").lower()
         
         if confirm == 'y':
-            booking.is_cancelled = True
-            booking.flight.available_seats += 1  # Make the seat available again
-            db.commit()
-            print(f"{Fore.GREEN}Booking has been cancelled successfully.{Style.RESET_ALL}")
+            show_result(cancel_reservation(db, booking.booking_reference))
         else:
             print("Cancellation aborted.")
     
     input("\nPress Enter to continue...")
 
-def main():
+MENU_ACTIONS = {
+    '1': add_flight,
+    '2': view_flights,
+    '3': search_flights,
+    '4': add_passenger,
+    '5': book_flight,
+    '6': view_bookings,
+    '7': cancel_booking,
+}
+
+# With arguments, run one batch command (see batch.py) and return its exit
+# status; without, run the interactive menu
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return batch.main(argv)
+
+    # FLIGHT_INSTRUMENTATION=<file> records SQL and per-operation metrics for
+    # the session and writes them to <file> on exit (JSON for a .json file)
+    report_path = os.environ.get("FLIGHT_INSTRUMENTATION")
+    if report_path:
+        slow_query_ms = float(os.environ.get("FLIGHT_SLOW_QUERY_MS", instrumentation.SLOW_QUERY_MS))
+        instrumentation.enable(slow_query_ms=slow_query_ms)
+    
     # Initialize database
     init_db()
-    
-    # Create a database session
-    db = next(get_db())
+    # Load the route graph now and park it, with everything else alive at
+    # startup, outside the garbage collector's generations: a million
+    # long-lived legs otherwise make every full collection walk the whole
+    # index. Frozen objects are never collected, so this happens once. The
+    # cost is that the first graph stays in memory after its GRAPH_TTL
+    # rebuild replaces it, and later graphs are walked by the collector again.
+    with SessionLocal() as db:
+        get_route_graph(db)
+    gc.freeze()
+    # Depart and land flights as their times pass, while the menu is open
+    scheduler = StatusScheduler().start()
     
     # Main menu loop
     while True:
         try:
             choice = display_menu()
             
-            if choice == '1':
-                add_flight(db)
-            elif choice == '2':
-                view_flights(db)
-            elif choice == '3':
-                search_flights(db)
-            elif choice == '4':
-                add_passenger(db)
-            elif choice == '5':
-                book_flight(db)
-            elif choice == '6':
-                view_bookings(db)
-            elif choice == '7':
-                cancel_booking(db)
+            if choice in MENU_ACTIONS:
+                # A fresh session per screen, so nothing is held between actions
+                with SessionLocal() as db:
+                    MENU_ACTIONS[choice](db)
             elif choice == '8':
                 print("\nThank you for using FlyNow. Goodbye!")
                 break
@@ -385,7 +404,10 @@ def main():
             print(f"\n{Fore.RED}An error occurred: {str(e)}{Style.RESET_ALL}")
             input("\nPress Enter to continue...")
     
-    db.close()
+    scheduler.stop()
+    if report_path:
+        with open(report_path, "w") as f:
+            f.write(instrumentation.instrumentation.export("json" if report_path.endswith(".json") else "text"))
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
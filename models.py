@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Float, Boolean, Enum
+from sqlalchemy import (Column, Integer, String, Date, DateTime, ForeignKey, Float, Boolean, Enum, LargeBinary, Index,
+                        DDL, event)
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -16,6 +17,10 @@ class FlightStatus(enum.Enum):
     DEPARTED = "Departed"
     ARRIVED = "Arrived"
 
+# Statuses a flight is on sale in. A delay only moves the flight's times, so
+# a delayed flight can still be booked until it departs or is cancelled.
+BOOKABLE_STATUSES = (FlightStatus.SCHEDULED, FlightStatus.DELAYED)
+
 class Flight(Base):
     __tablename__ = "flights"
     
@@ -33,6 +38,28 @@ class Flight(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     bookings = relationship("Booking", back_populates="flight")
+    seat_map = relationship("SeatMap", back_populates="flight", uselist=False)
+    
+    __table_args__ = (
+        # search_flights: route equality plus a departure_time range
+        Index("ix_flights_route_departure", "departure_airport", "arrival_airport", "departure_time"),
+        # search_flights by date only, and keyset pagination on (departure_time, id)
+        Index("ix_flights_departure_time", "departure_time"),
+        # book_flight: scheduled flights with seats left
+        Index("ix_flights_status_departure", "status", "departure_time"),
+    )
+
+class SeatMap(Base):
+    __tablename__ = "seat_maps"
+    
+    # One bit per seat, cabins laid out First, Business, Economy (see seat_map.py)
+    flight_id = Column(Integer, ForeignKey("flights.id"), primary_key=True)
+    first_seats = Column(Integer, nullable=False)
+    business_seats = Column(Integer, nullable=False)
+    economy_seats = Column(Integer, nullable=False)
+    occupied = Column(LargeBinary, nullable=False)
+    
+    flight = relationship("Flight", back_populates="seat_map")
 
 class Passenger(Base):
     __tablename__ = "passengers"
@@ -53,8 +80,8 @@ class Booking(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     booking_reference = Column(String(10), unique=True, nullable=False)
-    flight_id = Column(Integer, ForeignKey("flights.id"), nullable=False)
-    passenger_id = Column(Integer, ForeignKey("passengers.id"), nullable=False)
+    flight_id = Column(Integer, ForeignKey("flights.id"), nullable=False, index=True)
+    passenger_id = Column(Integer, ForeignKey("passengers.id"), nullable=False, index=True)
     seat_number = Column(String(10), nullable=False)
     flight_class = Column(Enum(FlightClass), nullable=False)
     booking_date = Column(DateTime, default=datetime.utcnow)
@@ -62,3 +89,163 @@ class Booking(Base):
     
     flight = relationship("Flight", back_populates="bookings")
     passenger = relationship("Passenger", back_populates="bookings")
+    
+    __table_args__ = (
+        # Active bookings per flight (seat map backfill, consistency checks)
+        Index("ix_bookings_active_flight", "flight_id", sqlite_where=is_cancelled == False),  # noqa: E712
+        # Keyset pagination on (booking_date, id)
+        Index("ix_bookings_booking_date", "booking_date"),
+    )
+
+# A passenger waiting for a seat in a full cabin (see waitlist.py). A
+# cancellation in that cabin books the first entry in queue order: highest
+# loyalty tier first, then the earliest request.
+class WaitlistEntry(Base):
+    __tablename__ = "waitlist"
+    
+    id = Column(Integer, primary_key=True)
+    flight_id = Column(Integer, ForeignKey("flights.id"), nullable=False)
+    passenger_id = Column(Integer, ForeignKey("passengers.id"), nullable=False)
+    flight_class = Column(Enum(FlightClass), nullable=False)
+    loyalty_tier = Column(Integer, nullable=False, default=0)
+    requested_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # One cabin's queue in promotion order; the head is the first entry
+        Index("ix_waitlist_queue", flight_id, flight_class, loyalty_tier.desc(), requested_at, id),
+        # One place per passenger per flight
+        Index("ix_waitlist_flight_passenger", flight_id, passenger_id, unique=True),
+    )
+
+# A delay or cancellation that hit a booking, written by flight_status.py.
+# booking_id has no foreign key: archive.py moves bookings to
+# bookings_archive with the same id, and the record still applies there.
+class BookingDisruption(Base):
+    __tablename__ = "booking_disruptions"
+    
+    id = Column(Integer, primary_key=True)
+    booking_id = Column(Integer, nullable=False, index=True)
+    flight_id = Column(Integer, nullable=False, index=True)
+    status = Column(Enum(FlightStatus), nullable=False)   # DELAYED or CANCELLED
+    delay_minutes = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Completed flights and their bookings, moved out of the hot tables by
+# archive.py. Rows keep their original ids and columns, plus when they were
+# archived. Flight numbers are not unique here: a number can be flown again
+# once its earlier flight is archived.
+class ArchivedFlight(Base):
+    __tablename__ = "flights_archive"
+    
+    id = Column(Integer, primary_key=True)
+    flight_number = Column(String(20), nullable=False, index=True)
+    airline = Column(String(100), nullable=False)
+    departure_airport = Column(String(100), nullable=False)
+    arrival_airport = Column(String(100), nullable=False)
+    departure_time = Column(DateTime, nullable=False)
+    arrival_time = Column(DateTime, nullable=False)
+    total_seats = Column(Integer, nullable=False)
+    available_seats = Column(Integer, nullable=False)
+    price = Column(Float, nullable=False)
+    status = Column(Enum(FlightStatus))
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    
+    bookings = relationship("ArchivedBooking", back_populates="flight")
+
+class ArchivedBooking(Base):
+    __tablename__ = "bookings_archive"
+    
+    id = Column(Integer, primary_key=True)
+    booking_reference = Column(String(10), nullable=False, index=True)
+    flight_id = Column(Integer, ForeignKey("flights_archive.id"), nullable=False, index=True)
+    passenger_id = Column(Integer, ForeignKey("passengers.id"), nullable=False, index=True)
+    seat_number = Column(String(10), nullable=False)
+    flight_class = Column(Enum(FlightClass), nullable=False)
+    booking_date = Column(DateTime)
+    is_cancelled = Column(Boolean)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    
+    flight = relationship("ArchivedFlight", back_populates="bookings")
+    passenger = relationship("Passenger")
+    
+    __table_args__ = (
+        # bookings_page merges archived rows in (booking_date, id) order
+        Index("ix_bookings_archive_booking_date", "booking_date"),
+    )
+
+# Cheapest bookable fare per route and day, for month views (see
+# fare_calendar.py). Counts cover scheduled flights; min_price only those
+# with seats left, and is NULL when the day is sold out.
+class FareCalendarDay(Base):
+    __tablename__ = "fare_calendar"
+    
+    departure_airport = Column(String(100), primary_key=True)
+    arrival_airport = Column(String(100), primary_key=True)
+    day = Column(Date, primary_key=True)
+    min_price = Column(Float)
+    flights = Column(Integer, nullable=False, default=0)
+    seats = Column(Integer, nullable=False, default=0)
+    
+    # Rows are stored in key order, so a month is one contiguous range
+    __table_args__ = {"sqlite_with_rowid": False}
+
+_BOOKABLE_SQL = ", ".join(f"'{status.name}'" for status in BOOKABLE_STATUSES)
+
+# Recompute the calendar day of one flight row (NEW or OLD) from the flights
+# on that route and day: a short range of ix_flights_route_departure
+def _fare_calendar_day_sql(row):
+    return f"""
+        INSERT INTO fare_calendar (departure_airport, arrival_airport, day, min_price, flights, seats)
+        SELECT {row}.departure_airport, {row}.arrival_airport, date({row}.departure_time),
+               MIN(CASE WHEN available_seats > 0 THEN price END), COUNT(id), COALESCE(SUM(available_seats), 0)
+        FROM flights
+        WHERE departure_airport = {row}.departure_airport AND arrival_airport = {row}.arrival_airport
+          AND departure_time >= date({row}.departure_time) AND departure_time < date({row}.departure_time, '+1 day')
+          AND status IN ({_BOOKABLE_SQL})
+        ON CONFLICT (departure_airport, arrival_airport, day) DO UPDATE SET
+            min_price = excluded.min_price, flights = excluded.flights, seats = excluded.seats;"""
+
+_FARE_COLUMNS = "departure_airport, arrival_airport, departure_time, available_seats, price, status"
+_ROUTE_COLUMNS = "departure_airport, arrival_airport, departure_time"
+
+# Every write to flights - bookings, cancellations, imports, status changes,
+# archiving - keeps the calendar current inside the same statement, whichever
+# code path or process makes it. A flight that moves to another route or day
+# also refreshes the day it left.
+FARE_CALENDAR_TRIGGERS = {
+    "fare_calendar_flight_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS fare_calendar_flight_insert AFTER INSERT ON flights
+        BEGIN {_fare_calendar_day_sql("NEW")} END""",
+    "fare_calendar_flight_update": f"""
+        CREATE TRIGGER IF NOT EXISTS fare_calendar_flight_update AFTER UPDATE OF {_FARE_COLUMNS} ON flights
+        BEGIN {_fare_calendar_day_sql("NEW")} END""",
+    "fare_calendar_flight_move": f"""
+        CREATE TRIGGER IF NOT EXISTS fare_calendar_flight_move AFTER UPDATE OF {_ROUTE_COLUMNS} ON flights
+        WHEN OLD.departure_airport IS NOT NEW.departure_airport OR OLD.arrival_airport IS NOT NEW.arrival_airport
+          OR date(OLD.departure_time) IS NOT date(NEW.departure_time)
+        BEGIN {_fare_calendar_day_sql("OLD")} END""",
+    "fare_calendar_flight_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS fare_calendar_flight_delete AFTER DELETE ON flights
+        BEGIN {_fare_calendar_day_sql("OLD")} END""",
+}
+
+# The whole calendar from scratch, one GROUP BY over the bookable flights
+FARE_CALENDAR_QUERY = f"""
+    SELECT departure_airport, arrival_airport, date(departure_time),
+           MIN(CASE WHEN available_seats > 0 THEN price END), COUNT(id), SUM(available_seats)
+    FROM flights
+    WHERE status IN ({_BOOKABLE_SQL})
+    GROUP BY departure_airport, arrival_airport, date(departure_time)"""
+
+FARE_CALENDAR_REBUILD = f"""
+    INSERT INTO fare_calendar (departure_airport, arrival_airport, day, min_price, flights, seats)
+    {FARE_CALENDAR_QUERY}"""
+
+# A database that gains the table gets a filled calendar and the triggers.
+# This runs once every table exists, since the calendar is built from flights.
+@event.listens_for(Base.metadata, "after_create")
+def _create_fare_calendar(target, connection, tables=(), **kw):
+    if FareCalendarDay.__table__ in tables:
+        for ddl in (FARE_CALENDAR_REBUILD, *FARE_CALENDAR_TRIGGERS.values()):
+            connection.execute(DDL(ddl))
@@ -0,0 +1,443 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from database import BASE_DIR, SQLALCHEMY_DATABASE_URL, DB_PROFILE, ENGINE_PROFILES, create_sqlite_engine, create_schema
+from models import FlightClass, FlightStatus
+
+# Extracted columns, kept between runs so a refresh only reads what changed
+REPORT_CACHE_DIR = os.path.join(BASE_DIR, "report_cache")
+CACHE_VERSION = 1
+
+# Rows converted to arrays per fetch while extracting, and bookings
+# aggregated per pass in a report; memory use is bounded by these, not by
+# the size of the tables
+FETCH_CHUNK = 100_000
+REPORT_CHUNK = 2_000_000
+
+# Ids per IN (...) when re-reading flights or bookings by id
+IN_CHUNK = 500
+
+GROUPINGS = ("route", "airline", "class", "all")
+
+SECONDS_PER_DAY = 86400
+
+# Flights, hot and archived, as one structured array in id order. airline
+# and route are indexes into the name lists kept in the cache metadata, hot
+# is False once the flight is in flights_archive (and can no longer change).
+FLIGHT_DTYPE = np.dtype([
+    ("id", "i8"), ("airline", "i4"), ("route", "i4"), ("departure", "i8"), ("total_seats", "i4"),
+    ("available_seats", "i4"), ("price", "f8"), ("status", "i1"), ("hot", "?"),
+])
+# Rows as they come from SQLite, before airline and route are encoded
+FLIGHT_ROW_DTYPE = np.dtype([(name, "O" if name in ("airline", "route") else FLIGHT_DTYPE[name])
+                             for name in FLIGHT_DTYPE.names])
+
+# Bookings, hot and archived, in id order; one file per column
+BOOKING_DTYPE = np.dtype([
+    ("id", "i8"), ("flight_id", "i8"), ("flight_class", "i1"), ("booked", "i8"), ("cancelled", "?"),
+])
+
+# Enums are stored by name; the arrays hold their position in the enum
+FLIGHT_CLASSES = list(FlightClass)
+FLIGHT_STATUSES = list(FlightStatus)
+
+
+def _code(column, enum):
+    cases = " ".join(f"WHEN '{member.name}' THEN {i}" for i, member in enumerate(enum))
+    return f"CASE {column} {cases} ELSE 0 END"
+
+# DateTime text to Unix seconds, for any SQLite version
+def _epoch(column):
+    return f"CAST(ROUND((julianday({column}) - 2440587.5) * {SECONDS_PER_DAY}) AS INTEGER)"
+
+def _flights_sql(table, where):
+    hot = int(table == "flights")
+    return f"""
+        SELECT id, airline, departure_airport || '-' || arrival_airport, {_epoch("departure_time")}, total_seats,
+               available_seats, price, {_code("status", FlightStatus)}, {hot}
+        FROM {table} WHERE {where}"""
+
+_BOOKING_SELECT = (f"SELECT id, flight_id, {_code('flight_class', FlightClass)}, "
+                   f"COALESCE({_epoch('booking_date')}, 0), is_cancelled")
+
+# Bookings added since the last refresh, wherever they are now. Both sides
+# come in primary key order, so SQLite merges them instead of sorting.
+NEW_BOOKINGS_SQL = f"""
+    {_BOOKING_SELECT} FROM bookings WHERE id > :after
+    UNION ALL
+    {_BOOKING_SELECT} FROM bookings_archive WHERE id > :after
+    ORDER BY 1"""
+
+# Active bookings per hot flight, read from ix_bookings_active_flight alone
+ACTIVE_COUNTS_SQL = "SELECT flight_id, COUNT(*) FROM bookings WHERE is_cancelled = 0 GROUP BY flight_id"
+
+# The oldest flight identifies the database: a reseeded file gets a new one
+ORIGIN_SQL = """
+    SELECT id, created_at FROM (SELECT id, created_at FROM flights
+                                UNION ALL SELECT id, created_at FROM flights_archive)
+    ORDER BY id LIMIT 1"""
+
+RefreshReport = namedtuple("RefreshReport", "flights bookings new_bookings reread_flights rebuilt seconds")
+ReportRow = namedtuple("ReportRow", "group flights load_factor bookings cancellation_rate revenue lead_time_days")
+
+
+def _chunks(ids, size=IN_CHUNK):
+    for start in range(0, len(ids), size):
+        yield [int(i) for i in ids[start:start + size]]
+
+def _placeholders(ids):
+    return ", ".join("?" * len(ids))
+
+# Run a query and yield its rows as structured arrays of up to FETCH_CHUNK rows
+def _fetch(cursor, sql, params, dtype):
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(FETCH_CHUNK)
+        if not rows:
+            return
+        yield np.array(rows, dtype=dtype)
+
+def _concat(chunks, dtype):
+    chunks = list(chunks)
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype)
+
+def _encode(values, names, index):
+    codes = list(map(index.get, values))
+    for i, code in enumerate(codes):
+        if code is None:
+            codes[i] = index.setdefault(values[i], len(names))
+            if codes[i] == len(names):
+                names.append(values[i])
+    return np.array(codes, np.int32)
+
+def _fetch_flights(cursor, table, where, params, meta, indexes):
+    flights = []
+    for rows in _fetch(cursor, _flights_sql(table, where), params, FLIGHT_ROW_DTYPE):
+        chunk = np.empty(len(rows), FLIGHT_DTYPE)
+        for name in FLIGHT_DTYPE.names:
+            if name in ("airline", "route"):
+                chunk[name] = _encode(rows[name], meta[f"{name}s"], indexes[name])
+            else:
+                chunk[name] = rows[name]
+        flights.append(chunk)
+    return _concat(flights, FLIGHT_DTYPE)
+
+def _epoch_of(when: datetime):
+    return int((when - datetime(1970, 1, 1)).total_seconds())
+
+
+# The extracted columns on disk: metadata.json, the flights as
+# flights.<generation>.npy, and one raw file per booking column. metadata.json
+# is written last and is what makes a refresh count: booking rows past the
+# count it records are left over from an interrupted refresh and dropped.
+class ReportCache:
+    def __init__(self, path=REPORT_CACHE_DIR):
+        self.path = path
+        self.meta = self._read_meta()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._file("metadata.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get("version") == CACHE_VERSION else None
+
+    def write_meta(self, meta):
+        temp = self._file("metadata.json.tmp")
+        with open(temp, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp, self._file("metadata.json"))
+        self.meta = meta
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+        self.meta = None
+
+    def flights(self):
+        if self.meta is None or self.meta["generation"] == 0:
+            return np.empty(0, FLIGHT_DTYPE)
+        return np.load(self._file(f"flights.{self.meta['generation']}.npy"), mmap_mode="r")
+
+    # Written under the next generation's name; the old file goes once the
+    # metadata pointing at the new one is in place
+    def write_flights(self, flights, meta):
+        meta["generation"] += 1
+        np.save(self._file(f"flights.{meta['generation']}.npy"), flights)
+
+    def drop_old_flights(self, generation):
+        for name in os.listdir(self.path):
+            if name.startswith("flights.") and name != f"flights.{generation}.npy":
+                os.remove(self._file(name))
+
+    def bookings(self, name, count=None, mode="r"):
+        count = self.meta["bookings"] if count is None else count
+        dtype = BOOKING_DTYPE[name]
+        if count == 0:
+            return np.empty(0, dtype)
+        return np.memmap(self._file(f"bookings.{name}"), dtype=dtype, mode=mode, shape=(count,))
+
+    def truncate_bookings(self, count):
+        for name in BOOKING_DTYPE.names:
+            with open(self._file(f"bookings.{name}"), "ab") as f:
+                f.truncate(count * BOOKING_DTYPE[name].itemsize)
+
+    def append_bookings(self, chunk):
+        for name in BOOKING_DTYPE.names:
+            with open(self._file(f"bookings.{name}"), "ab") as f:
+                f.write(np.ascontiguousarray(chunk[name]).tobytes())
+
+
+def _new_meta(db_url, origin):
+    return {"version": CACHE_VERSION, "db": db_url, "origin": origin, "generation": 0, "bookings": 0,
+            "flight_id": 0, "booking_id": 0, "airlines": [], "routes": [], "refreshed_at": None}
+
+def _max_id(cursor, table):
+    return cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+
+# Bring the cache up to date with the database, extracting everything on the
+# first run (or with rebuild=True) and afterwards only:
+# - bookings and flights with ids above the last refresh's; SQLite hands out
+#   max(id) + 1 and archive.py never moves the highest ids, so ids only grow
+# - the hot flights, re-read whole, since seats, price, status and times
+#   change in place; the hot table only holds what is ahead plus a day
+# - flights moved to the archive since, with their bookings as archived
+# - the bookings of hot flights whose active booking count in the table no
+#   longer matches the cache's. A booking only changes by being cancelled,
+#   so equal counts mean nothing on that flight changed.
+# Everything is read in one snapshot, so the cache never holds a booking
+# whose flight it has not seen.
+def refresh(db_url=SQLALCHEMY_DATABASE_URL, path=REPORT_CACHE_DIR, rebuild=False, profile=DB_PROFILE):
+    started = time.perf_counter()
+    engine = create_sqlite_engine(db_url, profile=profile)
+    create_schema(engine)
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute("BEGIN")
+        origin = [str(value) for value in cursor.execute(ORIGIN_SQL).fetchone() or ()]
+        cache = ReportCache(path)
+        meta = cache.meta
+        if (rebuild or meta is None or meta["db"] != db_url or meta["origin"] != origin
+                or max(_max_id(cursor, "flights"), _max_id(cursor, "flights_archive")) < meta["flight_id"]
+                or max(_max_id(cursor, "bookings"), _max_id(cursor, "bookings_archive")) < meta["booking_id"]):
+            cache.clear()
+            meta = _new_meta(db_url, origin)
+        else:
+            meta = dict(meta)
+            cache.truncate_bookings(meta["bookings"])
+        rebuilt = meta["generation"] == 0
+        indexes = {"airline": {name: i for i, name in enumerate(meta["airlines"])},
+                   "route": {name: i for i, name in enumerate(meta["routes"])}}
+
+        old = cache.flights()
+        hot = _fetch_flights(cursor, "flights", "1", (), meta, indexes)
+        # Flight ids are dense, so membership is a lookup in an array indexed by id
+        is_hot = np.zeros(int(max(old["id"].max(initial=0), hot["id"].max(initial=0))) + 1, bool)
+        is_hot[hot["id"]] = True
+        was_hot = old["id"][old["hot"]]
+        moved = was_hot[~is_hot[was_hot]]
+        archived = [_fetch_flights(cursor, "flights_archive", "id > ?", (meta["flight_id"],), meta, indexes)]
+        for ids in _chunks(moved):
+            archived.append(_fetch_flights(cursor, "flights_archive", f"id IN ({_placeholders(ids)})", ids,
+                                           meta, indexes))
+        flights = np.concatenate([old[~old["hot"]], *archived, hot])
+        flights = flights[np.argsort(flights["id"], kind="stable")]
+
+        new_bookings = 0
+        for chunk in _fetch(cursor, NEW_BOOKINGS_SQL, {"after": meta["booking_id"]}, BOOKING_DTYPE):
+            cache.append_bookings(chunk)
+            new_bookings += len(chunk)
+            meta["booking_id"] = int(chunk["id"][-1])
+        count = meta["bookings"] + new_bookings
+
+        reread = 0
+        if not rebuilt and meta["bookings"]:
+            cached = meta["bookings"]
+            flight_ids = cache.bookings("flight_id", cached)
+            cancelled = cache.bookings("cancelled", cached)
+            size = int(max(flights["id"].max(initial=0), flight_ids.max())) + 1
+            cached_active = np.zeros(size, np.int64)
+            for start in range(0, cached, REPORT_CHUNK):
+                stop = start + REPORT_CHUNK
+                cached_active += np.bincount(flight_ids[start:stop][~cancelled[start:stop]], minlength=size)
+            db_active = np.zeros(size, np.int64)
+            for rows in _fetch(cursor, ACTIVE_COUNTS_SQL, (), [("flight_id", "i8"), ("count", "i8")]):
+                inside = rows["flight_id"] < size
+                db_active[rows["flight_id"][inside]] = rows["count"][inside]
+            old_hot = was_hot[is_hot[was_hot]]
+            # New bookings were read as they are now; leave them out of the comparison
+            new_ids = cache.bookings("flight_id", count)[cached:]
+            db_active -= np.bincount(new_ids[~cache.bookings("cancelled", count)[cached:]], minlength=size)[:size]
+            changed = old_hot[cached_active[old_hot] != db_active[old_hot]]
+
+            states = []
+            for table, ids in (("bookings", changed), ("bookings_archive", moved)):
+                for chunk in _chunks(ids):
+                    states += _fetch(cursor, f"SELECT id, is_cancelled FROM {table} "
+                                             f"WHERE flight_id IN ({_placeholders(chunk)}) AND id <= ?",
+                                     chunk + [int(cache.bookings("id", cached)[-1])],
+                                     [("id", "i8"), ("cancelled", "?")])
+            states = _concat(states, np.dtype([("id", "i8"), ("cancelled", "?")]))
+            if len(states):
+                positions = np.searchsorted(cache.bookings("id", cached), states["id"])
+                cancelled = cache.bookings("cancelled", cached, mode="r+")
+                cancelled[positions] = states["cancelled"]
+                cancelled.flush()
+            reread = len(changed) + len(moved)
+            del flight_ids, cancelled
+
+        cache.write_flights(flights, meta)
+        meta["bookings"] = count
+        meta["flight_id"] = max(meta["flight_id"], int(flights["id"].max(initial=0)))
+        meta["refreshed_at"] = datetime.now().isoformat(" ", "seconds")
+        cache.write_meta(meta)
+        cache.drop_old_flights(meta["generation"])
+    finally:
+        raw.rollback()
+        raw.close()
+        engine.dispose()
+    return RefreshReport(len(flights), count, new_bookings, reread, rebuilt, time.perf_counter() - started)
+
+# Aggregate the cache by route, airline, cabin class or overall, for flights
+# departing in [since, until). Every figure is a bincount over group codes,
+# bookings taken REPORT_CHUNK at a time:
+# - load factor: sold seats over seats, flights not cancelled
+# - revenue: the flight's current fare for every active booking
+# - cancellation rate: cancelled bookings over all bookings
+# - lead time: mean days from booking to departure, active bookings
+# Rows come back by revenue, highest first.
+def report(cache: ReportCache, by="route", since: datetime = None, until: datetime = None):
+    if by not in GROUPINGS:
+        raise ValueError(f"Unknown grouping {by!r}, expected one of {', '.join(GROUPINGS)}")
+    names = {"route": cache.meta["routes"], "airline": cache.meta["airlines"],
+             "class": [cls.value for cls in FLIGHT_CLASSES], "all": ["All"]}[by]
+    groups = len(names)
+    flights = np.asarray(cache.flights())
+    flight_ids = cache.bookings("flight_id")
+
+    in_window = np.ones(len(flights), bool)
+    if since is not None:
+        in_window &= flights["departure"] >= _epoch_of(since)
+    if until is not None:
+        in_window &= flights["departure"] < _epoch_of(until)
+    flight_group = flights[by] if by in ("route", "airline") else np.zeros(len(flights), np.int32)
+
+    flight_count = seats = sold = None
+    if by != "class":
+        flying = in_window & (flights["status"] != FLIGHT_STATUSES.index(FlightStatus.CANCELLED))
+        flight_count = np.bincount(flight_group[in_window], minlength=groups)
+        seats = np.bincount(flight_group[flying], weights=flights["total_seats"][flying], minlength=groups)
+        sold = np.bincount(flight_group[flying], minlength=groups,
+                           weights=(flights["total_seats"] - flights["available_seats"])[flying])
+
+    # Booking -> flight position, one gather per chunk instead of a search
+    position = np.full(int(max(flights["id"].max(initial=0), flight_ids.max(initial=0))) + 1, -1, np.int64)
+    position[flights["id"]] = np.arange(len(flights))
+
+    bookings = np.zeros(groups, np.int64)
+    cancelled = np.zeros(groups, np.int64)
+    active = np.zeros(groups, np.int64)
+    revenue = np.zeros(groups)
+    lead_days = np.zeros(groups)
+    for start in range(0, len(flight_ids), REPORT_CHUNK):
+        stop = start + REPORT_CHUNK
+        pos = position[flight_ids[start:stop]]
+        keep = pos >= 0
+        keep[keep] = in_window[pos[keep]]
+        pos = pos[keep]
+        is_cancelled = np.asarray(cache.bookings("cancelled")[start:stop])[keep]
+        if by == "class":
+            group = np.asarray(cache.bookings("flight_class")[start:stop])[keep]
+        else:
+            group = flight_group[pos]
+        live = ~is_cancelled
+        bookings += np.bincount(group, minlength=groups)
+        cancelled += np.bincount(group[is_cancelled], minlength=groups)
+        active += np.bincount(group[live], minlength=groups)
+        revenue += np.bincount(group[live], weights=flights["price"][pos[live]], minlength=groups)
+        booked = np.asarray(cache.bookings("booked")[start:stop])[keep][live]
+        lead_days += np.bincount(group[live], minlength=groups,
+                                 weights=(flights["departure"][pos[live]] - booked) / SECONDS_PER_DAY)
+
+    rows = []
+    for g in np.flatnonzero(bookings + (flight_count if flight_count is not None else 0)):
+        rows.append(ReportRow(
+            names[g],
+            int(flight_count[g]) if flight_count is not None else None,
+            float(sold[g] / seats[g]) if seats is not None and seats[g] else None,
+            int(bookings[g]),
+            float(cancelled[g] / bookings[g]) if bookings[g] else None,
+            float(revenue[g]),
+            float(lead_days[g] / active[g]) if active[g] else None,
+        ))
+    rows.sort(key=lambda row: -row.revenue)
+    return rows
+
+
+def _percent(value):
+    return f"{value:.1%}" if value is not None else "-"
+
+def print_report(rows, by, top=None):
+    print(f"\n{by.capitalize():<14} {'Flights':>9} {'Load':>7} {'Bookings':>11} {'Cancelled':>10} "
+          f"{'Revenue':>22} {'Lead time':>10}")
+    print("-" * 89)
+    for row in rows[:top] if top else rows:
+        flights = f"{row.flights:,}" if row.flights is not None else "-"
+        lead = f"{row.lead_time_days:.1f} d" if row.lead_time_days is not None else "-"
+        print(f"{row.group:<14} {flights:>9} {_percent(row.load_factor):>7} {row.bookings:>11,} "
+              f"{_percent(row.cancellation_rate):>10} {'Rs.' + format(row.revenue, ',.2f'):>22} {lead:>10}")
+    if top and len(rows) > top:
+        print(f"... {len(rows) - top:,} more")
+
+def parse_args(argv=None):
+    date = lambda s: datetime.strptime(s, "%Y-%m-%d")  # noqa: E731
+    parser = argparse.ArgumentParser(description="Load factor, revenue, cancellation and lead time reports.")
+    parser.add_argument("--by", choices=GROUPINGS, default="route", help="grouping (default route)")
+    parser.add_argument("--since", type=date, help="flights departing on or after YYYY-MM-DD")
+    parser.add_argument("--until", type=date, help="flights departing before YYYY-MM-DD")
+    parser.add_argument("--top", type=int, default=20, help="rows shown, 0 for all (default 20)")
+    parser.add_argument("--json", action="store_true", help="print the rows as JSON")
+    parser.add_argument("--rebuild", action="store_true", help="extract everything again")
+    parser.add_argument("--no-refresh", action="store_true", help="report from the cache as it is")
+    parser.add_argument("--cache", default=REPORT_CACHE_DIR, help=f"cache directory (default {REPORT_CACHE_DIR})")
+    parser.add_argument("--profile", choices=ENGINE_PROFILES, default=DB_PROFILE, help="engine profile")
+    parser.add_argument("--db", default=SQLALCHEMY_DATABASE_URL, help="database URL")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.no_refresh:
+        result = refresh(args.db, args.cache, args.rebuild, args.profile)
+        if not args.json:
+            print(f"{'Extracted' if result.rebuilt else 'Refreshed'} {result.flights:,} flights and "
+                  f"{result.bookings:,} bookings: {result.new_bookings:,} new bookings, "
+                  f"{result.reread_flights:,} flights re-read ({result.seconds:.1f}s)")
+    cache = ReportCache(args.cache)
+    if cache.meta is None:
+        print("No report cache yet; run without --no-refresh first.")
+        return 1
+
+    started = time.perf_counter()
+    rows = report(cache, args.by, args.since, args.until)
+    if args.json:
+        print(json.dumps([row._asdict() for row in rows[:args.top or None]], indent=2))
+    else:
+        print_report(rows, args.by, args.top)
+        print(f"\nReport over {cache.meta['bookings']:,} bookings in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,39 @@
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import Flight, Passenger, Booking, BOOKABLE_STATUSES
+
+# Rows sampled from each table by sample_inputs
+SAMPLE_SIZE = 2_000
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+# Random inputs drawn from the database's own data (flights, passenger emails
+# and booking references), looked up by primary key so sampling stays cheap
+# on the large tier. Used by the benchmarks and by generated workloads.
+def sample_inputs(db: Session, rng):
+    max_flight = db.query(func.max(Flight.id)).scalar() or 0
+    max_passenger = db.query(func.max(Passenger.id)).scalar() or 0
+    max_booking = db.query(func.max(Booking.id)).scalar() or 0
+
+    flight_ids = [rng.randint(1, max_flight) for _ in range(SAMPLE_SIZE)] if max_flight else []
+    flights = db.query(Flight.id, Flight.departure_airport, Flight.arrival_airport,
+                       Flight.departure_time, Flight.status).filter(Flight.id.in_(flight_ids)).all()
+    passenger_ids = [rng.randint(1, max_passenger) for _ in range(SAMPLE_SIZE)] if max_passenger else []
+    emails = [email for (email,) in db.query(Passenger.email).filter(Passenger.id.in_(passenger_ids))]
+    booking_ids = [rng.randint(1, max_booking) for _ in range(SAMPLE_SIZE)] if max_booking else []
+    references = [ref for (ref,) in db.query(Booking.booking_reference).filter(Booking.id.in_(booking_ids))]
+
+    return {
+        "flights": flights,
+        "bookable": [f.id for f in flights if f.status in BOOKABLE_STATUSES] or [f.id for f in flights],
+        "passenger_count": max_passenger,
+        "lookups": emails + references,
+        "booked": [],
+    }
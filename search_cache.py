@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+# Default bounds for the process-wide flight search cache
+MAX_ENTRIES = 1024
+TTL_SECONDS = 30.0
+
+
+def _day(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    raise TypeError(f"Expected a date or datetime, got {type(value).__name__}")
+
+# Searches skip empty filters, so the same flight is reachable from every
+# combination of its route and day with some filters left out
+def search_key(departure=None, arrival=None, day=None):
+    return (departure.upper() if departure else None, arrival.upper() if arrival else None, _day(day))
+
+def affected_keys(departure, arrival, departure_time):
+    day = _day(departure_time)
+    return [search_key(dep, arr, d)
+            for dep in (departure, None)
+            for arr in (arrival, None)
+            for d in (day, None)]
+
+
+# Bounded LRU cache of search results with a time-to-live. Writes that change
+# a flight's seats or status invalidate just the keys that flight appears
+# under. Only writes made in this process do: a flight sold out or cancelled
+# by another process can be served as it was for up to ttl seconds. Bookings
+# re-check the seats in the database, so this can never oversell.
+class SearchCache:
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation so a search that started before a
+        # write cannot store its pre-write result afterwards
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    # Returns (found, value, generation); pass generation back to put()
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value, self._generation
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None, self._generation
+
+    def put(self, key, value, generation):
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def invalidate_flight(self, departure, arrival, departure_time):
+        with self._lock:
+            self._generation += 1
+            for key in affected_keys(departure, arrival, departure_time):
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+flight_search_cache = SearchCache()
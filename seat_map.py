@@ -0,0 +1,193 @@
+import logging
+
+from sqlalchemy.orm import Session
+
+from models import Flight, Booking, SeatMap, FlightClass
+
+# Share of the aircraft given to each premium cabin, in percent.
+# Economy gets whatever is left.
+CABIN_SHARE = {
+    FlightClass.FIRST: 5,
+    FlightClass.BUSINESS: 15,
+}
+
+# Cabins in bitmap order
+CABIN_ORDER = (FlightClass.FIRST, FlightClass.BUSINESS, FlightClass.ECONOMY)
+
+logger = logging.getLogger("flight_reservation.seat_map")
+
+
+def cabin_sizes(total_seats: int):
+    first = total_seats * CABIN_SHARE[FlightClass.FIRST] // 100
+    business = total_seats * CABIN_SHARE[FlightClass.BUSINESS] // 100
+    return {
+        FlightClass.FIRST: first,
+        FlightClass.BUSINESS: business,
+        FlightClass.ECONOMY: total_seats - first - business,
+    }
+
+def new_seat_map(total_seats: int):
+    sizes = cabin_sizes(total_seats)
+    return SeatMap(
+        first_seats=sizes[FlightClass.FIRST],
+        business_seats=sizes[FlightClass.BUSINESS],
+        economy_seats=sizes[FlightClass.ECONOMY],
+        occupied=bytes((total_seats + 7) // 8)
+    )
+
+# (first bit, number of seats) of a cabin inside the bitmap
+def cabin_range(seat_map: SeatMap, flight_class: FlightClass):
+    sizes = {
+        FlightClass.FIRST: seat_map.first_seats,
+        FlightClass.BUSINESS: seat_map.business_seats,
+        FlightClass.ECONOMY: seat_map.economy_seats,
+    }
+    start = 0
+    for cls in CABIN_ORDER:
+        if cls == flight_class:
+            return start, sizes[cls]
+        start += sizes[cls]
+
+# Seat labels keep the existing "<class initial><number>" format, e.g. E12, B3
+def seat_label(flight_class: FlightClass, number: int):
+    return f"{flight_class.value[0]}{number}"
+
+def seat_bit(seat_map: SeatMap, seat_number: str):
+    for cls in CABIN_ORDER:
+        if seat_number[:1] == cls.value[0] and seat_number[1:].isdigit():
+            start, size = cabin_range(seat_map, cls)
+            number = int(seat_number[1:])
+            if 1 <= number <= size:
+                return cls, start + number - 1
+    return None, None
+
+def free_seats(seat_map: SeatMap, flight_class: FlightClass):
+    start, size = cabin_range(seat_map, flight_class)
+    occupied = int.from_bytes(seat_map.occupied, "little")
+    return size - bin((occupied >> start) & ((1 << size) - 1)).count("1")
+
+# Set the lowest free bit in a cabin (or the requested seat) and return its
+# label. The bitmap is a handful of machine words for any real aircraft, so
+# this does not grow with the number of bookings the flight has seen.
+def _take(seat_map: SeatMap, flight_class: FlightClass, seat_number: str = None):
+    start, size = cabin_range(seat_map, flight_class)
+    occupied = int.from_bytes(seat_map.occupied, "little")
+
+    if seat_number:
+        cls, bit = seat_bit(seat_map, seat_number)
+        if cls != flight_class or occupied >> bit & 1:
+            return None
+    else:
+        free = ~occupied & (((1 << size) - 1) << start)
+        if not free:
+            return None
+        bit = (free & -free).bit_length() - 1
+
+    seat_map.occupied = (occupied | 1 << bit).to_bytes(len(seat_map.occupied), "little")
+    return seat_label(flight_class, bit - start + 1)
+
+# Load the flight's seat map for update, always re-reading the row so a copy
+# cached in the session by an earlier read is not written back stale.
+# Flights created before seat maps existed get one built on first use from
+# their active bookings (see seat_bookings).
+def get_seat_map(db: Session, flight_id: int):
+    seat_map = (db.query(SeatMap).filter(SeatMap.flight_id == flight_id)
+                .populate_existing().with_for_update().first())
+    if seat_map:
+        return seat_map
+
+    flight = db.get(Flight, flight_id)
+    if not flight:
+        return None
+
+    seat_map = new_seat_map(flight.total_seats)
+    seat_map.flight_id = flight_id
+    db.add(seat_map)
+    bookings = (db.query(Booking).filter(Booking.flight_id == flight_id, Booking.is_cancelled == False)  # noqa: E712
+                .order_by(Booking.id).all())
+    moves = seat_bookings(seat_map, bookings)
+    for booking, seat_number in moves:
+        if seat_number:
+            booking.seat_number = seat_number
+    log_rebuild(seat_map, flight.flight_number, flight.available_seats, moves)
+    db.flush()
+    return seat_map
+
+# Seat a flight's active bookings in a new, empty seat map. A booking keeps
+# its seat when the label is a free seat of its cabin; the rest (labels from
+# before cabins were sized or from a larger aircraft, or a seat already held)
+# get the lowest free seat of their cabin. Returns the bookings that have to
+# move as (booking, new label), the label None if their cabin is full.
+def seat_bookings(seat_map: SeatMap, bookings):
+    unplaced = [booking for booking in bookings
+                if not booking.seat_number or _take(seat_map, booking.flight_class, booking.seat_number) is None]
+    return [(booking, _take(seat_map, booking.flight_class)) for booking in unplaced]
+
+# Log the seats a rebuilt map moved, and any difference between its free
+# seats and the flight's available_seats counter. The counter still decides
+# whether the flight can be booked.
+def log_rebuild(seat_map: SeatMap, flight_number: str, available_seats: int, moves):
+    for booking, seat_number in moves:
+        if seat_number is None:
+            logger.warning("Flight %s: no %s seat left for booking %s (seat %s)", flight_number,
+                           booking.flight_class.value, booking.booking_reference, booking.seat_number)
+        else:
+            logger.warning("Flight %s: booking %s moved from seat %s to %s", flight_number,
+                           booking.booking_reference, booking.seat_number, seat_number)
+    free = sum(free_seats(seat_map, cls) for cls in CABIN_ORDER)
+    if free != available_seats:
+        logger.warning("Flight %s: seat map has %d free seats but available_seats is %d", flight_number,
+                       free, available_seats)
+
+# Assign a seat in the given class (a specific one if seat_number is given).
+# Returns the seat label, or None if the cabin is full or the seat is taken.
+def allocate_seat(db: Session, flight_id: int, flight_class: FlightClass, seat_number: str = None):
+    seat_map = get_seat_map(db, flight_id)
+    if seat_map is None:
+        return None
+
+    seat_number = _take(seat_map, flight_class, seat_number)
+    db.flush()
+    return seat_number
+
+# Assign `count` seats in the given class at once, lowest numbers first, so a
+# group sits together where it can. Returns the labels, or None (with nothing
+# taken) if the cabin does not have that many free seats.
+def allocate_seats(db: Session, flight_id: int, flight_class: FlightClass, count: int):
+    seat_map = get_seat_map(db, flight_id)
+    if seat_map is None:
+        return None
+
+    start, size = cabin_range(seat_map, flight_class)
+    occupied = int.from_bytes(seat_map.occupied, "little")
+    free = ~occupied & (((1 << size) - 1) << start)
+    bits = []
+    while free and len(bits) < count:
+        lowest = free & -free
+        bits.append(lowest.bit_length() - 1)
+        free ^= lowest
+        occupied |= lowest
+    if len(bits) < count:
+        return None
+
+    seat_map.occupied = occupied.to_bytes(len(seat_map.occupied), "little")
+    db.flush()
+    return [seat_label(flight_class, bit - start + 1) for bit in bits]
+
+# Free the exact seat held by a booking. Returns the updated seat map, or
+# None if the seat was not taken.
+def release_seat_number(db: Session, flight_id: int, seat_number: str):
+    seat_map = get_seat_map(db, flight_id)
+    if seat_map is None:
+        return None
+
+    cls, bit = seat_bit(seat_map, seat_number)
+    if cls is None:
+        return None
+
+    occupied = int.from_bytes(seat_map.occupied, "little")
+    if not occupied >> bit & 1:
+        return None
+    seat_map.occupied = (occupied & ~(1 << bit)).to_bytes(len(seat_map.occupied), "little")
+    db.flush()
+    return seat_map
@@ -1,13 +1,23 @@
-from datetime import datetime, timedelta
+import argparse
+import bisect
+import itertools
+import random
+import time
+import zlib
+from datetime import datetime, timedelta, date
 from random import randint, choice
 
-from database import Base, engine, SessionLocal
-from models import Flight, Passenger, FlightStatus
+from sqlalchemy import insert, func, select
+
+from database import Base, create_schema, create_sqlite_engine, SessionLocal, SQLALCHEMY_DATABASE_URL
+from models import Flight, Passenger, Booking, SeatMap, FlightClass, FlightStatus
+from seat_map import cabin_sizes, CABIN_ORDER
+import fare_calendar
 
 
 def seed():
     # Ensure tables exist
-    Base.metadata.create_all(bind=engine)
+    create_schema()
 
     db = SessionLocal()
     try:
@@ -69,5 +79,278 @@ def seed():
         db.close()
 
 
+# Benchmark tiers: (flights, passengers, bookings)
+SCALES = {
+    "small": (1_000, 5_000, 20_000),
+    "medium": (100_000, 500_000, 2_000_000),
+    "large": (1_000_000, 5_000_000, 20_000_000),
+}
+
+# Rows per executemany / commit
+INSERT_CHUNK = 20_000
+
+# Airports weighted by traffic, so hubs get most of the routes
+AIRPORTS = [
+    ("DEL", 10), ("BOM", 9), ("BLR", 7), ("HYD", 5), ("MAA", 5), ("CCU", 4),
+    ("AMD", 3), ("PNQ", 3), ("GOI", 3), ("COK", 3), ("GAU", 2), ("JAI", 2),
+    ("LKO", 2), ("SXR", 1), ("UDR", 1), ("IXC", 1), ("TRV", 1), ("PAT", 1),
+    ("BBI", 1), ("IXB", 1),
+]
+AIRLINES = [("IndiGo", "6E", 6), ("Air India", "AI", 3), ("Vistara", "UK", 2), ("SpiceJet", "SG", 1), ("Akasa Air", "QP", 1)]
+AIRCRAFT_SEATS = [(120, 1), (150, 2), (180, 5), (220, 2), (300, 1)]
+
+# Morning and evening departure banks
+DEPARTURE_HOURS = [(h, 1) for h in range(0, 5)] + [(h, 6) for h in range(5, 10)] + \
+                  [(h, 3) for h in range(10, 17)] + [(h, 6) for h in range(17, 22)] + [(h, 2) for h in range(22, 24)]
+
+CLASS_MIX = [(FlightClass.ECONOMY, 80), (FlightClass.BUSINESS, 15), (FlightClass.FIRST, 5)]
+CANCEL_RATE = 0.08          # share of bookings later cancelled
+FLIGHT_CANCEL_RATE = 0.015  # share of flights cancelled outright
+DELAY_RATE = 0.03           # share of upcoming flights marked delayed
+MEAN_LEAD_DAYS = 21         # mean days between booking and departure
+
+FIRST_NAMES = ["Aarav", "Vivaan", "Aditya", "Ananya", "Diya", "Isha", "Kabir", "Meera", "Rohan", "Saanvi",
+               "Arjun", "Priya", "Rahul", "Neha", "Vikram", "Kavya", "Nikhil", "Pooja", "Siddharth", "Tara"]
+LAST_NAMES = ["Sharma", "Verma", "Iyer", "Nair", "Reddy", "Patel", "Gupta", "Singh", "Khan", "Das",
+              "Menon", "Rao", "Joshi", "Mehta", "Bose", "Kulkarni", "Chopra", "Pillai", "Shah", "Sen"]
+
+REF_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+REF_PAIRS = [a + b for b, a in itertools.product(REF_ALPHABET, repeat=2)]
+REF_SPACE = 36 ** 8
+REF_MULTIPLIER = 2_654_435_761  # odd and not divisible by 3, so i -> i*M mod 36^8 never repeats
+
+
+def _weighted(items):
+    values = [item[:-1] if len(item) > 2 else item[0] for item in items]
+    weights = [item[-1] for item in items]
+    return values, weights
+
+# Unique, random-looking 8 character reference for the i-th booking
+def booking_reference(i):
+    n = (i * REF_MULTIPLIER) % REF_SPACE
+    n, a = divmod(n, 1296)
+    n, b = divmod(n, 1296)
+    d, c = divmod(n, 1296)
+    return REF_PAIRS[a] + REF_PAIRS[b] + REF_PAIRS[c] + REF_PAIRS[d]
+
+def _chunks(rows, size=INSERT_CHUNK):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def generate_passengers(rng, count):
+    for i in range(1, count + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield {
+            "id": i,
+            "first_name": first,
+            "last_name": last,
+            "email": f"{first.lower()}.{last.lower()}.{i}@example.com",
+            "phone": f"9{rng.randrange(10**9):09d}",
+            "passport_number": f"P{i:09d}",
+            "date_of_birth": date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 55)),
+        }
+
+# Flights with their seat maps and bookings. Each flight draws a load factor
+# from a beta distribution, scaled so the whole run lands near the requested
+# number of bookings.
+def generate_schedule(rng, flights, passengers, bookings, now, history_days, future_days):
+    airports, airport_weights = _weighted(AIRPORTS)
+    airlines, airline_weights = _weighted(AIRLINES)
+    seat_options, seat_weights = _weighted(AIRCRAFT_SEATS)
+    hours, hour_weights = _weighted(DEPARTURE_HOURS)
+    # Cabins are handled by position in CABIN_ORDER in the per-booking loop
+    class_weights = dict(CLASS_MIX)
+    class_cum = list(itertools.accumulate(class_weights[cls] for cls in CABIN_ORDER))
+    prefixes = [cls.value[0] for cls in CABIN_ORDER]
+
+    mean_seats = sum(s * w for s, w in zip(seat_options, seat_weights)) / sum(seat_weights)
+    mean_load = 5 / 7  # mean of betavariate(5, 2)
+    sold_scale = bookings / (flights * mean_seats * mean_load * (1 + CANCEL_RATE)) if flights else 0
+    first_day = now - timedelta(days=history_days)
+    span_days = history_days + future_days
+
+    booking_id = 0
+    for flight_id in range(1, flights + 1):
+        dep = rng.choices(airports, airport_weights)[0]
+        arr = dep
+        while arr == dep:
+            arr = rng.choices(airports, airport_weights)[0]
+        airline, code = rng.choices(airlines, airline_weights)[0]
+        total = rng.choices(seat_options, seat_weights)[0]
+
+        # Block time and base fare are fixed per route
+        minutes = 60 + zlib.crc32(f"{min(dep, arr)}{max(dep, arr)}".encode()) % 180
+        departure = first_day + timedelta(days=rng.randrange(span_days),
+                                          hours=rng.choices(hours, hour_weights)[0],
+                                          minutes=rng.choice((0, 15, 30, 45)))
+        arrival = departure + timedelta(minutes=minutes)
+        price = round((2000 + minutes * 30) * rng.uniform(0.8, 1.6), -1)
+
+        if rng.random() < FLIGHT_CANCEL_RATE:
+            status = FlightStatus.CANCELLED
+        elif arrival <= now:
+            status = FlightStatus.ARRIVED
+        elif departure <= now:
+            status = FlightStatus.DEPARTED
+        elif rng.random() < DELAY_RATE:
+            status = FlightStatus.DELAYED
+        else:
+            status = FlightStatus.SCHEDULED
+
+        sizes = [cabin_sizes(total)[cls] for cls in CABIN_ORDER]
+        starts = [0, sizes[0], sizes[0] + sizes[1]]
+        taken = [0, 0, 0]
+        occupied = 0
+
+        sold = min(total, round(total * rng.betavariate(5, 2) * sold_scale))
+        cancelled = round(sold * CANCEL_RATE * rng.uniform(0.5, 1.5))
+        flight_bookings = []
+        for n in range(sold + cancelled):
+            booking_id += 1
+            is_cancelled = n >= sold or status == FlightStatus.CANCELLED
+            cabin = bisect.bisect(class_cum, rng.random() * class_cum[-1])
+            if taken[cabin] == sizes[cabin]:
+                cabin = next((c for c in range(3) if taken[c] < sizes[c]), cabin)
+            if taken[cabin] < sizes[cabin]:
+                seat = f"{prefixes[cabin]}{taken[cabin] + 1}"
+                if not is_cancelled:
+                    occupied |= 1 << (starts[cabin] + taken[cabin])
+                    taken[cabin] += 1
+            else:
+                seat = f"{prefixes[cabin]}{sizes[cabin]}"
+
+            booked = departure - timedelta(days=rng.expovariate(1 / MEAN_LEAD_DAYS))
+            if booked > now:
+                booked = now - timedelta(hours=rng.uniform(0, 24))
+            flight_bookings.append({
+                "id": booking_id,
+                "booking_reference": booking_reference(booking_id),
+                "flight_id": flight_id,
+                # Frequent flyers: low passenger ids book far more often
+                "passenger_id": int(passengers * rng.random() ** 2) + 1,
+                "seat_number": seat,
+                "flight_class": CABIN_ORDER[cabin],
+                "booking_date": booked,
+                "is_cancelled": is_cancelled,
+            })
+
+        active = sum(taken)
+        flight = {
+            "id": flight_id,
+            "flight_number": f"{code}{flight_id}",
+            "airline": airline,
+            "departure_airport": dep,
+            "arrival_airport": arr,
+            "departure_time": departure,
+            "arrival_time": arrival,
+            "total_seats": total,
+            "available_seats": total - active,
+            "price": price,
+            "status": status,
+            "created_at": departure - timedelta(days=120),
+        }
+        seat_map = {
+            "flight_id": flight_id,
+            "first_seats": sizes[0],
+            "business_seats": sizes[1],
+            "economy_seats": sizes[2],
+            "occupied": occupied.to_bytes((total + 7) // 8, "little"),
+        }
+        yield flight, seat_map, flight_bookings
+
+# Build a benchmark-size database through Core executemany in chunks.
+# The same seed and arguments always produce the same rows.
+def seed_scale(db_url=SQLALCHEMY_DATABASE_URL, flights=1_000, passengers=5_000, bookings=20_000,
+               random_seed=42, now=None, history_days=90, future_days=180):
+    rng = random.Random(random_seed)
+    now = now or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    # Loading only: a crash just means re-running the generator
+    bulk_engine = create_sqlite_engine(db_url, profile="throughput", synchronous="OFF", cache_size=-262144)
+
+    Base.metadata.create_all(bind=bulk_engine)
+    with bulk_engine.connect() as conn:
+        if conn.execute(select(func.count()).select_from(Flight.__table__)).scalar():
+            print("Data already exists. Skipping seeding.")
+            return
+
+    # Secondary indexes and the fare calendar triggers are dropped during the
+    # load and rebuilt once at the end
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(bind=bulk_engine, checkfirst=True)
+    with bulk_engine.begin() as conn:
+        fare_calendar.drop_triggers(conn)
+
+    started = time.perf_counter()
+    with bulk_engine.connect() as conn:
+        for chunk in _chunks(generate_passengers(rng, passengers)):
+            conn.execute(insert(Passenger), chunk)
+            conn.commit()
+        print(f"Passengers: {passengers:,} rows in {time.perf_counter() - started:.1f}s")
+
+        flight_rows, seat_map_rows, booking_rows = [], [], []
+        booking_count = 0
+        schedule = generate_schedule(rng, flights, passengers, bookings, now, history_days, future_days)
+        for flight, seat_map, flight_bookings in schedule:
+            flight_rows.append(flight)
+            seat_map_rows.append(seat_map)
+            booking_rows.extend(flight_bookings)
+            if len(booking_rows) >= INSERT_CHUNK or len(flight_rows) >= INSERT_CHUNK:
+                conn.execute(insert(Flight), flight_rows)
+                conn.execute(insert(SeatMap), seat_map_rows)
+                if booking_rows:
+                    conn.execute(insert(Booking), booking_rows)
+                conn.commit()
+                booking_count += len(booking_rows)
+                flight_rows, seat_map_rows, booking_rows = [], [], []
+        if flight_rows:
+            conn.execute(insert(Flight), flight_rows)
+            conn.execute(insert(SeatMap), seat_map_rows)
+            if booking_rows:
+                conn.execute(insert(Booking), booking_rows)
+            conn.commit()
+            booking_count += len(booking_rows)
+        print(f"Flights: {flights:,}, bookings: {booking_count:,} rows in {time.perf_counter() - started:.1f}s")
+
+    create_schema(bind=bulk_engine)
+    with bulk_engine.begin() as conn:
+        fare_calendar.rebuild(conn)
+    with bulk_engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+    bulk_engine.dispose()
+    print(f"Indexes built, done in {time.perf_counter() - started:.1f}s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Seed the flight reservation database.")
+    parser.add_argument("--scale", choices=SCALES, help="benchmark tier; without it a small demo data set is created")
+    parser.add_argument("--flights", type=int, help="number of flights (overrides --scale)")
+    parser.add_argument("--passengers", type=int, help="number of passengers (overrides --scale)")
+    parser.add_argument("--bookings", type=int, help="approximate number of bookings (overrides --scale)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed (default 42)")
+    parser.add_argument("--now", type=lambda s: datetime.strptime(s, "%Y-%m-%d"),
+                        help="reference date YYYY-MM-DD; fix it for byte-identical runs (default today)")
+    parser.add_argument("--db", default=None, help="SQLite file to create (default flight_reservation.db)")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    seed()
+    args = parse_args()
+    if args.scale or args.flights or args.passengers or args.bookings:
+        flights, passengers, bookings = SCALES[args.scale or "small"]
+        seed_scale(
+            db_url=f"sqlite:///{args.db}" if args.db else SQLALCHEMY_DATABASE_URL,
+            flights=args.flights or flights,
+            passengers=args.passengers or passengers,
+            bookings=args.bookings if args.bookings is not None else bookings,
+            random_seed=args.seed,
+            now=args.now,
+        )
+    else:
+        seed()
@@ -0,0 +1,619 @@
+import heapq
+import random
+import string
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, delete, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+
+from models import (Flight, Passenger, Booking, WaitlistEntry, ArchivedFlight, ArchivedBooking, FlightClass,
+                    FlightStatus, BOOKABLE_STATUSES)
+from seat_map import allocate_seat, allocate_seats, release_seat_number, new_seat_map, free_seats, get_seat_map
+from search_cache import flight_search_cache, search_key
+from itineraries import route_graph
+from waitlist import waitlist
+from instrumentation import timed
+
+
+def generate_booking_reference():
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+
+# Flights matching the search filters; any filter left empty is skipped.
+# day is a date or datetime, matching departures on that calendar day.
+def find_flights(db: Session, departure: str = None, arrival: str = None, day=None):
+    query = db.query(Flight)
+    if departure:
+        query = query.filter(Flight.departure_airport == departure)
+    if arrival:
+        query = query.filter(Flight.arrival_airport == arrival)
+    if day:
+        start = datetime(day.year, day.month, day.day)
+        query = query.filter(Flight.departure_time >= start, Flight.departure_time < start + timedelta(days=1))
+    return query
+
+# Columns returned by cached searches
+FLIGHT_ROW_COLUMNS = (
+    Flight.id,
+    Flight.flight_number,
+    Flight.airline,
+    Flight.departure_airport,
+    Flight.arrival_airport,
+    Flight.departure_time,
+    Flight.arrival_time,
+    Flight.available_seats,
+    Flight.total_seats,
+    Flight.price,
+    Flight.status,
+)
+
+# What a seat or status change reports back, so the search cache and the
+# route graph can be updated without another SELECT
+CHANGE_COLUMNS = (
+    Flight.id,
+    Flight.status,
+    Flight.available_seats,
+    Flight.departure_airport,
+    Flight.arrival_airport,
+    Flight.departure_time,
+)
+
+# find_flights as plain rows, answered from flight_search_cache when the same
+# filters were searched recently
+@timed("search")
+def search_flight_rows(db: Session, departure: str = None, arrival: str = None, day=None):
+    key = search_key(departure, arrival, day)
+    found, rows, generation = flight_search_cache.get(key)
+    if found:
+        return rows
+    rows = find_flights(db, *key).with_entities(*FLIGHT_ROW_COLUMNS).order_by(Flight.departure_time, Flight.id).all()
+    flight_search_cache.put(key, rows, generation)
+    return rows
+
+# Call after committing any change to a flight's seats or status, with the
+# Flight or a row of CHANGE_COLUMNS
+def flight_changed(flight):
+    flight_search_cache.invalidate_flight(flight.departure_airport, flight.arrival_airport, flight.departure_time)
+    if route_graph.loaded:
+        route_graph.apply(flight)
+
+# Take one seat (or `count` seats) with a single conditional UPDATE so
+# concurrent writers can never oversell. Returns the updated row of
+# CHANGE_COLUMNS, or None if the flight has too few seats left (or is missing /
+# no longer bookable) - no separate SELECT is needed.
+def reserve_seat(db: Session, flight_id: int, count: int = 1):
+    result = db.execute(
+        update(Flight)
+        .where(Flight.id == flight_id,
+               Flight.available_seats >= count,
+               Flight.status.in_(BOOKABLE_STATUSES))
+        .values(available_seats=Flight.available_seats - count)
+        .returning(*CHANGE_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    return result.first()
+
+# Give one seat back, never going above the flight's capacity. Returns the
+# updated row like reserve_seat, or None if nothing changed.
+def release_seat(db: Session, flight_id: int):
+    result = db.execute(
+        update(Flight)
+        .where(Flight.id == flight_id, Flight.available_seats < Flight.total_seats)
+        .values(available_seats=Flight.available_seats + 1)
+        .returning(*CHANGE_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    return result.first()
+
+# The writes of a booking, without the commit: take a seat on the counter,
+# mark it in the seat map and add the Booking. Returns (booking, flight row
+# of CHANGE_COLUMNS); booking is None if the flight, the cabin or the
+# requested seat is not available, in which case nothing is left changed, so
+# callers can put several bookings in one transaction.
+def add_booking(db: Session, flight_id: int, passenger_id: int, flight_class: FlightClass,
+                seat_number: str = None):
+    # The counter UPDATE takes the write lock first, so the seat map
+    # read-modify-write below cannot race with another booking
+    flight = reserve_seat(db, flight_id)
+    if flight is None:
+        return None, None
+
+    seat_number = allocate_seat(db, flight_id, flight_class, seat_number)
+    if seat_number is None:
+        release_seat(db, flight_id)
+        return None, None
+
+    booking = Booking(
+        booking_reference=generate_booking_reference(),
+        flight_id=flight_id,
+        passenger_id=passenger_id,
+        seat_number=seat_number,
+        flight_class=flight_class
+    )
+    db.add(booking)
+    return booking, flight
+
+# Book a seat for an existing passenger and commit. A specific seat can be
+# asked for with seat_number. Returns the new Booking, or None if the flight,
+# the cabin or the requested seat is not available.
+@timed("book")
+def book_seat(db: Session, flight_id: int, passenger_id: int, flight_class: FlightClass,
+              seat_number: str = None):
+    try:
+        booking, flight = add_booking(db, flight_id, passenger_id, flight_class, seat_number)
+        if booking is None:
+            db.rollback()
+            return None
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    flight_changed(flight)
+    return booking
+
+# The writes of a cancellation, without the commit. The booking is flipped
+# with a conditional UPDATE, so two concurrent cancels of the same reference
+# only release one seat. If the cabin was full, the freed seat goes to the
+# head of its waitlist in the same transaction. Returns (cancelled, flight
+# row or None).
+def remove_booking(db: Session, booking_reference: str):
+    result = db.execute(
+        update(Booking)
+        .where(Booking.booking_reference == booking_reference,
+               Booking.is_cancelled == False)  # noqa: E712
+        .values(is_cancelled=True)
+        .returning(Booking.flight_id, Booking.seat_number, Booking.flight_class)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.first()
+    if row is None:
+        return False, None
+
+    flight = release_seat(db, row.flight_id)
+    seat_map = release_seat_number(db, row.flight_id, row.seat_number)
+    if seat_map is not None and flight is not None:
+        # People only join the waitlist of a full cabin, so there is nobody
+        # to promote unless this seat was the cabin's only free one. The seat
+        # that ended the cabin being full went to the table's head of queue,
+        # whichever process added it (see WaitlistMirror.take).
+        if flight.status in BOOKABLE_STATUSES and free_seats(seat_map, row.flight_class) == 1:
+            promoted = promote_waitlisted(db, row.flight_id, row.flight_class, row.seat_number)
+            if promoted is not None:
+                flight = promoted
+    return True, flight
+
+# Book the freed seat for the first passenger in the cabin's waitlist, in the
+# caller's transaction. Entries are taken from the in-memory queue and
+# deleted with a conditional DELETE, so one already promoted or removed
+# elsewhere is skipped. Returns the flight row after the booking, or None if
+# nobody was waiting.
+def promote_waitlisted(db: Session, flight_id: int, flight_class: FlightClass, seat_number: str):
+    while True:
+        entry_id = waitlist.take(db, flight_id, flight_class)
+        if entry_id is None:
+            return None
+        entry = db.execute(
+            delete(WaitlistEntry).where(WaitlistEntry.id == entry_id).returning(WaitlistEntry.passenger_id)
+        ).first()
+        if entry is None:
+            continue
+        # The seat and the counter were released just above in this same
+        # transaction, which holds the write lock, so this cannot fail
+        _, flight = add_booking(db, flight_id, entry.passenger_id, flight_class, seat_number)
+        return flight
+
+# Cancel a booking by reference, return its seat and commit. Returns True if
+# this call cancelled it.
+@timed("cancel")
+def cancel_seat(db: Session, booking_reference: str):
+    try:
+        cancelled, flight = remove_booking(db, booking_reference)
+        if not cancelled:
+            db.rollback()
+            return False
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    if flight is not None:
+        flight_changed(flight)
+    return True
+
+# Rows per page in interactive listings
+PAGE_SIZE = 20
+
+# Rows fetched per round trip when streaming a whole table
+CHUNK_SIZE = 1000
+
+# Columns shown in booking listings
+BOOKING_ROW_COLUMNS = (
+    Booking.id,
+    Booking.booking_date,
+    Booking.booking_reference,
+    Passenger.first_name,
+    Passenger.last_name,
+    Flight.flight_number,
+    Flight.departure_airport,
+    Flight.arrival_airport,
+    Flight.departure_time,
+    Booking.seat_number,
+    Booking.flight_class,
+    Booking.is_cancelled,
+    Flight.status,
+)
+
+# The same columns for bookings of archived flights (see archive.py)
+ARCHIVED_BOOKING_ROW_COLUMNS = (
+    ArchivedBooking.id,
+    ArchivedBooking.booking_date,
+    ArchivedBooking.booking_reference,
+    Passenger.first_name,
+    Passenger.last_name,
+    ArchivedFlight.flight_number,
+    ArchivedFlight.departure_airport,
+    ArchivedFlight.arrival_airport,
+    ArchivedFlight.departure_time,
+    ArchivedBooking.seat_number,
+    ArchivedBooking.flight_class,
+    ArchivedBooking.is_cancelled,
+    ArchivedFlight.status,
+)
+
+def _match_ref_or_email(query, ref_or_email: str, booking=Booking):
+    if not ref_or_email:
+        return query
+    # Match the passenger through a subquery so both sides of the OR can
+    # use an index instead of scanning the joined tables
+    passenger_ids = select(Passenger.id).where(Passenger.email == ref_or_email)
+    return query.filter(
+        (booking.booking_reference == ref_or_email) |
+        (booking.passenger_id.in_(passenger_ids))
+    )
+
+# Bookings with their flight and passenger loaded in the same SELECT, so
+# reading booking.flight / booking.passenger does not issue a query per row
+def find_bookings(db: Session, ref_or_email: str = None):
+    query = db.query(Booking).options(
+        joinedload(Booking.flight, innerjoin=True),
+        joinedload(Booking.passenger, innerjoin=True)
+    )
+    return _match_ref_or_email(query, ref_or_email)
+
+@timed("lookup_booking")
+def find_booking(db: Session, booking_reference: str):
+    return find_bookings(db).filter(Booking.booking_reference == booking_reference).first()
+
+# Plain row tuples with just the display columns, for listings that do not
+# need ORM objects. Rows expose the column names, e.g. row.flight_number.
+def booking_rows(db: Session, ref_or_email: str = None):
+    query = db.query(*BOOKING_ROW_COLUMNS).join(Booking.passenger).join(Booking.flight)
+    return _match_ref_or_email(query, ref_or_email)
+
+def archived_booking_rows(db: Session, ref_or_email: str = None):
+    query = (db.query(*ARCHIVED_BOOKING_ROW_COLUMNS)
+             .join(ArchivedBooking.passenger).join(ArchivedBooking.flight))
+    return _match_ref_or_email(query, ref_or_email, ArchivedBooking)
+
+FLIGHT_ORDER = (Flight.departure_time, Flight.id)
+BOOKING_ORDER = (Booking.booking_date, Booking.id)
+ARCHIVED_BOOKING_ORDER = (ArchivedBooking.booking_date, ArchivedBooking.id)
+
+# Keyset (seek) pagination: continue strictly after the last key seen, so
+# every page is an index range read no matter how deep the listing goes
+def _seek(query, order, after):
+    if after is not None:
+        query = query.filter(tuple_(*order) > tuple_(*after))
+    return query.order_by(*order)
+
+# One page of flights ordered by departure. Returns (flights, next_after);
+# pass next_after back in to get the following page, None means last page.
+# bookable=True keeps only flights on sale (BOOKABLE_STATUSES) with seats left.
+@timed("list_flights")
+def flights_page(db: Session, after=None, limit: int = PAGE_SIZE, bookable: bool = False):
+    query = db.query(Flight)
+    if bookable:
+        query = query.filter(Flight.status.in_(BOOKABLE_STATUSES), Flight.available_seats > 0)
+    flights = _seek(query, FLIGHT_ORDER, after).limit(limit).all()
+    next_after = None
+    if len(flights) == limit:
+        next_after = (flights[-1].departure_time, flights[-1].id)
+    return flights, next_after
+
+# One page of booking rows ordered by booking date, same contract as flights_page.
+# Bookings of archived flights are included unless archived=False: one page
+# is read from each table past the same key and the two are merged, so a
+# page still costs two index range reads.
+@timed("list_bookings")
+def bookings_page(db: Session, ref_or_email: str = None, after=None, limit: int = PAGE_SIZE,
+                  archived: bool = True):
+    rows = _seek(booking_rows(db, ref_or_email), BOOKING_ORDER, after).limit(limit).all()
+    if archived:
+        rows += _seek(archived_booking_rows(db, ref_or_email), ARCHIVED_BOOKING_ORDER, after).limit(limit).all()
+        rows = sorted(rows, key=lambda row: (row.booking_date, row.id))[:limit]
+    next_after = None
+    if len(rows) == limit:
+        next_after = (rows[-1].booking_date, rows[-1].id)
+    return rows, next_after
+
+# Stream every flight in departure order, CHUNK_SIZE rows per fetch, so
+# memory stays flat however large the table is. Archived flights are not
+# included.
+def iter_flights(db: Session, chunk_size: int = CHUNK_SIZE, bookable: bool = False):
+    query = db.query(Flight)
+    if bookable:
+        query = query.filter(Flight.status.in_(BOOKABLE_STATUSES), Flight.available_seats > 0)
+    yield from query.order_by(*FLIGHT_ORDER).yield_per(chunk_size)
+
+# Stream every booking row in booking date order, the same rows bookings_page
+# pages through: bookings of archived flights are merged in by the same key
+# unless archived=False, each table read CHUNK_SIZE rows per fetch
+def iter_booking_rows(db: Session, ref_or_email: str = None, chunk_size: int = CHUNK_SIZE, archived: bool = True):
+    rows = booking_rows(db, ref_or_email).order_by(*BOOKING_ORDER).yield_per(chunk_size)
+    if not archived:
+        yield from rows
+        return
+    archived_rows = (archived_booking_rows(db, ref_or_email).order_by(*ARCHIVED_BOOKING_ORDER)
+                     .yield_per(chunk_size))
+    yield from heapq.merge(rows, archived_rows, key=lambda row: (row.booking_date, row.id))
+
+
+# Outcome of a service call: ok, a short machine-readable status ("booked",
+# "sold_out", "not_found", "duplicate", "invalid", ...), a message for the
+# user and the created or affected object, if any
+Result = namedtuple("Result", "ok status message value", defaults=(None,))
+
+# A failed INSERT or UPDATE as a Result: a unique constraint means the row
+# already exists; anything else (a required column left empty) is bad input
+def integrity_failure(error: IntegrityError, duplicate_message: str):
+    if "UNIQUE constraint failed" in str(error.orig):
+        return Result(False, "duplicate", duplicate_message)
+    return Result(False, "invalid", f"Missing or invalid details ({error.orig}).")
+
+@timed("add_flight")
+def create_flight(db: Session, flight_number: str, airline: str, departure_airport: str, arrival_airport: str,
+                  departure_time: datetime, arrival_time: datetime, total_seats: int, price: float):
+    if total_seats <= 0:
+        return Result(False, "invalid", "Total seats must be positive.")
+    if price < 0:
+        return Result(False, "invalid", "Price cannot be negative.")
+    if arrival_time <= departure_time:
+        return Result(False, "invalid", "Arrival must be after departure.")
+
+    flight = Flight(
+        flight_number=flight_number,
+        airline=airline,
+        departure_airport=departure_airport.upper(),
+        arrival_airport=arrival_airport.upper(),
+        departure_time=departure_time,
+        arrival_time=arrival_time,
+        total_seats=total_seats,
+        available_seats=total_seats,
+        price=price,
+        status=FlightStatus.SCHEDULED
+    )
+    flight.seat_map = new_seat_map(total_seats)
+    try:
+        db.add(flight)
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        return integrity_failure(e, f"Flight {flight_number} already exists.")
+
+    flight_changed(flight)
+    return Result(True, "created", "Flight added successfully!", flight)
+
+def find_passenger(db: Session, email: str):
+    return db.query(Passenger).filter(Passenger.email == email).first()
+
+# Add a passenger. With commit=False the passenger is only flushed, so it
+# can be committed together with a booking.
+@timed("add_passenger")
+def create_passenger(db: Session, first_name: str, last_name: str, email: str, phone: str,
+                     passport_number: str, date_of_birth, commit: bool = True):
+    if not (first_name and last_name and email and phone and passport_number and date_of_birth):
+        return Result(False, "invalid", "Name, email, phone, passport number and date of birth are required.")
+
+    # Report a clash up front instead of failing the whole transaction on commit
+    clash = (db.query(Passenger.email)
+             .filter((Passenger.email == email) | (Passenger.passport_number == passport_number))
+             .first())
+    if clash:
+        field = "email" if clash.email == email else "passport number"
+        return Result(False, "duplicate", f"A passenger with this {field} already exists.")
+
+    passenger = Passenger(
+        first_name=first_name,
+        last_name=last_name,
+        email=email,
+        phone=phone,
+        passport_number=passport_number,
+        date_of_birth=date_of_birth
+    )
+    try:
+        db.add(passenger)
+        if commit:
+            db.commit()
+        else:
+            db.flush()
+    except IntegrityError as e:
+        db.rollback()
+        return integrity_failure(e, "A passenger with this email or passport number already exists.")
+    return Result(True, "created", "Passenger added successfully!", passenger)
+
+# Book a seat for the passenger with this email, creating the passenger from
+# the extra details if they are new. Returns a Result whose value is the Booking.
+@timed("book")
+def create_booking(db: Session, flight_id: int, flight_class: FlightClass, email: str,
+                   first_name: str = None, last_name: str = None, phone: str = None,
+                   passport_number: str = None, date_of_birth=None, seat_number: str = None):
+    passenger = find_passenger(db, email)
+    if passenger is None:
+        result = create_passenger(db, first_name, last_name, email, phone, passport_number,
+                                  date_of_birth, commit=False)
+        if not result.ok:
+            return result
+        passenger = result.value
+
+    booking = book_seat(db, flight_id, passenger.id, flight_class, seat_number)
+    if booking is not None:
+        return Result(True, "booked", "Booking successful!", booking)
+    return booking_failure(db, flight_id, flight_class, seat_number)
+
+# Why a booking could not be made, as a failed Result. Only the failure path
+# pays for the extra read.
+def booking_failure(db: Session, flight_id: int, flight_class: FlightClass, seat_number: str = None):
+    flight = db.get(Flight, flight_id)
+    if flight is None:
+        return Result(False, "not_found", "Flight not found.")
+    if flight.status not in BOOKABLE_STATUSES:
+        return Result(False, "not_bookable", f"This flight is {flight.status.value.lower()}.")
+    if flight.available_seats <= 0:
+        return Result(False, "sold_out", "No available seats on this flight.")
+    if seat_number:
+        return Result(False, "seat_unavailable", f"Seat {seat_number} is not available in {flight_class.value}.")
+    return Result(False, "sold_out", f"No {flight_class.value} seats left on this flight.")
+
+# Put the passenger with this email on the waitlist of a full cabin,
+# creating the passenger from the extra details if they are new, like
+# create_booking. Higher loyalty tiers go ahead of lower ones, and within a
+# tier the earliest request goes first. Returns a Result whose value is the
+# WaitlistEntry.
+@timed("join_waitlist")
+def join_waitlist(db: Session, flight_id: int, flight_class: FlightClass, email: str,
+                  first_name: str = None, last_name: str = None, phone: str = None,
+                  passport_number: str = None, date_of_birth=None, loyalty_tier: int = 0):
+    if loyalty_tier < 0:
+        return Result(False, "invalid", "Loyalty tier cannot be negative.")
+
+    passenger = find_passenger(db, email)
+    if passenger is None:
+        result = create_passenger(db, first_name, last_name, email, phone, passport_number,
+                                  date_of_birth, commit=False)
+        if not result.ok:
+            return result
+        passenger = result.value
+
+    entry = WaitlistEntry(flight_id=flight_id, passenger_id=passenger.id, flight_class=flight_class,
+                          loyalty_tier=loyalty_tier)
+    try:
+        # Insert first: the write lock is then held while the cabin is
+        # checked, so no cancellation can free a seat in between
+        db.add(entry)
+        db.flush()
+        flight = db.get(Flight, flight_id, populate_existing=True)
+        if flight is None or flight.status not in BOOKABLE_STATUSES:
+            db.rollback()
+            return booking_failure(db, flight_id, flight_class)
+        if flight.available_seats > 0 and free_seats(get_seat_map(db, flight_id), flight_class) > 0:
+            db.rollback()
+            return Result(False, "available", f"{flight_class.value} seats are still available; book one instead.")
+        queued = (flight_id, flight_class, entry.loyalty_tier, entry.requested_at, entry.id)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return Result(False, "duplicate", "This passenger is already on the waitlist for this flight.")
+    except Exception:
+        db.rollback()
+        raise
+
+    waitlist.add(*queued)
+    return Result(True, "waitlisted", "Added to the waitlist. You will be booked automatically "
+                                      "if a seat becomes free.", entry)
+
+# Details a group booking needs for each passenger; existing passengers are
+# matched on email and only need that
+PASSENGER_FIELDS = ("first_name", "last_name", "email", "phone", "passport_number", "date_of_birth")
+
+# What a group booking returns for each passenger
+GROUP_BOOKING_COLUMNS = (
+    Booking.id,
+    Booking.booking_reference,
+    Booking.passenger_id,
+    Booking.seat_number,
+)
+
+# Book the same flight and class for a whole group in one transaction: one
+# SELECT resolves every email, one INSERT adds the new passengers, one
+# conditional UPDATE takes all the seats and one INSERT adds the bookings.
+# Either everyone is booked or nobody is. `passengers` is a list of dicts
+# with the keys of PASSENGER_FIELDS. Returns a Result whose value is a list
+# of GROUP_BOOKING_COLUMNS rows, in the order the passengers were given.
+@timed("book_group")
+def book_group(db: Session, flight_id: int, flight_class: FlightClass, passengers):
+    emails = [p["email"] for p in passengers]
+    if not emails:
+        return Result(False, "invalid", "A group booking needs at least one passenger.")
+    if len(set(emails)) != len(emails):
+        return Result(False, "invalid", "Each passenger in a group needs their own email.")
+
+    try:
+        ids = dict(db.execute(select(Passenger.email, Passenger.id).where(Passenger.email.in_(emails))).all())
+        new = [{field: p.get(field) for field in PASSENGER_FIELDS} for p in passengers if p["email"] not in ids]
+        for p in new:
+            if not (p["first_name"] and p["last_name"] and p["phone"] and p["passport_number"]
+                    and p["date_of_birth"]):
+                return Result(False, "invalid", f"Name, phone, passport number and date of birth are required "
+                                                f"for new passenger {p['email']}.")
+
+        flight = reserve_seat(db, flight_id, len(emails))
+        if flight is None:
+            db.rollback()
+            return group_failure(db, flight_id, flight_class, len(emails))
+
+        seat_numbers = allocate_seats(db, flight_id, flight_class, len(emails))
+        if seat_numbers is None:
+            db.rollback()
+            return Result(False, "sold_out", f"Not enough {flight_class.value} seats left "
+                                             f"for {len(emails)} passengers.")
+
+        # Multi-row VALUES keeps each INSERT to one statement; rows are
+        # matched back by their unique keys, not by RETURNING order
+        if new:
+            ids.update(db.execute(insert(Passenger).values(new).returning(Passenger.email, Passenger.id)).all())
+
+        rows = [
+            {
+                "booking_reference": generate_booking_reference(),
+                "flight_id": flight_id,
+                "passenger_id": ids[email],
+                "seat_number": seat_number,
+                "flight_class": flight_class,
+            }
+            for email, seat_number in zip(emails, seat_numbers)
+        ]
+        inserted = {row.booking_reference: row for row in
+                    db.execute(insert(Booking).values(rows).returning(*GROUP_BOOKING_COLUMNS))}
+        bookings = [inserted[row["booking_reference"]] for row in rows]
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        return integrity_failure(e, "A new passenger's email or passport number is already registered.")
+    except Exception:
+        db.rollback()
+        raise
+
+    flight_changed(flight)
+    return Result(True, "booked", f"{len(bookings)} seats booked.", bookings)
+
+def group_failure(db: Session, flight_id: int, flight_class: FlightClass, count: int):
+    flight = db.get(Flight, flight_id)
+    if flight is not None and flight.status in BOOKABLE_STATUSES and flight.available_seats > 0:
+        return Result(False, "sold_out", f"Only {flight.available_seats} seats left on this flight.")
+    return booking_failure(db, flight_id, flight_class)
+
+@timed("cancel")
+def cancel_reservation(db: Session, booking_reference: str):
+    if cancel_seat(db, booking_reference):
+        return Result(True, "cancelled", "Booking has been cancelled successfully.")
+    return cancel_failure(db, booking_reference)
+
+def cancel_failure(db: Session, booking_reference: str):
+    booking = db.query(Booking.is_cancelled).filter(Booking.booking_reference == booking_reference).first()
+    if booking is None:
+        archived = db.query(ArchivedBooking.id).filter(ArchivedBooking.booking_reference == booking_reference)
+        if archived.first():
+            return Result(False, "archived", "This booking is for a completed flight and can no longer be changed.")
+        return Result(False, "not_found", "Booking not found.")
+    return Result(False, "already_cancelled", "This booking is already cancelled.")
@@ -0,0 +1,48 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+# The modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import create_sqlite_engine, create_schema  # noqa: E402
+from seed_demo import seed_scale  # noqa: E402
+
+# Size of the seeded database shared by the query tests: enough rows that
+# SQLite's statistics make it pick the same plans as on the real tiers
+SEED_FLIGHTS = 2_000
+SEED_PASSENGERS = 5_000
+SEED_BOOKINGS = 20_000
+SEED_NOW = datetime(2026, 1, 1)
+
+
+# A fresh, empty database file with the full schema
+@pytest.fixture
+def db_url(tmp_path):
+    url = f"sqlite:///{tmp_path / 'flights.db'}"
+    engine = create_sqlite_engine(url)
+    create_schema(engine)
+    engine.dispose()
+    return url
+
+@pytest.fixture
+def engine(db_url):
+    engine = create_sqlite_engine(db_url)
+    yield engine
+    engine.dispose()
+
+# A seeded, analyzed database built once per test session. Tests that write
+# to it must leave the flights and bookings they query for others alone.
+@pytest.fixture(scope="session")
+def seeded_db_url(tmp_path_factory):
+    url = f"sqlite:///{tmp_path_factory.mktemp('seeded') / 'flights.db'}"
+    seed_scale(url, SEED_FLIGHTS, SEED_PASSENGERS, SEED_BOOKINGS, now=SEED_NOW)
+    return url
+
+@pytest.fixture(scope="session")
+def seeded_engine(seeded_db_url):
+    engine = create_sqlite_engine(seeded_db_url)
+    yield engine
+    engine.dispose()
@@ -0,0 +1,39 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from fare_calendar import fare_calendar_month
+from flight_status import delay_flights
+from itineraries import RouteGraph
+from models import FlightClass, FlightStatus
+from services import create_flight, create_passenger, book_seat, flights_page
+
+DEPARTURE = (datetime.now() + timedelta(days=30)).replace(hour=9, minute=0, second=0, microsecond=0)
+DELAY = timedelta(minutes=90)
+
+
+# A delayed flight stays on sale: it can be booked, is listed as bookable and
+# counts in the fare calendar, and the route graph moves it to its new times
+def test_delayed_flight_stays_on_sale(engine):
+    with Session(engine, expire_on_commit=False) as db:
+        flight = create_flight(db, "TS300", "Test Air", "DEL", "BOM", DEPARTURE, DEPARTURE + timedelta(hours=2),
+                               100, 4999.0).value
+        passenger = create_passenger(db, "Test", "Passenger", "test@example.com", "9000000000", "P000000001",
+                                     date(1990, 1, 1)).value
+        graph = RouteGraph().load(db)
+        result = delay_flights(db, [flight.id], int(DELAY.total_seconds() // 60))
+        graph.apply(result.value[0])
+
+        booking = book_seat(db, flight.id, passenger.id, FlightClass.ECONOMY)
+        db.refresh(flight)
+        flights, _ = flights_page(db, bookable=True)
+        calendar = fare_calendar_month(db, "DEL", "BOM", DEPARTURE.year, DEPARTURE.month)
+
+    assert flight.status == FlightStatus.DELAYED
+    assert booking is not None
+    assert flight.available_seats == 99
+    assert [f.id for f in flights] == [flight.id]
+    assert [(day.flights, day.seats) for day in calendar] == [(1, 99)]
+    itinerary = graph.search("DEL", "BOM", DEPARTURE.date())
+    assert (itinerary.departure_time, itinerary.arrival_time) == (DEPARTURE + DELAY,
+                                                                  DEPARTURE + DELAY + timedelta(hours=2))
@@ -0,0 +1,49 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from models import Flight, Passenger, Booking, SeatMap, FlightClass
+from services import create_flight, create_passenger, book_seat, book_group
+
+DEPARTURE = datetime.now().replace(microsecond=0) + timedelta(days=7)
+
+
+def new_passenger(n, passport_number=None):
+    return {"first_name": "Group", "last_name": f"Member{n}", "email": f"group{n}@example.com",
+            "phone": f"91000000{n:02d}", "passport_number": passport_number or f"G{n:09d}",
+            "date_of_birth": date(1990, 1, 1)}
+
+# A 100-seat flight (5 First Class seats) with one First Class seat taken by
+# an existing passenger
+def booked_flight(db):
+    flight = create_flight(db, "TS500", "Test Air", "DEL", "BOM", DEPARTURE, DEPARTURE + timedelta(hours=2),
+                           100, 4999.0).value
+    existing = create_passenger(db, "Test", "Passenger", "test@example.com", "9000000000", "P000000001",
+                                date(1990, 1, 1)).value
+    book_seat(db, flight.id, existing.id, FlightClass.FIRST)
+    return flight.id, existing
+
+# Everything a group booking writes to
+def snapshot(db, flight_id):
+    db.expire_all()
+    return (db.query(Booking).count(), db.query(Passenger).count(), db.get(Flight, flight_id).available_seats,
+            db.query(SeatMap.occupied).filter(SeatMap.flight_id == flight_id).scalar())
+
+
+def test_group_larger_than_the_cabin_books_nobody(engine):
+    with Session(engine) as db:
+        flight_id, existing = booked_flight(db)
+        before = snapshot(db, flight_id)
+        group = [{"email": existing.email}] + [new_passenger(n) for n in range(1, 5)]
+        result = book_group(db, flight_id, FlightClass.FIRST, group)
+        assert (result.ok, result.status) == (False, "sold_out")
+        assert snapshot(db, flight_id) == before
+
+def test_duplicate_passport_rolls_back_the_whole_group(engine):
+    with Session(engine) as db:
+        flight_id, existing = booked_flight(db)
+        before = snapshot(db, flight_id)
+        group = [new_passenger(1), new_passenger(2, passport_number=existing.passport_number), new_passenger(3)]
+        result = book_group(db, flight_id, FlightClass.ECONOMY, group)
+        assert (result.ok, result.status) == (False, "duplicate")
+        assert snapshot(db, flight_id) == before
@@ -0,0 +1,73 @@
+import csv
+from datetime import date, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from importers import FLIGHT_FIELDS, PASSENGER_COLUMNS, import_flights, import_passengers
+from models import Flight, Passenger, Booking, SeatMap, FlightClass
+from seat_map import CABIN_ORDER, free_seats
+from services import create_flight, create_passenger, book_seat
+
+DEPARTURE = datetime.now().replace(microsecond=0) + timedelta(days=7)
+
+
+# A 100-seat flight with 4 Business and 10 Economy bookings
+def booked_flight(engine):
+    with Session(engine) as db:
+        flight = create_flight(db, "TS200", "Test Air", "DEL", "BOM", DEPARTURE, DEPARTURE + timedelta(hours=2),
+                               100, 4999.0).value
+        passenger = create_passenger(db, "Test", "Passenger", "test@example.com", "9000000000", "P000000001",
+                                     date(1990, 1, 1)).value
+        for flight_class, count in ((FlightClass.BUSINESS, 4), (FlightClass.ECONOMY, 10)):
+            for _ in range(count):
+                book_seat(db, flight.id, passenger.id, flight_class)
+        return flight.id
+
+def import_capacity(tmp_path, db_url, total_seats):
+    path = tmp_path / "schedule.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FLIGHT_FIELDS)
+        writer.writeheader()
+        writer.writerow({"flight_number": "TS200", "airline": "Test Air", "departure_airport": "DEL",
+                         "arrival_airport": "BOM", "departure_time": DEPARTURE.isoformat(),
+                         "arrival_time": (DEPARTURE + timedelta(hours=2)).isoformat(),
+                         "total_seats": total_seats, "price": 4999.0})
+    return import_flights(str(path), db_url=db_url)
+
+
+# 20 seats hold the 14 bookings in total, but only 3 of them are Business
+def test_resize_below_a_cabin_is_rejected(tmp_path, db_url, engine):
+    flight_id = booked_flight(engine)
+    report = import_capacity(tmp_path, db_url, 20)
+    assert (report.updated, report.rejected) == (0, 1)
+    assert report.reasons == {"cabin below its active bookings": 1}
+    with Session(engine) as db:
+        assert db.get(Flight, flight_id).total_seats == 100
+
+def test_resize_rebuilds_the_seat_map(tmp_path, db_url, engine):
+    flight_id = booked_flight(engine)
+    report = import_capacity(tmp_path, db_url, 30)
+    assert (report.updated, report.rejected) == (1, 0)
+    with Session(engine) as db:
+        flight = db.get(Flight, flight_id)
+        seat_map = db.query(SeatMap).filter(SeatMap.flight_id == flight_id).one()
+        seats = [seat for (seat,) in db.query(Booking.seat_number).filter(Booking.flight_id == flight_id)]
+    assert (flight.total_seats, flight.available_seats) == (30, 16)
+    assert sum(free_seats(seat_map, cls) for cls in CABIN_ORDER) == flight.available_seats
+    assert len(set(seats)) == 14
+
+
+# The services refuse a passenger without a phone, so the import does too
+def test_passenger_without_phone_is_rejected(tmp_path, db_url, engine):
+    path = tmp_path / "passengers.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=PASSENGER_COLUMNS)
+        writer.writeheader()
+        for n, phone in ((1, "9000000001"), (2, "")):
+            writer.writerow({"first_name": "Test", "last_name": f"Passenger{n}", "email": f"p{n}@example.com",
+                             "phone": phone, "passport_number": f"P00000000{n}", "date_of_birth": "1990-01-01"})
+    report = import_passengers(str(path), db_url=db_url)
+    assert (report.inserted, report.rejected) == (1, 1)
+    assert report.reasons == {"missing phone": 1}
+    with Session(engine) as db:
+        assert [p.email for p in db.query(Passenger)] == ["p1@example.com"]
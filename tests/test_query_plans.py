@@ -0,0 +1,147 @@
+import re
+
+import pytest
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session
+
+from models import Flight, Passenger, Booking, SeatMap, FlightClass, FlightStatus
+from services import (find_flights, search_flight_rows, flights_page, bookings_page, iter_booking_rows,
+                      find_booking, book_seat, cancel_reservation)
+from search_cache import flight_search_cache
+from seat_map import get_seat_map
+from flight_status import delay_flights, cancel_flights
+from reports import ACTIVE_COUNTS_SQL
+
+# A plan step reading a whole table row by row. Scans of an index
+# ("SCAN bookings USING COVERING INDEX ...") do not match.
+TABLE_SCAN = re.compile(r"^SCAN (flights|bookings)\w*$")
+
+ACTIVE_INDEX = "ix_bookings_active_flight"
+
+
+# Run `work` in a session and return (statement, plan steps) for every
+# statement it sent, with the parameters it sent them with
+def query_plans(engine, work):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    flight_search_cache.clear()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        with Session(engine, autoflush=False, expire_on_commit=False) as db:
+            work(db)
+            db.rollback()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    plans = []
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            steps = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            plans.append((statement, [step.detail for step in steps]))
+    return plans
+
+def assert_no_table_scans(plans):
+    for statement, steps in plans:
+        scans = [step for step in steps if TABLE_SCAN.match(step)]
+        assert not scans, f"{scans} in the plan of:\n{statement}\n{steps}"
+
+def assert_uses_index(plans, index):
+    steps = [step for _, step_list in plans for step in step_list]
+    assert any(index in step for step in steps), f"{index} not used:\n{steps}"
+
+
+# Inputs drawn from the seeded data: an upcoming scheduled flight with
+# bookings, one of its bookings and that booking's passenger. Separate flights
+# are set aside for the tests that delay and cancel.
+@pytest.fixture(scope="module")
+def sample(seeded_engine):
+    with Session(seeded_engine) as db:
+        flights = db.execute(
+            select(Flight.id).where(Flight.status == FlightStatus.SCHEDULED,
+                                    Flight.available_seats < Flight.total_seats)
+            .order_by(Flight.id).limit(4)
+        ).scalars().all()
+        booking = db.execute(
+            select(Booking.booking_reference, Passenger.email)
+            .join(Passenger, Passenger.id == Booking.passenger_id)
+            .where(Booking.flight_id == flights[0], Booking.is_cancelled == False)  # noqa: E712
+            .limit(1)
+        ).one()
+        flight = db.get(Flight, flights[0])
+        return {
+            "flight": flight,
+            "reference": booking.booking_reference,
+            "email": booking.email,
+            "delay_flight": flights[1],
+            "cancel_flight": flights[2],
+            "backfill_flight": flights[3],
+        }
+
+
+HOT_QUERIES = {
+    "search_route_date": lambda db, s: find_flights(db, s["flight"].departure_airport, s["flight"].arrival_airport,
+                                                    s["flight"].departure_time).all(),
+    "search_route_date_rows": lambda db, s: search_flight_rows(db, s["flight"].departure_airport,
+                                                               s["flight"].arrival_airport,
+                                                               s["flight"].departure_time),
+    "search_date": lambda db, s: find_flights(db, day=s["flight"].departure_time).all(),
+    "flights_page": lambda db, s: flights_page(db, after=(s["flight"].departure_time, s["flight"].id)),
+    "flights_page_bookable": lambda db, s: flights_page(db, bookable=True),
+    "flights_page_bookable_after": lambda db, s: flights_page(db, after=(s["flight"].departure_time,
+                                                                          s["flight"].id), bookable=True),
+    "bookings_page_reference": lambda db, s: bookings_page(db, s["reference"]),
+    "bookings_page_email": lambda db, s: bookings_page(db, s["email"]),
+    "bookings_page_after": lambda db, s: bookings_page(db, after=(s["flight"].departure_time, 0)),
+    "iter_booking_rows_email": lambda db, s: list(iter_booking_rows(db, s["email"])),
+    "find_booking": lambda db, s: find_booking(db, s["reference"]),
+}
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_query_has_no_table_scan(seeded_engine, sample, name):
+    plans = query_plans(seeded_engine, lambda db: HOT_QUERIES[name](db, sample))
+    assert plans
+    assert_no_table_scans(plans)
+
+def test_route_search_uses_route_index(seeded_engine, sample):
+    flight = sample["flight"]
+    plans = query_plans(seeded_engine, lambda db: find_flights(db, flight.departure_airport, flight.arrival_airport,
+                                                               flight.departure_time).all())
+    assert_uses_index(plans, "ix_flights_route_departure")
+
+def test_book_and_cancel_have_no_table_scan(seeded_engine, sample):
+    def book_and_cancel(db):
+        booking = book_seat(db, sample["flight"].id, 1, FlightClass.ECONOMY)
+        if booking is not None:
+            cancel_reservation(db, booking.booking_reference)
+
+    assert_no_table_scans(query_plans(seeded_engine, book_and_cancel))
+
+
+# The lookups of active bookings per flight go through the partial index
+
+def test_seat_map_backfill_uses_active_index(seeded_engine, sample):
+    flight_id = sample["backfill_flight"]
+    with Session(seeded_engine) as db:
+        db.query(SeatMap).filter(SeatMap.flight_id == flight_id).delete()
+        db.commit()
+    plans = query_plans(seeded_engine, lambda db: get_seat_map(db, flight_id))
+    assert_no_table_scans(plans)
+    assert_uses_index(plans, ACTIVE_INDEX)
+
+def test_delay_flights_uses_active_index(seeded_engine, sample):
+    plans = query_plans(seeded_engine, lambda db: delay_flights(db, [sample["delay_flight"]], 30))
+    assert_no_table_scans(plans)
+    assert_uses_index(plans, ACTIVE_INDEX)
+
+def test_cancel_flights_uses_active_index(seeded_engine, sample):
+    plans = query_plans(seeded_engine, lambda db: cancel_flights(db, [sample["cancel_flight"]]))
+    assert_no_table_scans(plans)
+    assert_uses_index(plans, ACTIVE_INDEX)
+
+def test_active_counts_read_only_the_active_index(seeded_engine):
+    plans = query_plans(seeded_engine, lambda db: db.execute(text(ACTIVE_COUNTS_SQL)).all())
+    assert_no_table_scans(plans)
+    assert_uses_index(plans, ACTIVE_INDEX)
@@ -0,0 +1,37 @@
+import multiprocessing
+import os
+import signal
+import threading
+
+from batch import replay
+
+OPERATIONS = 20_000
+
+
+# A stream that kills one replay worker once the replay is under way, then
+# keeps going, so the feed would block on a full queue if nothing noticed
+def operations_killing_a_worker(killed):
+    for i in range(OPERATIONS):
+        if i == 1_000:
+            worker = multiprocessing.active_children()[0]
+            os.kill(worker.pid, signal.SIGKILL)
+            worker.join()
+            killed.set()
+        yield '{"op": "search", "departure": "DEL", "arrival": "BOM"}\n'
+
+
+def test_replay_reports_a_dead_worker(db_url):
+    killed = threading.Event()
+    reports = []
+    thread = threading.Thread(target=lambda: reports.append(replay(operations_killing_a_worker(killed), db_url, 2)),
+                              daemon=True)
+    thread.start()
+    thread.join(timeout=120)
+
+    assert not thread.is_alive(), "replay is still waiting on a dead worker"
+    assert killed.is_set()
+    report = reports[0]
+    assert report.lost_workers == 1
+    assert report.operations < OPERATIONS
+    assert report.errors["count"] >= 1
+    assert "workers died" in report.errors["examples"][0]
@@ -0,0 +1,36 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import Session
+
+from models import FlightClass
+from search_cache import flight_search_cache
+from services import create_flight, create_passenger, book_seat, search_flight_rows
+
+DEPARTURE = datetime.now().replace(microsecond=0) + timedelta(days=7)
+
+SEARCHES = {
+    "route_and_date": ("DEL", "BOM", DEPARTURE.date()),
+    "route": ("DEL", "BOM", None),
+    "date": (None, None, DEPARTURE.date()),
+}
+
+
+# The booking that sells a flight out evicts every cached search it appears
+# in, so this process never shows it as available again
+@pytest.mark.parametrize("name", SEARCHES)
+def test_selling_out_evicts_cached_searches(engine, name):
+    flight_search_cache.clear()
+    with Session(engine) as db:
+        flight = create_flight(db, "TS600", "Test Air", "DEL", "BOM", DEPARTURE, DEPARTURE + timedelta(hours=2),
+                               1, 4999.0).value
+        passenger = create_passenger(db, "Test", "Passenger", "test@example.com", "9000000000", "P000000001",
+                                     date(1990, 1, 1)).value
+
+        assert [row.available_seats for row in search_flight_rows(db, *SEARCHES[name])] == [1]
+        hits = flight_search_cache.hits
+        search_flight_rows(db, *SEARCHES[name])
+        assert flight_search_cache.hits == hits + 1
+
+        assert book_seat(db, flight.id, passenger.id, FlightClass.ECONOMY) is not None
+        assert [row.available_seats for row in search_flight_rows(db, *SEARCHES[name])] == [0]
@@ -0,0 +1,81 @@
+import multiprocessing
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from database import create_sqlite_engine
+from models import Flight, Booking, FlightClass
+from services import create_flight, create_passenger, book_seat
+
+WORKERS = 4
+CAPACITY = 180
+
+
+# Worker process: book seats on the flight, cycling through the cabins, until
+# every cabin turns it away. Reports "ready" once started, then sends back
+# the references it got.
+def _book_until_sold_out(db_url, flight_id, passenger_id, start, results):
+    engine = create_sqlite_engine(db_url)
+    references = []
+    full = set()
+    results.put("ready")
+    start.wait()
+    try:
+        with Session(engine) as db:
+            while len(full) < len(FlightClass):
+                for flight_class in FlightClass:
+                    if flight_class in full:
+                        continue
+                    booking = book_seat(db, flight_id, passenger_id, flight_class)
+                    if booking is None:
+                        full.add(flight_class)
+                    else:
+                        references.append(booking.booking_reference)
+    finally:
+        engine.dispose()
+        results.put(references)
+
+
+def test_concurrent_bookings_never_oversell(db_url, engine, record_property):
+    departure = datetime.now() + timedelta(days=7)
+    with Session(engine) as db:
+        flight = create_flight(db, "TS100", "Test Air", "DEL", "BOM", departure, departure + timedelta(hours=2),
+                               CAPACITY, 4999.0).value
+        passenger = create_passenger(db, "Test", "Passenger", "test@example.com", "9000000000", "P000000001",
+                                     date(1990, 1, 1)).value
+        flight_id, passenger_id = flight.id, passenger.id
+
+    context = multiprocessing.get_context("spawn")
+    start = context.Event()
+    results = context.Queue()
+    processes = [context.Process(target=_book_until_sold_out,
+                                 args=(db_url, flight_id, passenger_id, start, results))
+                 for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        assert results.get(timeout=120) == "ready"
+    started = time.perf_counter()
+    start.set()
+    references = [reference for _ in processes for reference in results.get(timeout=120)]
+    seconds = time.perf_counter() - started
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+
+    with Session(engine) as db:
+        flight = db.get(Flight, flight_id)
+        seats = [seat for (seat,) in db.query(Booking.seat_number).filter(Booking.flight_id == flight_id,
+                                                                          Booking.is_cancelled == False)]  # noqa: E712
+
+    rate = len(references) / seconds
+    record_property("bookings_per_second", round(rate))
+    print(f"{len(references)} bookings from {WORKERS} processes in {seconds:.2f}s ({rate:,.0f} bookings/s)")
+
+    assert len(references) == CAPACITY
+    assert len(set(references)) == CAPACITY
+    assert flight.available_seats == 0
+    assert len(seats) == CAPACITY
+    assert [seat for seat, count in Counter(seats).items() if count > 1] == []
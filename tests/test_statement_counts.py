@@ -0,0 +1,65 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from benchmark import StatementCounter
+from models import Flight, Passenger, Booking, FlightClass, FlightStatus
+from services import bookings_page, booking_rows, find_bookings, find_booking
+
+EMAIL = "frequent@example.com"
+
+
+# One passenger with `count` bookings, each on its own flight, so nothing
+# can be shared between rows by the identity map
+def add_bookings(engine, count):
+    departure = datetime(2026, 6, 1, 9, 0)
+    with engine.begin() as conn:
+        conn.execute(insert(Passenger), [{"id": 1, "first_name": "Asha", "last_name": "Rao", "email": EMAIL,
+                                          "phone": "9000000000", "passport_number": "P000000001",
+                                          "date_of_birth": date(1990, 1, 1)}])
+        conn.execute(insert(Flight), [
+            {"id": i, "flight_number": f"TS{i}", "airline": "Test Air", "departure_airport": "DEL",
+             "arrival_airport": "BOM", "departure_time": departure + timedelta(hours=i),
+             "arrival_time": departure + timedelta(hours=i + 2), "total_seats": 120, "available_seats": 119,
+             "price": 4999.0, "status": FlightStatus.SCHEDULED}
+            for i in range(1, count + 1)
+        ])
+        conn.execute(insert(Booking), [
+            {"id": i, "booking_reference": f"REF{i:05d}", "flight_id": i, "passenger_id": 1, "seat_number": "E1",
+             "flight_class": FlightClass.ECONOMY, "booking_date": departure - timedelta(days=30, hours=i),
+             "is_cancelled": False}
+            for i in range(1, count + 1)
+        ])
+
+# Statements sent while `work` runs in a fresh session
+def statements(engine, work):
+    counter = StatementCounter(engine)
+    with Session(engine) as db:
+        before = counter.count
+        work(db)
+        return counter.count - before
+
+def read_rows(rows):
+    return [(row.booking_reference, row.first_name, row.flight_number) for row in rows]
+
+def read_bookings(bookings):
+    return [(b.booking_reference, b.passenger.first_name, b.flight.flight_number) for b in bookings]
+
+# Listings and lookups, with the number of statements each may send
+# whatever the number of bookings
+LISTINGS = {
+    "bookings_page": (lambda db, n: read_rows(bookings_page(db, EMAIL, limit=n)[0]), 2),
+    "bookings_page_hot_only": (lambda db, n: read_rows(bookings_page(db, EMAIL, limit=n, archived=False)[0]), 1),
+    "booking_rows": (lambda db, n: read_rows(booking_rows(db, EMAIL).all()), 1),
+    "find_bookings": (lambda db, n: read_bookings(find_bookings(db, EMAIL).all()), 1),
+    "find_booking": (lambda db, n: read_bookings([find_booking(db, f"REF{n:05d}")]), 1),
+}
+
+@pytest.mark.parametrize("count", [5, 100])
+@pytest.mark.parametrize("name", LISTINGS)
+def test_statements_do_not_grow_with_bookings(engine, name, count):
+    add_bookings(engine, count)
+    work, expected = LISTINGS[name]
+    assert statements(engine, lambda db: work(db, count)) == expected
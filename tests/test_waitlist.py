@@ -0,0 +1,63 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from models import Booking, WaitlistEntry, FlightClass
+from services import create_flight, create_passenger, book_seat, join_waitlist, cancel_seat
+from waitlist import waitlist
+
+DEPARTURE = datetime.now().replace(microsecond=0) + timedelta(days=7)
+
+
+def passenger(db, n):
+    return create_passenger(db, "Test", f"Passenger{n}", f"p{n}@example.com", f"90000000{n:02d}", f"P{n:09d}",
+                            date(1990, 1, 1)).value
+
+def first_class_holder(db, flight_id):
+    booking = (db.query(Booking).filter(Booking.flight_id == flight_id, Booking.flight_class == FlightClass.FIRST,
+                                        Booking.is_cancelled == False)  # noqa: E712
+               .one())
+    return booking.passenger.email, booking.booking_reference
+
+# What another process does when its passenger joins the waitlist: the row
+# is committed, but this process's mirror never hears of it
+def join_elsewhere(engine, flight_id, passenger_id, loyalty_tier):
+    with Session(engine) as other:
+        other.add(WaitlistEntry(flight_id=flight_id, passenger_id=passenger_id, flight_class=FlightClass.FIRST,
+                                loyalty_tier=loyalty_tier))
+        other.commit()
+
+
+# A 20-seat flight has a single First Class seat, so every cancellation of it
+# frees the cabin's only seat and promotes the head of the queue
+def test_cancel_promotes_in_queue_order_including_other_sessions(engine):
+    waitlist.clear()
+    with Session(engine, expire_on_commit=False) as db:
+        flight = create_flight(db, "TS400", "Test Air", "DEL", "BOM", DEPARTURE, DEPARTURE + timedelta(hours=2),
+                               20, 4999.0).value
+        people = [passenger(db, n) for n in range(1, 6)]
+        booking = book_seat(db, flight.id, people[0].id, FlightClass.FIRST)
+        assert join_waitlist(db, flight.id, FlightClass.FIRST, people[1].email).status == "waitlisted"
+
+        # Promotion loads the queue into the mirror, which is then empty
+        assert cancel_seat(db, booking.booking_reference)
+        email, reference = first_class_holder(db, flight.id)
+        assert email == people[1].email
+
+        # Entries the mirror has never seen, the later one on a higher tier
+        join_elsewhere(engine, flight.id, people[2].id, 0)
+        join_elsewhere(engine, flight.id, people[3].id, 2)
+        assert cancel_seat(db, reference)
+        email, reference = first_class_holder(db, flight.id)
+        assert email == people[3].email
+
+        # The mirror now holds people[2]; a higher tier added elsewhere still goes first
+        join_elsewhere(engine, flight.id, people[4].id, 5)
+        assert cancel_seat(db, reference)
+        email, reference = first_class_holder(db, flight.id)
+        assert email == people[4].email
+
+        assert cancel_seat(db, reference)
+        email, _ = first_class_holder(db, flight.id)
+        assert email == people[2].email
+        assert db.query(WaitlistEntry).count() == 0
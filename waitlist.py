@@ -0,0 +1,109 @@
+import heapq
+import threading
+import time
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import WaitlistEntry
+
+# Queues are re-read from the table after this long, which bounds how far a
+# process's mirror can fall behind entries added by other processes
+MIRROR_TTL = 30.0
+
+# Promotion order within one cabin's queue, as laid out in ix_waitlist_queue
+QUEUE_ORDER = (WaitlistEntry.loyalty_tier.desc(), WaitlistEntry.requested_at, WaitlistEntry.id)
+
+
+def _item(loyalty_tier, requested_at, entry_id):
+    return (-loyalty_tier, requested_at, entry_id)
+
+
+# In-memory mirror of the waitlist table: one binary heap per (flight, cabin)
+# queue, loaded on first use with one read of ix_waitlist_queue (rows come
+# back in queue order, which is already a valid heap). After that, taking
+# the head and adding an entry are O(log n), so a burst of cancellations on
+# a long waitlist never reads the queue again. The table stays the source of
+# truth: take() checks the mirror's head against the table's, and the caller
+# deletes the entry it took with a conditional DELETE and skips it if it is
+# already gone. Entries taken in a transaction that rolls back are put back.
+class WaitlistMirror:
+    def __init__(self, ttl=MIRROR_TTL):
+        self.ttl = ttl
+        self._queues = {}   # (flight_id, flight_class) -> [heap, loaded at]
+        self._lock = threading.Lock()
+
+    def _queue(self, db: Session, flight_id, flight_class, reload=False):
+        key = (flight_id, flight_class)
+        with self._lock:
+            queue = self._queues.get(key)
+            if not reload and queue is not None and time.monotonic() - queue[1] < self.ttl:
+                return queue
+        rows = db.execute(
+            select(WaitlistEntry.loyalty_tier, WaitlistEntry.requested_at, WaitlistEntry.id)
+            .where(WaitlistEntry.flight_id == flight_id, WaitlistEntry.flight_class == flight_class)
+            .order_by(*QUEUE_ORDER)
+        ).all()
+        queue = [[_item(*row) for row in rows], time.monotonic()]
+        with self._lock:
+            self._queues[key] = queue
+        return queue
+
+    # Pop the head of a cabin's queue within db's transaction. Returns the
+    # entry id, or None if nobody is waiting. The table's head is read first
+    # (one seek of ix_waitlist_queue); if the mirror's differs, entries were
+    # added or taken by another process since it was loaded, and the queue
+    # is re-read, so they are neither missed nor overtaken.
+    def take(self, db: Session, flight_id, flight_class):
+        head = db.execute(
+            select(WaitlistEntry.id)
+            .where(WaitlistEntry.flight_id == flight_id, WaitlistEntry.flight_class == flight_class)
+            .order_by(*QUEUE_ORDER).limit(1)
+        ).scalar()
+        if head is None:
+            return None
+        heap = self._queue(db, flight_id, flight_class)[0]
+        with self._lock:
+            stale = not heap or heap[0][2] != head
+        if stale:
+            heap = self._queue(db, flight_id, flight_class, reload=True)[0]
+        with self._lock:
+            if not heap:
+                return None
+            item = heapq.heappop(heap)
+        db.info.setdefault("waitlist_taken", []).append((flight_id, flight_class, item))
+        return item[2]
+
+    # Mirror an entry once its INSERT is committed
+    def add(self, flight_id, flight_class, loyalty_tier, requested_at, entry_id):
+        with self._lock:
+            queue = self._queues.get((flight_id, flight_class))
+            if queue is not None:
+                heapq.heappush(queue[0], _item(loyalty_tier, requested_at, entry_id))
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(queue[0]) for queue in self._queues.values())
+
+    def clear(self):
+        with self._lock:
+            self._queues.clear()
+
+    def _committed(self, session):
+        session.info.pop("waitlist_taken", None)
+
+    def _rolled_back(self, session):
+        taken = session.info.pop("waitlist_taken", None)
+        if not taken:
+            return
+        with self._lock:
+            for flight_id, flight_class, item in taken:
+                queue = self._queues.get((flight_id, flight_class))
+                if queue is not None:
+                    heapq.heappush(queue[0], item)
+
+
+# Process-wide mirror, shared by every session
+waitlist = WaitlistMirror()
+event.listen(Session, "after_commit", waitlist._committed)
+event.listen(Session, "after_rollback", waitlist._rolled_back)